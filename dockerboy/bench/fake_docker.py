@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+""" A scriptable stand-in for the `docker` CLI.
+
+Keeps containers and images in a JSON state file and answers the subset of
+the CLI that dockerboy uses (ps, images, build, run, exec, start, stop, kill,
+rm, rmi, commit, export | import, save, load, image/container inspect,
+container/image prune, system df, info, events) with output in the same format as the real thing,
+including `--label` and `--filter label=...`. A global `-H <url>` or
+`--context <name>` talks to another fake daemon, with a state file of its
+own next to the default one. Every
+invocation is appended to a JSONL log with its arguments, exit code and
+timing, and whatever it changed to an events log that `docker events` tails.
+
+    FAKE_DOCKER_STATE  state file (default: ./fake-docker.json)
+    FAKE_DOCKER_LOG    invocation log (default: ./fake-docker.log)
+    FAKE_DOCKER_EVENTS events log (default: <state file>.events)
+    FAKE_DOCKER_DELAY  seconds to sleep per call, to simulate a slow daemon
+    FAKE_DOCKER_NCPU   CPUs `docker info` reports (default: this machine's)
+
+Containers whose command starts with `sleep` (or is a shell loop around one,
+like the pool's idle watchdog) keep running, everything else
+exits 0 after printing its command line (or 1..N for `seq N`), which is
+also what `docker logs` returns for it; an exec of `false` exits 1. Builds
+follow the context's Dockerfile: a `FROM <name>-image` that doesn't exist
+yet or a `RUN false` fails. `regress.py` installs this as `docker` first on
+the PATH.
+"""
+import tarfile
+import hashlib
+import fcntl
+import json
+import re
+import time
+import sys
+import io
+import os
+
+
+STATE_FILE = os.environ.get("FAKE_DOCKER_STATE", "fake-docker.json")
+LOG_FILE = os.environ.get("FAKE_DOCKER_LOG", "fake-docker.log")
+EVENTS_FILE = os.environ.get("FAKE_DOCKER_EVENTS", f"{STATE_FILE}.events")
+
+# flags that take a value, everything else starting with "-" is a switch
+VALUE_FLAGS = {"-p", "--gpus", "--name", "-v", "-e", "-w", "-t", "--format",
+               "--change", "-m", "--filter", "--label", "-l", "--tail"}
+
+
+def _id(*parts) -> str:
+    return hashlib.sha256(repr((parts, time.time_ns())).encode()).hexdigest()
+
+
+def parse(args: list[str]) -> tuple[dict, list[str]]:
+    """ Split args into {flag: [values]} and positionals. Parsing stops at the
+    first positional after the flags, like docker's own `run IMAGE CMD...`.
+    """
+    flags, positional = {}, []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if positional or not arg.startswith("-") or arg == "-":
+            positional = args[i:]
+            break
+        if arg in VALUE_FLAGS:
+            flags.setdefault(arg, []).append(args[i + 1])
+            i += 2
+        else:
+            flags.setdefault(arg, []).append(True)
+            i += 1
+    return flags, positional
+
+
+def empty_state() -> dict:
+    # layers: digest -> bytes, shared between images
+    return {"containers": {}, "images": {}, "layers": {}}
+
+
+# image fields `docker images` doesn't print
+IMAGE_PRIVATE = {"Labels", "Layers", "Size"}
+
+
+def labels_from(values: list[str]) -> dict:
+    """ ["a=1", "b=2"] -> {"a": "1", "b": "2"} """
+    return dict(value.partition("=")[::2] for value in values)
+
+
+def labelled(obj: dict, flags: dict) -> bool:
+    for f in flags.get("--filter", []):
+        kind, _, label = f.partition("=")
+        key, has_value, value = label.partition("=")
+        if kind == "label" and (key not in obj["Labels"]
+                                or has_value and obj["Labels"][key] != value):
+            return False
+    return True
+
+
+def add_image(state: dict, ref: str, labels: dict = None, parent: dict = None,
+              size: int = 100 << 20) -> dict:
+    """ A new image on top of `parent`'s layers, adding one of `size` bytes. """
+    repository, _, tag = ref.partition(":")
+    layer = f"sha256:{_id('layer', ref)}"
+    state.setdefault("layers", {})[layer] = size
+    image = {"ID": _id("image", ref)[:12], "Repository": repository, "Tag": tag or "latest",
+             "Labels": labels or {}, "Layers": [*(parent or {}).get("Layers", []), layer],
+             "Size": size + (parent or {}).get("Size", 0)}
+    # a retagged ref moves to the new image
+    for other in state["images"].values():
+        if (other["Repository"], other["Tag"]) == (image["Repository"], image["Tag"]):
+            other["Repository"], other["Tag"] = "<none>", "<none>"
+    state["images"][image["ID"]] = image
+    return image
+
+
+def layer_content(digest: str) -> bytes:
+    """ Stands in for a layer's tar in `save` and `load`. """
+    return f"files of {digest}\n".encode() * 1000
+
+
+def chain_ids(diff_ids: list[str]) -> list[str]:
+    chains = []
+    for diff_id in diff_ids:
+        if chains:
+            diff_id = "sha256:" + hashlib.sha256(f"{chains[-1]} {diff_id}".encode()).hexdigest()
+        chains.append(diff_id)
+    return chains
+
+
+def fake_output(cmd: list[str]) -> list[str]:
+    if cmd[:1] == ["seq"] and len(cmd) == 2:
+        return [str(i) for i in range(1, int(cmd[1]) + 1)]
+    return [" ".join(cmd)]
+
+
+def add_container(state: dict, name: str, image: str, cmd: list[str], running: bool,
+                  labels: dict = None) -> dict:
+    container = {"ID": _id("container", name), "Names": name, "Image": image,
+                 "Labels": labels or {},
+                 "Command": " ".join(cmd), "CreatedAt": time.strftime("%Y-%m-%d %H:%M:%S"),
+                 "Ports": "", "State": "running" if running else "exited",
+                 "Status": "Up 1 second" if running else "Exited (0) 1 second ago",
+                 "Output": [] if running else fake_output(cmd)}
+    state["containers"][container["ID"]] = container
+    return container
+
+
+def find_image(state: dict, ref: str):
+    repository, _, tag = ref.partition(":")
+    for image in state["images"].values():
+        if ref == image["ID"] or (image["Repository"] == repository
+                                  and image["Tag"] == (tag or "latest")):
+            return image
+    return None
+
+
+def find_container(state: dict, name_or_id: str):
+    for container in state["containers"].values():
+        if name_or_id in (container["Names"], container["ID"]) or \
+                container["ID"].startswith(name_or_id):
+            return container
+    return None
+
+
+def change_labels(flags: dict) -> dict:
+    """ Labels from `--change 'LABEL key="value"'`, the only change understood. """
+    labels = {}
+    for change in flags.get("--change", []):
+        if change.startswith("LABEL "):
+            key, _, value = change[len("LABEL "):].partition("=")
+            labels[key] = json.loads(value)
+    return labels
+
+
+def fingerprint(state: dict) -> tuple[dict, dict]:
+    return ({c["ID"]: (c["State"], c["Names"], c["Labels"]) for c in state["containers"].values()},
+            {i["ID"]: (i["Repository"], i["Tag"]) for i in state["images"].values()})
+
+
+def changes(before: tuple[dict, dict], after: tuple[dict, dict]) -> list[dict]:
+    """ The events the daemon would have sent for going from `before` to `after`. """
+    now = time.time_ns()
+    events = []
+    for container_id in before[0].keys() | after[0].keys():
+        old, new = before[0].get(container_id), after[0].get(container_id)
+        if old != new:
+            state, name, labels = new or old
+            action = "destroy" if new is None else "start" if state == "running" else "die"
+            events.append({"Type": "container", "Action": action, "Actor": {
+                "ID": container_id, "Attributes": {**labels, "name": name}}})
+    for image_id in before[1].keys() | after[1].keys():
+        old, new = before[1].get(image_id), after[1].get(image_id)
+        if old != new:
+            action = "delete" if new is None else "untag" if new[0] == "<none>" else "tag"
+            events.append({"Type": "image", "Action": action, "Actor": {
+                "ID": image_id, "Attributes": {"name": ":".join(new or old)}}})
+    return [{**event, "time": now // 10**9, "timeNano": now} for event in events]
+
+
+def events(flags: dict) -> int:
+    """ `docker events`: follow the events log until our reader exits. """
+    if not os.path.exists(EVENTS_FILE):
+        open(EVENTS_FILE, "a").close()
+    types = {f.partition("=")[2] for f in flags.get("--filter", []) if f.startswith("type=")}
+    parent = os.getppid()
+    with open(EVENTS_FILE, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        # the real one would notice its reader is gone on the next event
+        while os.getppid() == parent:
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                # nothing new yet, or a half-written line
+                f.seek(-len(line), os.SEEK_CUR)
+                time.sleep(0.02)
+                continue
+            if not types or json.loads(line)["Type"] in types:
+                sys.stdout.buffer.write(line)
+                sys.stdout.buffer.flush()
+    return 0
+
+
+def fail(message: str, status: int = 1) -> int:
+    print(f"Error response from daemon: {message}", file=sys.stderr)
+    return status
+
+
+class Docker:
+    def __init__(self, state: dict, stdin: str = None):
+        self.state = state
+        self.stdin = stdin
+
+    def ps(self, flags, args):
+        show_all = "-a" in flags
+        for c in self.state["containers"].values():
+            if (show_all or c["State"] == "running") and labelled(c, flags):
+                row = {k: v for k, v in c.items() if k != "Output"}
+                row["Labels"] = ",".join(f"{k}={v}" for k, v in c["Labels"].items())
+                print(json.dumps(row))
+        return 0
+
+    def images(self, flags, args):
+        for image in self.state["images"].values():
+            if labelled(image, flags):
+                print(json.dumps({k: v for k, v in image.items() if k not in IMAGE_PRIVATE}))
+        return 0
+
+    def build(self, flags, args):
+        steps = ["FROM python:3.11", "COPY . /app", "RUN pip install -r requirements.txt"]
+        if args == ["-"]:
+            # the steps are the context's Dockerfile, if it has one
+            with tarfile.open(fileobj=io.BytesIO(sys.stdin.buffer.read())) as tar:
+                if "Dockerfile" in tar.getnames():
+                    dockerfile = tar.extractfile("Dockerfile").read().decode()
+                    steps = [line.strip() for line in dockerfile.splitlines()
+                             if line.strip() and not line.strip().startswith("#")]
+        for i, step in enumerate(steps, 1):
+            print(f"Step {i}/{len(steps)} : {step}")
+            base = step.split()[1] if step.upper().startswith("FROM ") else None
+            # a dboy image has to be built before another one is built FROM it
+            if base is not None and base.endswith("-image") \
+                    and find_image(self.state, base) is None:
+                return fail(f"pull access denied for {base}, repository does not exist")
+            if step == "RUN false":
+                return fail("The command '/bin/sh -c false' returned a non-zero code: 1")
+            print(" ---> Using cache" if i < len(steps) else " ---> Running in 0123456789ab")
+        image = add_image(self.state, flags["-t"][0], labels_from(flags.get("--label", [])),
+                          {"Layers": [f"sha256:{_id('base')}"], "Size": 0})
+        print(f"Successfully built {image['ID']}")
+        print(f"Successfully tagged {flags['-t'][0]}")
+        return 0
+
+    def run(self, flags, args):
+        image_ref, cmd = args[0], args[1:]
+        if find_image(self.state, image_ref) is None:
+            return fail(f"No such image: {image_ref}")
+        name = flags.get("--name", [_id("name")[:12]])[0]
+        if find_container(self.state, name) is not None:
+            # `docker run` exits 125 when docker itself fails
+            return fail(f"Conflict. The container name \"/{name}\" is already in use", 125)
+
+        detach = "-d" in flags
+        running = detach and (cmd[:1] == ["sleep"]
+                              or cmd[:2] == ["sh", "-c"] and "sleep" in " ".join(cmd[2:]))
+        container = add_container(self.state, name, image_ref, cmd, running,
+                                  labels_from(flags.get("--label", [])))
+        if detach:
+            print(container["ID"])
+            return 0
+
+        print("\n".join(container["Output"]))
+        if "--rm" in flags:
+            del self.state["containers"][container["ID"]]
+        return 0
+
+    def logs(self, flags, args):
+        container = find_container(self.state, args[0])
+        if container is None:
+            return fail(f"No such container: {args[0]}")
+        lines = container["Output"]
+        if "--tail" in flags:
+            lines = lines[-int(flags["--tail"][0]):] if int(flags["--tail"][0]) else []
+        for i, line in enumerate(lines):
+            stamp = f"{container['CreatedAt'].replace(' ', 'T')}.{i:09d}Z "
+            print(f"{stamp if '--timestamps' in flags else ''}{line}")
+        return 0
+
+    def exec(self, flags, args):
+        container = find_container(self.state, args[0])
+        if container is None:
+            return fail(f"No such container: {args[0]}")
+        if container["State"] != "running":
+            return fail(f"Container {args[0]} is not running")
+        print(" ".join(args[1:]))
+        # lets a test make a job fail, or take its container down with it
+        if args[1:2] == ["die"]:
+            container["State"], container["Status"] = "exited", "Exited (137) 1 second ago"
+            return 137
+        return 1 if args[1:2] == ["false"] else 0
+
+    def start(self, flags, args):
+        container = find_container(self.state, args[0])
+        if container is None:
+            return fail(f"No such container: {args[0]}")
+        container["State"], container["Status"] = "running", "Up 1 second"
+        print(args[0])
+        return 0
+
+    def stop(self, flags, args):
+        container = find_container(self.state, args[0])
+        if container is None:
+            return fail(f"No such container: {args[0]}")
+        container["State"], container["Status"] = "exited", "Exited (0) 1 second ago"
+        print(args[0])
+        return 0
+
+    kill = stop
+
+    def rm(self, flags, args):
+        container = find_container(self.state, args[0])
+        if container is None:
+            return fail(f"No such container: {args[0]}")
+        if container["State"] == "running" and "-f" not in flags:
+            return fail(f"You cannot remove a running container {container['ID']}")
+        del self.state["containers"][container["ID"]]
+        print(args[0])
+        return 0
+
+    def rmi(self, flags, args):
+        image = find_image(self.state, args[0])
+        if image is None:
+            return fail(f"No such image: {args[0]}")
+        del self.state["images"][image["ID"]]
+        print(f"Deleted: sha256:{image['ID']}")
+        return 0
+
+    def commit(self, flags, args):
+        container = find_container(self.state, args[0])
+        if container is None:
+            return fail(f"No such container: {args[0]}")
+        labels = {**container["Labels"], **change_labels(flags)}
+        image = add_image(self.state, args[1], labels, find_image(self.state, container["Image"]),
+                          size=5 << 20)
+        print(f"sha256:{image['ID']}")
+        return 0
+
+    def export(self, flags, args):
+        container = find_container(self.state, args[0])
+        if container is None:
+            return fail(f"No such container: {args[0]}")
+        image = find_image(self.state, container["Image"]) or {"Size": 0}
+        # stands in for the tar, the import sizes the new image from it
+        print(json.dumps({"rootfs": container["ID"], "size": image["Size"]}))
+        return 0
+
+    def import_(self, flags, args):
+        rootfs = json.loads(self.stdin or "{}")
+        image = add_image(self.state, args[1], change_labels(flags), size=rootfs.get("size", 0))
+        print(f"sha256:{image['ID']}")
+        return 0
+
+    def save(self, flags, args):
+        """ The classic docker-archive layout, one directory per layer. """
+        images = [find_image(self.state, ref) for ref in args]
+        if None in images:
+            return fail(f"No such image: {args[images.index(None)]}")
+        manifest = []
+        with tarfile.open(fileobj=sys.stdout.buffer, mode="w|") as tar:
+            def add(name, data):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+            for image in images:
+                config = json.dumps({"config": {"Labels": image["Labels"]},
+                                     "rootfs": {"type": "layers",
+                                                "diff_ids": image["Layers"]}}).encode()
+                config_name = f"{hashlib.sha256(config).hexdigest()}.json"
+                add(config_name, config)
+                paths = []
+                for layer in image["Layers"]:
+                    paths.append(f"{layer.split(':')[-1]}/layer.tar")
+                    add(paths[-1], layer_content(layer))
+                manifest.append({"Config": config_name, "Layers": paths, "RepoTags": [
+                    f"{image['Repository']}:{image['Tag']}"]})
+            add("manifest.json", json.dumps(manifest).encode())
+        return 0
+
+    def load(self, flags, args):
+        present = {chain for image in self.state["images"].values()
+                   for chain in chain_ids(image["Layers"])}
+        with tarfile.open(fileobj=io.BytesIO(self.stdin)) as tar:
+            files = {name: tar.extractfile(name).read() for name in tar.getnames()
+                     if tar.getmember(name).isfile()}
+        for entry in json.loads(files["manifest.json"]):
+            config = json.loads(files[entry["Config"]])
+            diff_ids = config["rootfs"]["diff_ids"]
+            for path, diff_id, chain in zip(entry["Layers"], diff_ids, chain_ids(diff_ids)):
+                if chain in present:
+                    continue
+                if path not in files:
+                    return fail(f"open {path}: no such file or directory")
+                print(f"Loading layer {diff_id.split(':')[-1][:12]}")
+                self.state["layers"][diff_id] = len(files[path])
+            for ref in entry["RepoTags"]:
+                repository, _, tag = ref.partition(":")
+                for other in self.state["images"].values():
+                    if (other["Repository"], other["Tag"]) == (repository, tag):
+                        other["Repository"], other["Tag"] = "<none>", "<none>"
+                # the ID is the config's digest
+                image_id = hashlib.sha256(files[entry["Config"]]).hexdigest()[:12]
+                self.state["images"][image_id] = {
+                    "ID": image_id, "Repository": repository, "Tag": tag,
+                    "Labels": config["config"]["Labels"], "Layers": diff_ids,
+                    "Size": sum(self.state["layers"].get(layer, 0) for layer in diff_ids)}
+                print(f"Loaded image: {ref}")
+        return 0
+
+    def image(self, flags, args):
+        # `image inspect` and `image prune`
+        subcommand, (flags, args) = args[0], parse(args[1:])
+        if subcommand == "prune":
+            used = {c["Image"] for c in self.state["containers"].values()}
+            dangling = [i for i in self.state["images"].values() if i["Repository"] == "<none>"
+                        and i["ID"] not in used and labelled(i, flags)]
+            print("Deleted Images:")
+            for image in dangling:
+                del self.state["images"][image["ID"]]
+                print(f"deleted: sha256:{image['ID']}")
+            print("\nTotal reclaimed space: 0B")
+            return 0
+
+        # the ones that exist, failing if any doesn't
+        images = [find_image(self.state, ref) for ref in args]
+        print(json.dumps([{"Id": f"sha256:{image['ID']}", "RepoTags": [
+            f"{image['Repository']}:{image['Tag']}"], "Size": image["Size"],
+            "RootFS": {"Type": "layers", "Layers": image["Layers"]},
+            "Config": {"Labels": image["Labels"], "Cmd": ["bash"]}}
+            for image in images if image is not None]))
+        if None in images:
+            return fail(f"No such image: {args[images.index(None)]}")
+        return 0
+
+    def container(self, flags, args):
+        # `container inspect` and `container prune`
+        subcommand, (flags, args) = args[0], parse(args[1:])
+        if subcommand == "inspect":
+            containers = [find_container(self.state, ref) for ref in args]
+            if None in containers:
+                return fail(f"No such container: {args[containers.index(None)]}")
+            print("\n".join(c["ID"] for c in containers))
+            return 0
+        stopped = [c for c in self.state["containers"].values()
+                   if c["State"] != "running" and labelled(c, flags)]
+        print("Deleted Containers:")
+        for container in stopped:
+            del self.state["containers"][container["ID"]]
+            print(container["ID"])
+        print("\nTotal reclaimed space: 0B")
+        return 0
+
+    def system(self, flags, args):
+        # `system df`
+        used = {layer for image in self.state["images"].values() for layer in image["Layers"]}
+        size = sum(self.state["layers"].get(layer, 0) for layer in used)
+        print(json.dumps({"Type": "Images", "TotalCount": str(len(self.state["images"])),
+                          "Size": f"{size / 1e6:.4g}MB"}))
+        return 0
+
+    def info(self, flags, args):
+        containers = self.state["containers"].values()
+        print(json.dumps({"NCPU": int(os.environ.get("FAKE_DOCKER_NCPU") or os.cpu_count()),
+                          "MemTotal": 8 << 30, "Containers": len(containers),
+                          "ContainersRunning": sum(c["State"] == "running" for c in containers)}))
+        return 0
+
+
+def main(argv: list[str]) -> int:
+    global STATE_FILE, EVENTS_FILE
+
+    started = time.perf_counter()
+    if os.environ.get("FAKE_DOCKER_DELAY"):
+        time.sleep(float(os.environ["FAKE_DOCKER_DELAY"]))
+
+    host = None
+    if argv[:1] in (["-H"], ["--context"]):
+        host, argv = argv[1], argv[2:]
+        STATE_FILE = f"{STATE_FILE}.{re.sub(r'[^A-Za-z0-9_.-]+', '_', host)}"
+        EVENTS_FILE = f"{STATE_FILE}.events"
+
+    subcommand = argv[0] if argv else ""
+    # `export | import` runs both at once, so the import mustn't hold the
+    # lock while it waits for the export's output
+    stdin = sys.stdin.read() if subcommand == "import" else \
+        sys.stdin.buffer.read() if subcommand == "load" else None
+    if subcommand == "events":
+        # runs until killed, without holding the lock
+        return events(parse(argv[1:])[0])
+
+    with open(f"{STATE_FILE}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = empty_state()
+        if os.path.exists(STATE_FILE):
+            with open(STATE_FILE, "r") as f:
+                state = json.load(f)
+
+        # `import` is a keyword
+        handler = getattr(Docker(state, stdin), "import_" if subcommand == "import" else subcommand, None)
+        if handler is None or subcommand.startswith("_"):
+            returncode = fail(f"fake docker doesn't implement `{subcommand}`")
+        else:
+            before = fingerprint(state)
+            returncode = handler(*parse(argv[1:]))
+            happened = changes(before, fingerprint(state))
+            if happened:
+                with open(EVENTS_FILE, "a") as f:
+                    f.write("".join(json.dumps(event) + "\n" for event in happened))
+
+        with open(STATE_FILE, "w") as f:
+            json.dump(state, f, indent=1)
+
+    with open(LOG_FILE, "a") as f:
+        f.write(json.dumps({"args": argv, "host": host, "returncode": returncode,
+                            "time": time.time(),
+                            "duration": time.perf_counter() - started}) + "\n")
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
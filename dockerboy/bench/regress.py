@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+""" Docker round-trip and latency regression check for the `dboy` CLI.
+
+Runs each CLI command against `fake_docker.py` (installed as `docker` first
+on the PATH) in a scratch project, counts the docker invocations it makes
+and times it end to end, and compares both against `baseline.json`:
+
+    python bench/regress.py              # compare, exit 1 on a regression
+    python bench/regress.py -k r -v      # only scenarios starting with "r", list the calls
+    python bench/regress.py --update     # record a new baseline
+
+A scenario regresses if it makes more docker calls than the baseline, or
+its median latency is more than `--tolerance` above it. Latencies depend on
+the machine, so record the baseline on the machine you compare on; the call
+counts don't.
+"""
+import os
+import sys
+import json
+import stat
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+import fake_docker
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+
+ENTRY = "from dockerboy import main; main()"
+IMAGE = "bench-image"
+CONTAINER = "bench-container"
+RUN_ARGS = ["-ni", "--", "echo", "hi"]
+
+# name -> command line, daemon state before the run (`foreign` adds that many
+# containers of another project), and dboy commands run (untimed) beforehand
+SCENARIOS = {
+    "b": {"args": ["b"]},
+    "b cached": {"args": ["b"], "prepare": [["b"]]},
+    "r": {"args": ["r", *RUN_ARGS], "images": [IMAGE]},
+    "r exec": {"args": ["r", *RUN_ARGS], "images": [IMAGE],
+               "containers": [(CONTAINER, "running")]},
+    "r crowded": {"args": ["r", *RUN_ARGS], "images": [IMAGE],
+                  "containers": [(CONTAINER, "running")], "foreign": 2000},
+    "r pool": {"args": ["r", "--pool", *RUN_ARGS], "images": [IMAGE],
+               "prepare": [["pool", "warm", "-n", "1"]]},
+    "sd": {"args": ["sd"], "images": [IMAGE], "containers": [(CONTAINER, "running")]},
+    "rm": {"args": ["rm"], "images": [IMAGE], "containers": [(CONTAINER, "exited")]},
+    "cm": {"args": ["cm", "grc"], "images": [IMAGE], "containers": [(CONTAINER, "running")]},
+    "tb": {"args": ["tb"], "images": [IMAGE]},
+}
+
+
+def config(project: str) -> dict:
+    # JSON is valid YAML, so this doubles as a .dboy.yaml
+    return {"image_name": "bench", "dockerfile_path": f"{project}/",
+            "host_dir": f"{project}/shared", "ports": [[6006, 6006]],
+            "interactive": True, "post_removal": True, "rebuild": True}
+
+
+class Sandbox:
+    """ A scratch project plus the fake docker's state and log. """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.project = os.path.join(root, "project")
+        self.state_file = os.path.join(root, "state.json")
+        self.log_file = os.path.join(root, "calls.log")
+
+        bin_dir = os.path.join(root, "bin")
+        os.makedirs(bin_dir)
+        docker = os.path.join(bin_dir, "docker")
+        with open(docker, "w") as f:
+            f.write(f"#!/bin/sh\nexec {sys.executable} {BENCH_DIR}/fake_docker.py \"$@\"\n")
+        os.chmod(docker, os.stat(docker).st_mode | stat.S_IXUSR)
+
+        self.env = dict(os.environ)
+        self.env.update({
+            "PATH": f"{bin_dir}{os.pathsep}{self.env.get('PATH', '')}",
+            "PYTHONPATH": f"{PROJECT_DIR}{os.pathsep}{self.env.get('PYTHONPATH', '')}",
+            "DBOY_BACKEND": "cli",
+            # measure the commands themselves, not a `dboy serve` running here
+            "DBOY_NO_DAEMON": "1",
+            "FAKE_DOCKER_STATE": self.state_file,
+            "FAKE_DOCKER_LOG": self.log_file,
+            # host ports leased by the runs, instead of the user's registry
+            "DBOY_PORT_REGISTRY": os.path.join(root, "ports.json"),
+        })
+
+    def reset(self, scenario: dict):
+        shutil.rmtree(self.project, ignore_errors=True)
+        os.makedirs(os.path.join(self.project, "shared"))
+        with open(os.path.join(self.project, "Dockerfile"), "w") as f:
+            f.write("FROM python:3.11\nCOPY . /app\n")
+        with open(os.path.join(self.project, ".dboy.yaml"), "w") as f:
+            json.dump(config(self.project), f)
+
+        # what dboy would have labelled them with
+        labels = {"dockerboy.project": self.project, "dockerboy.spec": "bench",
+                  "dockerboy.version": "0"}
+        state = fake_docker.empty_state()
+        for ref in scenario.get("images", []):
+            fake_docker.add_image(state, ref, labels)
+        for name, container_state in scenario.get("containers", []):
+            fake_docker.add_container(state, name, IMAGE, ["sleep", "infinity"],
+                                      container_state == "running", labels)
+        for i in range(scenario.get("foreign", 0)):
+            fake_docker.add_container(state, f"foreign-{i}", "foreign-image",
+                                      ["sleep", "infinity"], True,
+                                      {"dockerboy.project": "/elsewhere"})
+        with open(self.state_file, "w") as f:
+            json.dump(state, f)
+
+        for args in scenario.get("prepare", []):
+            self.dboy(args)
+        self.clear_log()
+
+    def clear_log(self):
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+
+    def calls(self) -> list[dict]:
+        if not os.path.exists(self.log_file):
+            return []
+        with open(self.log_file, "r") as f:
+            return [json.loads(line) for line in f]
+
+    def dboy(self, args: list[str]) -> subprocess.CompletedProcess:
+        return subprocess.run([sys.executable, "-c", ENTRY, *args], cwd=self.project,
+                              env=self.env, stdin=subprocess.DEVNULL, capture_output=True)
+
+
+def measure(sandbox: Sandbox, scenario: dict, runs: int) -> dict:
+    timings, counts = [], []
+    for _ in range(runs):
+        sandbox.reset(scenario)
+        started = time.perf_counter()
+        proc = sandbox.dboy(scenario["args"])
+        timings.append((time.perf_counter() - started) * 1000)
+        if proc.returncode != 0:
+            raise RuntimeError(f"dboy {' '.join(scenario['args'])} failed:\n"
+                               f"{proc.stderr.decode(errors='replace')}")
+        calls = sandbox.calls()
+        counts.append(len(calls))
+
+    return {"calls": max(counts), "ms": round(statistics.median(timings), 1),
+            "docker": [" ".join(call["args"][:1]) for call in calls]}
+
+
+def compare(name: str, result: dict, baseline: dict | None, tolerance: float) -> list[str]:
+    if baseline is None:
+        return []
+    problems = []
+    if result["calls"] > baseline["calls"]:
+        problems.append(f"{result['calls']} docker calls, baseline {baseline['calls']}")
+    if result["ms"] > baseline["ms"] * (1 + tolerance):
+        problems.append(f"{result['ms']:.0f}ms, baseline {baseline['ms']:.0f}ms "
+                        f"(+{tolerance:.0%} allowed)")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed relative latency increase")
+    parser.add_argument("--update", action="store_true",
+                        help="write the results as the new baseline")
+    parser.add_argument("-k", dest="only", default=None,
+                        help="only run scenarios starting with this")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="list the docker calls of each scenario")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, "r") as f:
+            baseline = json.load(f)
+
+    results, failed = {}, []
+    with tempfile.TemporaryDirectory() as tmp:
+        sandbox = Sandbox(tmp)
+        print(f"{'scenario':<10} {'calls':>5} {'base':>5} {'ms':>8} {'base':>8}")
+        for name, scenario in SCENARIOS.items():
+            if args.only and not name.startswith(args.only):
+                continue
+            result = measure(sandbox, scenario, args.runs)
+            results[name] = result
+            base = baseline.get(name)
+
+            problems = compare(name, result, base, args.tolerance)
+            failed += [f"{name}: {problem}" for problem in problems]
+            print(f"{name:<10} {result['calls']:>5} {base['calls'] if base else '-':>5} "
+                  f"{result['ms']:>8.1f} {base['ms'] if base else '-':>8} "
+                  f"{'REGRESSED' if problems else ''}")
+            if args.verbose:
+                print(f"           docker {', '.join(result['docker'])}")
+
+    if args.update:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump({**baseline, **results}, f, indent=1)
+            f.write("\n")
+        print(f"Wrote {BASELINE_FILE}")
+        return
+
+    if failed:
+        print("\n".join(["", "Regressions:", *failed]))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+""" Direct vs `dboy serve` latency for a stream of everyday commands.
+
+Runs the same command sequence against `fake_docker.py` twice, once with
+every `dboy` starting from scratch and once handed to a `dboy serve` daemon
+in the sandbox, and reports each command's median latency and docker calls:
+
+    python bench/serve.py [--rounds 10] [--delay 0.05]
+
+`--delay` adds a sleep to every fake docker call, roughly what a real
+daemon's CLI costs, so skipped listings show up in the timings.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+import regress
+
+
+# run in order, every round; none of them changes the daemon's state for good
+COMMANDS = [
+    ["r", "--pool", *regress.RUN_ARGS],
+    ["pool", "status"],
+    ["b"],
+    ["gc", "-l"],
+    ["cm", "grc"],
+]
+SCENARIO = {"images": [regress.IMAGE], "prepare": [["b"], ["pool", "warm", "-n", "1"]]}
+
+
+def run_rounds(sandbox: regress.Sandbox, rounds: int) -> dict[str, dict]:
+    timings = {" ".join(args): [] for args in COMMANDS}
+    calls = {" ".join(args): [] for args in COMMANDS}
+    for _ in range(rounds):
+        for args in COMMANDS:
+            sandbox.clear_log()
+            started = time.perf_counter()
+            proc = sandbox.dboy(args)
+            timings[" ".join(args)].append((time.perf_counter() - started) * 1000)
+            if proc.returncode != 0:
+                raise RuntimeError(f"dboy {' '.join(args)} failed:\n"
+                                   f"{proc.stderr.decode(errors='replace')}")
+            calls[" ".join(args)].append(len(sandbox.calls()))
+    # the first round of the daemon is a cold start, report the steady state
+    return {name: {"ms": statistics.median(timings[name][1:] or timings[name]),
+                   "calls": statistics.median(calls[name][1:] or calls[name])}
+            for name in timings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="seconds each fake docker call sleeps")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sandbox = regress.Sandbox(tmp)
+        if args.delay:
+            sandbox.env["FAKE_DOCKER_DELAY"] = str(args.delay)
+
+        sandbox.reset(SCENARIO)
+        direct = run_rounds(sandbox, args.rounds)
+
+        sandbox.reset(SCENARIO)
+        socket_path = os.path.join(tmp, "dboy.sock")
+        env = {**sandbox.env, "DBOY_SOCKET": socket_path}
+        env.pop("DBOY_NO_DAEMON")
+        daemon = subprocess.Popen([sys.executable, "-c", regress.ENTRY, "serve"],
+                                  cwd=sandbox.project, env=env, stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(socket_path):
+                time.sleep(0.05)
+            # past the daemon's event stream grace period
+            time.sleep(1.2)
+            sandbox.env = env
+            served = run_rounds(sandbox, args.rounds)
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+    print(f"{'command':<28} {'direct ms':>9} {'calls':>5} {'served ms':>9} {'calls':>5}")
+    for name in direct:
+        print(f"{name:<28} {direct[name]['ms']:>9.1f} {direct[name]['calls']:>5g} "
+              f"{served[name]['ms']:>9.1f} {served[name]['calls']:>5g}")
+    total_direct = sum(result["ms"] for result in direct.values())
+    total_served = sum(result["ms"] for result in served.values())
+    print(f"{'total':<28} {total_direct:>9.1f} {'':>5} {total_served:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+""" Startup benchmark for the `dboy` CLI.
+
+Measures the wall-clock time of `dboy -h` and `dboy cm grc` against a bare
+`python -c pass`, so what's left is dockerboy's own Python overhead, and
+lists the slowest imports from `python -X importtime`. The docker CLI is
+replaced by a stub that returns immediately, so docker itself isn't timed.
+
+Each command is timed twice: the default way, which looks for a `dboy serve`
+socket first (pointed at an empty scratch directory, so no daemon answers),
+and with DBOY_NO_DAEMON=1, which skips that.
+
+    python bench/startup.py [--runs 20] [--target-ms 50]
+
+Exits with status 1 if any command's overhead is above the target.
+"""
+import os
+import sys
+import stat
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "dboy -h": ["-h"],
+    "dboy cm grc": ["cm", "grc"],
+}
+
+ENTRY = "import sys; from dockerboy import main; main()"
+
+# label -> environment on top of make_env's
+MODES = {
+    "default": {},
+    "DBOY_NO_DAEMON=1": {"DBOY_NO_DAEMON": "1"},
+}
+
+
+def make_env(stub_dir: str) -> dict:
+    stub = os.path.join(stub_dir, "docker")
+    with open(stub, "w") as f:
+        f.write("#!/bin/sh\nexit 0\n")
+    os.chmod(stub, os.stat(stub).st_mode | stat.S_IXUSR)
+
+    env = dict(os.environ)
+    env["PATH"] = f"{stub_dir}{os.pathsep}{env.get('PATH', '')}"
+    env["PYTHONPATH"] = f"{PROJECT_DIR}{os.pathsep}{env.get('PYTHONPATH', '')}"
+    # don't probe a real docker socket, nor hand the commands to a real `dboy serve`
+    env["DBOY_BACKEND"] = "cli"
+    env["DBOY_SOCKET"] = os.path.join(stub_dir, "serve", "dboy.sock")
+    env.pop("DBOY_NO_DAEMON", None)
+    return env
+
+
+def time_runs(cmd: list[str], env: dict, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def slowest_imports(args: list[str], env: dict, top: int) -> list[tuple[int, str]]:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", ENTRY, *args],
+                          env=env, capture_output=True, text=True)
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # only top-level imports, nested ones are included in their parent
+        if name.startswith("  ") and not name.strip().startswith("dockerboy"):
+            continue
+        imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--target-ms", type=float, default=50.0)
+    parser.add_argument("--top", type=int, default=8,
+                        help="number of slow imports to list")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = make_env(tmp)
+        baseline = time_runs([sys.executable, "-c", "pass"], env, args.runs)
+        print(f"python -c pass: {baseline:.1f}ms (baseline)")
+
+        failed = False
+        for label, cmd_args in SCENARIOS.items():
+            print()
+            for mode, extra_env in MODES.items():
+                total = time_runs([sys.executable, "-c", ENTRY, *cmd_args],
+                                  {**env, **extra_env}, args.runs)
+                overhead = total - baseline
+                verdict = "ok" if overhead <= args.target_ms else "OVER TARGET"
+                failed |= overhead > args.target_ms
+                print(f"{label} ({mode}): {total:.1f}ms, {overhead:.1f}ms over baseline "
+                      f"(target {args.target_ms:.0f}ms) {verdict}")
+
+            # of the default path, the one everybody gets
+            for cumulative, name in slowest_imports(cmd_args, env, args.top):
+                print(f"  {cumulative / 1000:7.1f}ms  {name}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,157 +1,543 @@
 #!/usr/bin/env python3
-from .dockwrap.wrapper import DockerWrapper
-from .utils.config import interactive_config_builder, load_config, default_config, save_config
-
+# Keep the imports here to the standard library's cheap modules: `dboy -h`
+# and every subcommand start by importing this file. Subcommands import what
+# they need inside their handler.
 import os
-import logging
+import sys
 import argparse
 
 
-logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)
+class Command:
+    def __init__(self, name: str, help: str, handler, arguments=(),
+                 needs_container: bool = True):
+        self.name = name
+        self.help = help
+        self.handler = handler
+        self.arguments = arguments
+        self.needs_container = needs_container
+
+
+# subcommand name -> Command, filled by the @command decorators below
+COMMANDS: dict[str, Command] = {}
+
+
+def arg(*flags, **kwargs):
+    return flags, kwargs
+
+
+def group(*arguments, required=False):
+    """ A mutually exclusive group of `arg`s. """
+    return "group", {"arguments": arguments, "required": required}
+
+
+def command(name: str, help: str, *arguments, needs_container: bool = True):
+    """ Register a subcommand. The handler is called as handler(args, my_container);
+    `my_container` is None for commands that don't need a config.
+    """
+    def register(handler):
+        COMMANDS[name] = Command(name, help, handler, arguments, needs_container)
+        return handler
+    return register
+
+
+@command("b", "build the image, and the config's other images as a DAG",
+         arg("-r", "--rebuild", action="store_true", dest="rebuild", default=False),
+         arg("-f", "--force", action="store_true", dest="force", default=False,
+             help="build even if the context is unchanged since the last build"),
+         arg("-P", "--parallel", type=int, dest="parallel", default=None,
+             help="images built at once (default: build_jobs from the config)"),
+         arg("-k", "--keep-going", action="store_true", dest="keep_going", default=False,
+             help="keep building images that don't depend on a failed one"),
+         arg("targets", type=str, nargs="*",
+             help="only build these images and the ones they are built FROM"))
+def build_cmd(args, my_container):
+    if args.rebuild:
+        my_container.snapshot_and_rebuild()
+    elif my_container.images or args.targets:
+        if not my_container.build_images(args.targets, force=args.force, jobs=args.parallel,
+                                         keep_going=args.keep_going):
+            sys.exit(1)
+    else:
+        my_container.build_image(force=args.force)
+
+
+@command("r", "run a command in the container",
+         arg("-ni", "--non-interactive", action="store_false", dest="interactive", default=True),
+         arg("-nrm", "--post-removal", action="store_false", dest="post_removal", default=True),
+         arg("--pool", action="store_true", dest="pool", default=None,
+             help="exec into a warm pool container instead of starting a new one"),
+         arg("-d", "--detach", action="store_true", dest="detach", default=False,
+             help="run in the background, logging to host_dir/logs/<container>"),
+         arg("run_cmd", type=str, nargs="+"))
+def run_cmd(args, my_container):
+    from .dockwrap.wrapper import DockerWrapper
+
+    if args.detach:
+        my_container.run_detached(args.run_cmd, post_removal=args.post_removal)
+        return
+
+    print(
+        f"We will remove the container after running: {args.post_removal}")
+    my_container.run(
+        args.run_cmd,
+        interactive=args.interactive,
+        post_removal=args.post_removal,
+        pool=args.pool)
+
+    # if a container was created without --rm before, we need to remove
+    # it manually
+    if args.post_removal and DockerWrapper.does_container_exist(
+            my_container.name):
+        my_container.remove()
+
+
+@command("sweep", "run one container per job of a parameter grid or job list",
+         group(arg("-g", "--grid", type=str, dest="sweep_file",
+                   help="yaml mapping of parameter -> list of values"),
+               arg("-j", "--jobs", type=str, dest="sweep_file",
+                   help="yaml list of parameter mappings or full commands"),
+               required=True),
+         arg("-w", "--workers", type=int, dest="workers", default=None,
+             help="concurrent containers (default: number of cores)"),
+         arg("-v", "--verbose", action="store_true", dest="verbose", default=False,
+             help="stream every job's output with a prefix"),
+         arg("run_cmd", type=str, nargs="*"))
+def sweep_cmd(args, my_container):
+    from .utils.config import load_sweep
+
+    sweep_jobs = my_container.sweep(
+        args.run_cmd,
+        load_sweep(args.sweep_file),
+        workers=args.workers,
+        verbose=args.verbose)
+    if not sweep_jobs or any(job.returncode != 0 for job in sweep_jobs):
+        sys.exit(1)
+
+
+@command("batch", "exec a list of jobs into running pool containers",
+         arg("batch_file", type=str,
+             help="yaml list of commands, or a mapping with `jobs` and defaults"),
+         arg("-n", "--containers", type=int, dest="containers", default=None,
+             help="pool containers to spread the jobs over (default: 1)"),
+         arg("-p", "--per-container", type=int, dest="per_container", default=None,
+             help="jobs running at once in each container (default: 1)"),
+         arg("-r", "--retries", type=int, dest="retries", default=None,
+             help="times a failed job is retried (default: 0)"),
+         arg("-o", "--results", type=str, dest="results", default=None,
+             help="jsonl file for the results (default: <batch file>.results.jsonl)"),
+         arg("-v", "--verbose", action="store_true", dest="verbose", default=False,
+             help="stream every job's output with a prefix"))
+def batch_cmd(args, my_container):
+    from .utils.config import load_batch
+
+    jobs, settings = load_batch(args.batch_file)
+    options = {key: settings.get(key, default) if getattr(args, key) is None
+               else getattr(args, key)
+               for key, default in (("containers", 1), ("per_container", 1), ("retries", 0))}
+    results = args.results or f"{os.path.splitext(args.batch_file)[0]}.results.jsonl"
+
+    batch_jobs = my_container.batch(jobs, results=results, verbose=args.verbose, **options)
+    if not batch_jobs or any(job.returncode != 0 for job in batch_jobs):
+        sys.exit(1)
+
+
+@command("pool", "manage the warm container pool used by `r --pool`",
+         arg("pool_cmd", choices=["warm", "status", "drain"]),
+         arg("-n", type=int, dest="pool_n", default=None,
+             help="idle containers to warm (default: pool_size from the config)"))
+def pool_cmd(args, my_container):
+    pool = my_container.pool()
+    if args.pool_cmd == "warm":
+        print(f"Started {pool.warm(args.pool_n)} pool containers")
+        print(pool.status())
+    elif args.pool_cmd == "drain":
+        print(f"Removed {pool.drain()} pool containers")
+    else:
+        print(pool.status())
+
+
+@command("stats", "sample the container's cpu, memory and io from its cgroup",
+         arg("-i", "--interval", type=float, dest="interval", default=1.0,
+             help="seconds between samples"),
+         arg("-n", "--capacity", type=int, dest="capacity", default=3600,
+             help="samples kept, older ones are dropped"),
+         arg("-t", "--duration", type=float, dest="duration", default=None,
+             help="stop after this many seconds (default: until the container stops)"),
+         arg("--csv", type=str, dest="csv", default=None, help="write the samples to a csv file"),
+         arg("--tb", action="store_true", dest="tb", default=False,
+             help="write the samples as tensorboard scalars under host_dir/tb_logs"),
+         arg("--cgroup-root", type=str, dest="cgroup_root", default=None))
+def stats_cmd(args, my_container):
+    from .dockwrap.stats import COLUMNS
+
+    sampler = my_container.stats(args.interval, args.capacity, args.cgroup_root)
+    print("  ".join(f"{column:>17}" for column in COLUMNS))
+    try:
+        sampler.run(args.duration, on_sample=lambda row: print(
+            "  ".join(f"{row[column]:>17}" for column in COLUMNS), flush=True))
+    except KeyboardInterrupt:
+        pass
+
+    if args.csv:
+        print(f"Wrote {sampler.to_csv(args.csv)} samples to {args.csv}")
+    if args.tb:
+        print(f"Wrote {sampler.to_tensorboard(my_container.stats_logdir())}")
+
+
+@command("logs", "tail the logs of one or more containers, merged with prefixes",
+         arg("containers", type=str, nargs="*",
+             help="containers to show (default: every running one with captured logs)"),
+         arg("-f", "--follow", action="store_true", dest="follow", default=False),
+         arg("-n", "--tail", type=int, dest="tail", default=10, help="lines per container"),
+         arg("-t", "--timestamps", action="store_true", dest="timestamps", default=False))
+def logs_cmd(args, my_container):
+    from .dockwrap.logs import FileSource, DockerSource, multiplex
+    from .dockwrap.backends import using
+    from .dockwrap.wrapper import DockerWrapper
+
+    def running(name):
+        with using(my_container.endpoint_of(name)):
+            return DockerWrapper.is_container_running(name)
+
+    names = args.containers
+    if not names:
+        logs_root = os.path.dirname(my_container.log_dir())
+        captured = sorted(os.listdir(logs_root)) if os.path.isdir(logs_root) else []
+        names = [name for name in captured if running(name)] or [my_container.name]
+
+    sources = []
+    for name in names:
+        if os.path.isdir(my_container.log_dir(name)):
+            sources.append(FileSource(name, my_container.log_dir(name)))
+        else:
+            with using(my_container.endpoint_of(name)):
+                sources.append(DockerSource(name))
+
+    try:
+        multiplex(sources, follow=args.follow, tail=args.tail, timestamps=args.timestamps)
+    except KeyboardInterrupt:
+        pass
+
+
+@command("data", "manage the dataset cache mounted read-only into every container",
+         arg("data_cmd", choices=["prepare", "ls", "verify", "rm", "gc"]),
+         arg("names", type=str, nargs="*", help="datasets (tfds names)"),
+         arg("--from-dir", type=str, dest="from_dir", default=None,
+             help="import a directory tfds already prepared instead of preparing it in the image"))
+def data_cmd(args, my_container):
+    cache = my_container.datasets()
+    if args.data_cmd in ("prepare", "rm") and not args.names:
+        print(f"`dboy data {args.data_cmd}` needs at least one dataset name")
+        return
+
+    if args.data_cmd == "prepare":
+        for name in args.names:
+            manifest = my_container.prepare_dataset(name, args.from_dir)
+            print(f"Prepared {name}: {len(manifest['files'])} files, "
+                  f"{manifest['size'] / 2**20:.1f}MB, digest {manifest['digest'][:12]}")
+    elif args.data_cmd == "verify":
+        for name in args.names or cache.names():
+            bad = cache.verify(name)
+            print(f"{name}: {'ok' if not bad else f'{len(bad)} corrupt or missing files'}")
+            for relpath in bad:
+                print(f"  {relpath}")
+    elif args.data_cmd == "rm":
+        for name in args.names:
+            cache.remove(name)
+        print(f"Freed {cache.gc() / 2**20:.1f}MB")
+    elif args.data_cmd == "gc":
+        print(f"Freed {cache.gc() / 2**20:.1f}MB")
+    else:
+        print(cache.table())
+
+
+@command("image", "archive built images compressed and deduplicated, and load them on another node",
+         arg("image_cmd", choices=["export", "import", "ls", "rm", "gc"]),
+         arg("refs", type=str, nargs="*",
+             help="images (default: the config's own and its `images`)"),
+         arg("--archive", type=str, dest="archive", default=None,
+             help="archive directory (default: image_archive from the config)"),
+         arg("--full", action="store_true", dest="full", default=False,
+             help="import: send every layer, even those the daemon has"))
+def image_cmd(args, my_container):
+    from .dockwrap.images import ImageArchive
+
+    archive = ImageArchive(args.archive or my_container.image_archive)
+    if args.image_cmd == "export":
+        for report in my_container.export_images(args.refs, archive.root):
+            print(report)
+    elif args.image_cmd == "import":
+        for report in my_container.import_images(args.refs, archive.root, full=args.full):
+            print(report)
+    elif args.image_cmd == "rm":
+        if not args.refs:
+            print("`dboy image rm` needs at least one image")
+            return
+        for ref in args.refs:
+            archive.remove(ref)
+        print(f"Freed {archive.gc() / 2**20:.1f}MB")
+    elif args.image_cmd == "gc":
+        print(f"Freed {archive.gc() / 2**20:.1f}MB")
+    else:
+        print(archive.table())
+
+
+@command("gc", "remove old snapshot versions, stopped containers and dangling images",
+         arg("-k", "--keep", type=int, dest="keep", default=None,
+             help="versions to keep (default: keep_versions from the config)"),
+         arg("-n", "--dry-run", action="store_true", dest="dry_run", default=False),
+         arg("-l", "--list", action="store_true", dest="list", default=False,
+             help="only list the snapshot versions"))
+def gc_cmd(args, my_container):
+    if args.list:
+        print(my_container.versions())
+    else:
+        print(my_container.gc(args.keep, args.dry_run))
+
+
+@command("rm", "remove the managed container")
+def remove_cmd(args, my_container):
+    my_container.remove()
+
+
+@command("sd", "shut down the managed container")
+def shutdown_cmd(args, my_container):
+    my_container.shutdown()
+
+
+@command("tb", "run tensorboard in a sidecar container, or compact its event files",
+         arg("tb_cmd", nargs="?", choices=["start", "stop", "compact"], default="start"),
+         arg("-l", "--logdir", action="append", dest="logdirs", default=[],
+             help="another tb_logs directory to show or compact, as [name=]path (repeatable)"),
+         arg("--compact", action="store_true", dest="compact", default=False,
+             help="serve the copies `dboy tb compact` made, where there are any"),
+         arg("--min-mb", type=float, dest="min_mb", default=10.0,
+             help="only downsample event files at least this large"),
+         arg("--max-scalars", type=int, dest="max_scalars", default=1000,
+             help="values kept per scalar tag"),
+         arg("--max-other", type=int, dest="max_other", default=100,
+             help="values kept per histogram, image, ... tag"))
+def tensorboard_cmd(args, my_container):
+    if args.tb_cmd == "stop":
+        print("Stopped TensorBoard" if my_container.stop_tensorboard()
+              else "TensorBoard is not running")
+    elif args.tb_cmd == "compact":
+        compacted = my_container.compact_tensorboard(
+            args.logdirs, min_mb=args.min_mb, max_scalars=args.max_scalars,
+            max_other=args.max_other)
+        for path, before, after in compacted:
+            print(f"{before / 2**20:>9.1f}MB -> {after / 2**20:>7.1f}MB  {path}")
+        print(f"Downsampled {len(compacted)} event files, serve them with `dboy tb --compact`")
+    else:
+        port = my_container.tensorboard(args.logdirs, compact=args.compact)
+        if port is not None:
+            from .dockwrap.backends import current_endpoint
+            from .dockwrap.endpoints import hostname
+
+            print(f"TensorBoard is at http://{hostname(current_endpoint())}:{port}, "
+                  f"stop it with `dboy tb stop`")
+
+
+@command("cfg", "generate a config file",
+         arg("-i", "--interactive", action="store_true", dest="build_cfg_interactive", default=False),
+         needs_container=False)
+def config_gen_cmd(args, my_container):
+    from .utils.config import interactive_config_builder, default_config, save_config
+
+    if args.build_cfg_interactive:
+        save_config(interactive_config_builder(), args.cfg_file)
+    else:
+        save_config(default_config(), args.cfg_file)
+
+
+@command("serve", "keep a daemon running that the other commands are handed to",
+         arg("--status", action="store_true", dest="status", default=False,
+             help="show what the running daemon has cached"),
+         arg("--stop", action="store_true", dest="stop", default=False),
+         arg("--socket", type=str, dest="socket", default=None,
+             help="unix socket to listen on (default: $DBOY_SOCKET, "
+                  "$XDG_RUNTIME_DIR/dockerboy/dboy.sock or /tmp/dockerboy-<uid>/dboy.sock)"),
+         needs_container=False)
+def serve_cmd(args, my_container):
+    from . import serve
+
+    if args.socket:
+        os.environ[serve.SOCKET_ENV] = args.socket
+    if args.status or args.stop:
+        reply = serve.request("status" if args.status else "stop")
+        if reply is None:
+            print(f"No dboy daemon is listening on {serve.socket_path()}")
+        elif args.stop:
+            print("Stopping the dboy daemon")
+        else:
+            for key, value in reply.items():
+                if key != "scopes":
+                    print(f"{key:>9}: {value}")
+            for scope in reply["scopes"]:
+                print(f"{'cached':>9}: {scope['project']} {scope['spec']}: "
+                      f"{', '.join(scope['cached']) or 'nothing'}")
+        return
+    serve.Daemon().serve()
+
+
+def _cm_help():
+    from .dockwrap.commands import CM_COMMANDS
+    return "CM cmds: " + ", ".join(f"{code} - {method}" for code, method in CM_COMMANDS.items())
+
+
+@command("cm", "container management: call a DockerWrapper method",
+         arg("cm_cmd", type=str, help="CM command, see `dboy cm -h`"),
+         arg("cm_args", type=str, help="CM command arguments", nargs="*"),
+         needs_container=False)
+def container_management_cmd(args, my_container):
+    from .dockwrap.commands import CM_COMMANDS
+
+    method = CM_COMMANDS.get(args.cm_cmd)
+    if method is None:
+        print(f"Command {args.cm_cmd} not found. {_cm_help()}")
+        return
+
+    from .dockwrap.wrapper import DockerWrapper
 
-cmds = {"Build": "b",
-        "Run": "r",
-        "Remove": "rm",
-        "Shutdown": "sd",
-        "Tensorboard": "tb",
-        "Config gen": "cfg",
-        "Container management": "cm"}
+    print(f"{args.cm_cmd}: Running {method} with args {args.cm_args}")
+    print(DockerWrapper.run_method(method, *args.cm_args))
 
 
-def argparser():
-    parser = argparse.ArgumentParser()
+class HelpFormatter(argparse.HelpFormatter):
+    """ argparse's own formatter imports shutil (and with it bz2 and lzma) on
+    every parser just to ask for the terminal width; this asks os directly.
+    """
+
+    def __init__(self, prog, indent_increment=2, max_help_position=24, width=None):
+        if width is None:
+            width = _terminal_width() - 2
+        super().__init__(prog, indent_increment, max_help_position, width)
+
+
+def _terminal_width() -> int:
+    # what shutil.get_terminal_size() would say
+    try:
+        return int(os.environ["COLUMNS"])
+    except (KeyError, ValueError):
+        pass
+    try:
+        return os.get_terminal_size(sys.__stdout__.fileno()).columns or 80
+    except (AttributeError, ValueError, OSError):
+        return 80
+
+
+def argparser(only: str = None):
+    """ The CLI's parser. With `only` the other subcommands are left out,
+    since building all of them is a good part of a command's startup time.
+    """
+    parser = argparse.ArgumentParser(formatter_class=HelpFormatter)
     parser.add_argument("-c", "--config", type=str, help="path to config file")
+    parser.add_argument("-d", "--debug", action="store_true", dest="debug",
+                        default=False, help="log every docker call")
+    parser.add_argument("-e", "--endpoint", type=str, dest="endpoint", default=None,
+                        help="docker endpoint (DOCKER_HOST URL or context) to use instead "
+                             "of placing containers (default: $DBOY_ENDPOINT)")
+    parser.add_argument("--profile", action="store_true", dest="profile", default=False,
+                        help="time every docker call and print a summary")
+    parser.add_argument("--trace-out", type=str, dest="trace_out", default=None,
+                        help="write the docker calls as a Chrome trace (chrome://tracing)")
 
     # main cmd
     subparsers = parser.add_subparsers(dest="cmd")
     subparsers.required = True
 
-    # build subcmd
-    build_parser = subparsers.add_parser(cmds["Build"])
-    build_parser.add_argument(
-        "-r",
-        "--rebuild",
-        action="store_true",
-        dest="rebuild",
-        default=False)
-
-    # run subcmd
-    run_parser = subparsers.add_parser(cmds["Run"])
-    run_parser.add_argument(
-        "-ni",
-        "--non-interactive",
-        action="store_false",
-        dest="interactive",
-        default=True)
-    run_parser.add_argument(
-        "-nrm",
-        "--post-removal",
-        action="store_false",
-        dest="post_removal",
-        default=True)
-    run_parser.add_argument("run_cmd", type=str, nargs="+")
-
-    # remove subcmd
-    remove_parser = subparsers.add_parser(cmds["Remove"])
-
-    # shutdown subcmd
-    shutdown_parser = subparsers.add_parser(cmds["Shutdown"])
-
-    # tensorboard subcmd
-    tensorboard_parser = subparsers.add_parser(cmds["Tensorboard"])
-
-    # config gen subcmd
-    config_gen_parser = subparsers.add_parser(cmds["Config gen"])
-    config_gen_parser.add_argument(
-        "-i",
-        "--interactive",
-        action="store_true",
-        dest="build_cfg_interactive",
-        default=False)
-
-    # container management subcmd
-    container_management_parser = subparsers.add_parser(
-        cmds["Container management"])
-    # add container management subcmd argument
-    help_str = "\n".join(
-        [f"\t\t{name} - {c}" for name, c in DockerWrapper.get_commands().items()])
-
-    container_management_parser.add_argument(
-        "cm_cmd",
-        type=str,
-        help=f"CM cmds: {help_str}",
-        choices=DockerWrapper.get_commands().values())
-    container_management_parser.add_argument(
-        "cm_args", type=str, help="CM command arguments", nargs="*")
+    for cmd in COMMANDS.values():
+        if only is not None and cmd.name != only:
+            continue
+        description = f"{cmd.help}. {_cm_help()}" if cmd.name == "cm" else cmd.help
+        sub = subparsers.add_parser(cmd.name, help=cmd.help, description=description,
+                                    formatter_class=HelpFormatter)
+        for flags, kwargs in cmd.arguments:
+            if flags == "group":
+                target = sub.add_mutually_exclusive_group(required=kwargs["required"])
+                for group_flags, group_kwargs in kwargs["arguments"]:
+                    target.add_argument(*group_flags, **group_kwargs)
+            else:
+                sub.add_argument(*flags, **kwargs)
 
     return parser
 
 
-def main():
-    parser = argparser()
-    args = parser.parse_args()
+def _subcommand(argv: list[str]) -> str | None:
+    """ The subcommand in `argv`, skipping the global options. """
+    i = 0
+    while i < len(argv):
+        if argv[i] in ("-c", "--config", "-e", "--endpoint", "--trace-out"):
+            i += 2
+        elif argv[i].startswith("-"):
+            i += 1
+        else:
+            return argv[i]
+    return None
+
+
+def main(argv: list[str] = None, forward: bool = True):
+    argv = sys.argv[1:] if argv is None else argv
+    subcommand = _subcommand(argv)
+    # hand the command to `dboy serve` if it's running
+    if forward and not os.environ.get("DBOY_NO_DAEMON") and subcommand != "serve":
+        from .serve import forward as forward_to_daemon
+
+        status = forward_to_daemon(argv)
+        if status is not None:
+            sys.exit(status)
+
+    # anything else (no or an unknown subcommand) needs the full parser's help
+    parser = argparser(only=subcommand if subcommand in COMMANDS else None)
+    args = parser.parse_args(argv)
+
+    from .dockwrap.lazylog import configure
+    # force: a `dboy serve` child inherits the daemon's logging setup
+    configure(level="DEBUG" if args.debug else "WARNING", force=True)
 
     if args.config is not None:
-        cfg_file = args.config
+        args.cfg_file = args.config
     else:
-        cfg_file = ".dboy.yaml"
+        args.cfg_file = ".dboy.yaml"
 
-    # If this is set, we're running a `cfg` command which will generate a
-    # config file and exit.
-    if args.cmd == cmds["Config gen"]:
-        if args.build_cfg_interactive:
-            save_config(interactive_config_builder(), args.config)
-        else:
-            save_config(default_config(), args.config)
-    else:
-        if not os.path.exists(cfg_file):
+    if not (args.profile or args.trace_out):
+        return run(args)
+
+    from .dockwrap import trace
+
+    recorder = trace.add_hook(trace.Recorder())
+    try:
+        with trace.span(f"dboy {args.cmd}", [args.cmd]):
+            run(args)
+    finally:
+        trace.remove_hook(recorder)
+        if args.profile:
+            print(recorder.summary())
+        if args.trace_out:
+            recorder.write_chrome_trace(args.trace_out)
+            print(f"Wrote {len(recorder.spans)} spans to {args.trace_out}")
+
+
+def run(args):
+    cmd = COMMANDS[args.cmd]
+    my_container = None
+    endpoint = args.endpoint or os.environ.get("DBOY_ENDPOINT")
+    if endpoint:
+        from .dockwrap.endpoints import pin
+        pin(endpoint)
+
+    if cmd.needs_container:
+        from .utils.config import interactive_config_builder, load_config, save_config
+
+        if not os.path.exists(args.cfg_file):
             # Generate config
-            config = interactive_config_builder()
-            save_config(config, cfg_file)
-        else:
-            config = load_config(cfg_file)
+            save_config(interactive_config_builder(), args.cfg_file)
+
+        config = load_config(args.cfg_file)
 
         my_container = config.into_container()
 
-    match args.cmd:
-        case "b":
-            if args.rebuild:
-                my_container.rebuild()
-            else:
-                my_container.build_image()
-        case "r":
-            print(
-                f"We will remove the container after running: {args.post_removal}")
-            my_container.run(
-                args.run_cmd,
-                interactive=args.interactive,
-                post_removal=args.post_removal)
-
-            # if a container was created without --rm before, we need to remove
-            # it manually
-            if args.post_removal and DockerWrapper.does_container_exist(
-                    my_container.name):
-                my_container.remove()
-        # TODO: can be CM commands?
-        case "sd":
-            my_container.shutdown()
-        case "tb":
-            my_container.run("tensorboard --logdir tb_logs")
-        case "cm":
-            found_cmd = False
-            for method, cmd in DockerWrapper.get_commands().items():
-                if cmd == args.cm_cmd:
-                    found_cmd = True
-                    print(f"{cmd}: Running {method} with args {args.cm_args}")
-                    print(DockerWrapper.run_method(method, *args.cm_args))
-                    break
-            if not found_cmd:
-                print(f"Command {args.cm_cmd} not found")
-        case "cfg":
-            pass
-        case _:
-            print("Unknown command")
+    cmd.handler(args, my_container)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+import asyncio
+
+from typing import Iterable
+
+from .backends import get_backend
+from .backends.base import Backend, ContainerInfo, ImageInfo
+from .wrapper import DockerWrapper
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+def _snapshot() -> dict:
+    # only update a listing that was already taken, rather than make one
+    return DockerWrapper.state()._containers or {}
+
+
+class AsyncDockerWrapper:
+    """ asyncio counterpart of DockerWrapper's lifecycle and query methods.
+
+    Every call goes to the current backend (`get_backend()`) on a worker
+    thread, with at most `concurrency` of them in flight, so stopping or
+    polling many containers costs roughly the slowest call instead of the
+    sum of them:
+
+        async_docker = AsyncDockerWrapper(concurrency=16)
+        await async_docker.shutdown_many(names)
+    """
+
+    def __init__(self, concurrency: int = 8, backend: Backend = None):
+        # resolved now, since the endpoint can be thread-local
+        self.backend = backend or get_backend()
+        self.concurrency = concurrency
+        self._semaphore = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created lazily so it binds to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def _call(self, method: str, *args, **kwargs):
+        # the backends trace their own calls, one span per worker thread
+        async with self.semaphore:
+            return await asyncio.to_thread(getattr(self.backend, method), *args, **kwargs)
+
+    # queries
+
+    async def ps(self, all: bool = True) -> list[ContainerInfo]:
+        return await self._call("ps", all=all)
+
+    async def images(self) -> list[ImageInfo]:
+        return await self._call("images")
+
+    async def get_running_containers(self) -> list[str]:
+        return [c.name for c in await self.ps(all=False)]
+
+    async def get_all_containers(self) -> list[str]:
+        return [c.name for c in await self.ps(all=True)]
+
+    async def is_container_running(self, container_name: str) -> bool:
+        return container_name in await self.get_running_containers()
+
+    # lifecycle, keeping DockerWrapper's cached state in step like its own methods do
+
+    async def shutdown_container(self, container_name: str) -> bool:
+        ok = await self._call("stop", container_name)
+        if ok and container_name in _snapshot():
+            _snapshot()[container_name].state = "exited"
+        return ok
+
+    async def remove_container(self, container_name: str, force: bool = False) -> bool:
+        ok = await self._call("rm", container_name, force=force)
+        if ok:
+            _snapshot().pop(container_name, None)
+        return ok
+
+    async def kill_container(self, container_name: str) -> bool:
+        ok = await self._call("kill", container_name)
+        if ok and container_name in _snapshot():
+            _snapshot()[container_name].state = "exited"
+        return ok
+
+    async def exec(self, container_name: str, cmd: list[str]) -> tuple[int, str]:
+        """ Run `cmd` in a running container, returning (exit code, output). """
+        lines = []
+        returncode = await self._call("exec", container_name, cmd, interactive=False,
+                                      on_line=lines.append)
+        return returncode, "".join(f"{line}\n" for line in lines)
+
+    # bulk helpers
+
+    async def _many(self, method, container_names: Iterable[str], **kwargs) -> dict:
+        names = list(container_names)
+        results = await asyncio.gather(
+            *(method(name, **kwargs) for name in names), return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"{method.__name__} {name} failed: {result}")
+        return dict(zip(names, results))
+
+    async def shutdown_many(self, container_names: Iterable[str]) -> dict[str, bool]:
+        results = await self._many(self.shutdown_container, container_names)
+        return {name: result is True for name, result in results.items()}
+
+    async def remove_many(self, container_names: Iterable[str], force: bool = False) -> dict[str, bool]:
+        results = await self._many(self.remove_container, container_names, force=force)
+        return {name: result is True for name, result in results.items()}
+
+    async def kill_many(self, container_names: Iterable[str]) -> dict[str, bool]:
+        results = await self._many(self.kill_container, container_names)
+        return {name: result is True for name, result in results.items()}
+
+    async def exec_many(self, container_names: Iterable[str], cmd: list[str]) -> dict[str, tuple[int, str] | BaseException]:
+        """ Exec `cmd` in each container. A container whose exec raised maps
+        to the exception instead of (exit code, output).
+        """
+        return await self._many(self.exec, container_names, cmd=cmd)
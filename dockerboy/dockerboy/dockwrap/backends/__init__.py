@@ -0,0 +1,129 @@
+import threading
+import os
+
+from contextlib import contextmanager
+
+from .base import Backend, ContainerInfo, ImageInfo, NameInUse
+from .cli import CliBackend
+from ..lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+
+
+def __getattr__(name):
+    # the Engine API client pulls in http.client, only import it when used
+    if name in ("EngineBackend", "EngineError"):
+        from . import engine
+        return getattr(engine, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def socket_from_env() -> str:
+    host = os.environ.get("DOCKER_HOST", "")
+    if host.startswith("unix://"):
+        return host[len("unix://"):]
+    return DEFAULT_SOCKET
+
+# one backend per endpoint, None being the local daemon (see DOCKER_HOST)
+_backends: dict[str | None, Backend] = {}
+_endpoint: str | None = None
+# per thread overrides of _endpoint, see `using`
+_local = threading.local()
+
+
+def normalize_endpoint(endpoint: str | None) -> str | None:
+    """ "" and "default" (docker's own name for it) mean the local daemon. """
+    return None if endpoint in (None, "", "default") else endpoint
+
+
+def make_backend(kind: str = None, endpoint: str = None) -> Backend:
+    """ Build a backend by kind: "cli", "engine" or "auto" (the default).
+
+    "auto" uses the Engine API when the daemon socket answers a ping and
+    falls back to the docker CLI otherwise. The kind can also be set with
+    the DBOY_BACKEND environment variable.
+
+    `endpoint` is another daemon than the local one: a `unix://` socket
+    (spoken to like the local one), another `DOCKER_HOST` URL (`tcp://`,
+    `ssh://`, handed to the CLI as `-H`) or the name of a docker context.
+    """
+    kind = kind or os.environ.get("DBOY_BACKEND", "auto")
+
+    if endpoint is None:
+        cli = CliBackend()
+        socket_path = socket_from_env()
+    elif endpoint.startswith("unix://"):
+        cli = CliBackend(host=endpoint)
+        socket_path = endpoint[len("unix://"):]
+    elif "://" in endpoint:
+        # the Engine backend only speaks over a unix socket
+        return CliBackend(host=endpoint)
+    else:
+        return CliBackend(context=endpoint)
+
+    if kind == "cli":
+        return cli
+
+    if kind == "engine":
+        from .engine import EngineBackend
+        return EngineBackend(socket_path, fallback=cli)
+
+    if kind == "auto":
+        if os.path.exists(socket_path):
+            from .engine import EngineBackend
+            backend = EngineBackend(socket_path, fallback=cli)
+            if backend.ping():
+                return backend
+        logger.debug(
+            f"Docker socket {socket_path} not reachable, using the docker CLI")
+        return cli
+
+    raise ValueError(f"Unknown backend: {kind}")
+
+
+def current_endpoint() -> str | None:
+    return getattr(_local, "endpoint", _endpoint)
+
+
+def use_endpoint(endpoint: str | None):
+    """ Point `get_backend()` at `endpoint` from now on, in every thread. """
+    global _endpoint
+    _endpoint = normalize_endpoint(endpoint)
+
+
+@contextmanager
+def using(endpoint: str | None):
+    """ Point `get_backend()` at `endpoint` in this thread only, e.g. for
+    sweep jobs running on different daemons at once.
+    """
+    missing = object()
+    saved = getattr(_local, "endpoint", missing)
+    _local.endpoint = normalize_endpoint(endpoint)
+    try:
+        yield
+    finally:
+        if saved is missing:
+            del _local.endpoint
+        else:
+            _local.endpoint = saved
+
+
+def get_backend() -> Backend:
+    endpoint = current_endpoint()
+    backend = _backends.get(endpoint)
+    if backend is None:
+        backend = _backends[endpoint] = make_backend(endpoint=endpoint)
+    return backend
+
+
+def set_backend(backend: Backend):
+    """ Use `backend` for the current endpoint; None forgets every backend
+    made so far.
+    """
+    if backend is None:
+        _backends.clear()
+    else:
+        _backends[current_endpoint()] = backend
@@ -0,0 +1,187 @@
+# Plain classes rather than dataclasses: these are imported on every `dboy`
+# invocation and `dataclasses` alone costs ~10ms of startup (it imports
+# inspect).
+from collections.abc import Callable
+
+
+class NameInUse(Exception):
+    """ A container couldn't be created because another one has its name. """
+
+    def __init__(self, name: str):
+        super().__init__(f"The container name {name} is already in use")
+        self.name = name
+
+
+class ContainerInfo:
+    __slots__ = ("id", "name", "image", "state",
+                 "status", "command", "created", "ports", "labels")
+
+    def __init__(self, id: str, name: str, image: str, state: str,
+                 status: str = "", command: str = "", created: str = "", ports: str = "",
+                 labels: dict = None):
+        self.id = id
+        self.name = name
+        self.image = image
+        self.state = state
+        self.status = status
+        self.command = command
+        self.created = created
+        self.ports = ports
+        self.labels = labels or {}
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    def __eq__(self, other):
+        return isinstance(other, ContainerInfo) and all(
+            getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    def __repr__(self):
+        return f"ContainerInfo(id={self.id[:12]!r}, name={self.name!r}, image={self.image!r}, state={self.state!r})"
+
+
+class ImageInfo:
+    __slots__ = ("id", "repository", "tag")
+
+    def __init__(self, id: str, repository: str, tag: str):
+        self.id = id
+        self.repository = repository
+        self.tag = tag
+
+    @property
+    def refs(self) -> list[str]:
+        if self.repository == "<none>":
+            return [self.id]
+        return [self.id, self.repository, f"{self.repository}:{self.tag}"]
+
+    def __eq__(self, other):
+        return isinstance(other, ImageInfo) and (self.id, self.repository, self.tag) == \
+            (other.id, other.repository, other.tag)
+
+    def __repr__(self):
+        return f"ImageInfo(id={self.id!r}, repository={self.repository!r}, tag={self.tag!r})"
+
+
+class Backend:
+    """ The operations dockerboy needs from a docker daemon.
+
+    `ps`/`images` return structured records, mutating calls return True on
+    success, and `build`/`run`/`exec` return the process-style exit status.
+    Everything created is labelled and listings are filtered by the current
+    `labels` scope.
+    `build` takes a BuildContext (or a directory) and hands its output line by
+    line to `on_line`.
+    """
+    name = "base"
+
+    def ps(self, all: bool = True) -> list[ContainerInfo]:
+        raise NotImplementedError
+
+    def images(self) -> list[ImageInfo]:
+        raise NotImplementedError
+
+    def start(self, container: str) -> bool:
+        raise NotImplementedError
+
+    def stop(self, container: str) -> bool:
+        raise NotImplementedError
+
+    def kill(self, container: str) -> bool:
+        raise NotImplementedError
+
+    def rm(self, container: str, force: bool = False) -> bool:
+        raise NotImplementedError
+
+    def rmi(self, image: str) -> bool:
+        raise NotImplementedError
+
+    def commit(self, container: str, ref: str) -> bool:
+        raise NotImplementedError
+
+    def squash(self, container: str, ref: str, changes: list[str] = ()) -> bool:
+        """ Flatten a container's filesystem into a single-layer image `ref`
+        (export | import). The image config doesn't survive this, `changes`
+        (Dockerfile instructions like "ENV A=1") restore it.
+        """
+        raise NotImplementedError
+
+    def prune(self, kind: str) -> list[str]:
+        """ Remove every stopped container (`kind="containers"`) or dangling
+        image (`kind="images"`) in the current label scope, returning their
+        IDs. Refuses to run unscoped.
+        """
+        raise NotImplementedError
+
+    def disk_usage(self) -> int:
+        """ Bytes taken by image layers on the daemon. """
+        raise NotImplementedError
+
+    def info(self) -> dict | None:
+        """ The daemon's system info (NCPU, MemTotal, ContainersRunning, ...),
+        or None if it can't be reached.
+        """
+        raise NotImplementedError
+
+    def inspect_image(self, image: str) -> dict | None:
+        """ The daemon's record of an image (Id, Size, RootFS.Layers, Config,
+        ...), or None if it doesn't exist.
+        """
+        raise NotImplementedError
+
+    def inspect_images(self, images: list[str]) -> list[dict]:
+        """ `inspect_image` of each of `images` that exists. """
+        return [data for data in map(self.inspect_image, images) if data is not None]
+
+    def build(self, tag: str, context,
+              on_line: Callable[[str], None] | None = None) -> int:
+        raise NotImplementedError
+
+    def save(self, images: list[str], read: Callable):
+        """ Hand `docker save`'s tar of `images` to `read(fileobj)` as it is
+        produced, and return what it returns.
+        """
+        raise NotImplementedError
+
+    def load(self, archive, on_line: Callable[[str], None] | None = None) -> int:
+        """ `docker load` the tar a TarStream `archive` writes. """
+        raise NotImplementedError
+
+    def run(self, image: str, name: str, cmd: list[str],
+            volumes: list[tuple[str, str]] = (), workdir: str = None,
+            ports: list[tuple[int, int]] = (), interactive: bool = True,
+            remove: bool = True, gpus: bool = True, env: dict = None,
+            on_line: Callable[[str], None] | None = None) -> int:
+        """ Run a container to completion. With `on_line` its output is handed
+        over line by line instead of going to the terminal. Raises NameInUse
+        if another container already has `name`.
+        """
+        raise NotImplementedError
+
+    def run_detached(self, image: str, name: str, cmd: list[str],
+                     volumes: list[tuple[str, str]] = (), workdir: str = None,
+                     ports: list[tuple[int, int]] = (), gpus: bool = True,
+                     env: dict = None) -> bool:
+        """ Create and start a container in the background. """
+        raise NotImplementedError
+
+    def exec(self, container: str, cmd: list[str], interactive: bool = True,
+             env: dict = None, on_line: Callable[[str], None] | None = None) -> int:
+        """ Run `cmd` in a running container. With `on_line` its output is
+        handed over line by line instead of going to the terminal.
+        """
+        raise NotImplementedError
+
+    def logs(self, container: str, on_line: Callable[[str], None], follow: bool = False,
+             tail: int = None, timestamps: bool = True) -> int:
+        """ Hand a container's stdout/stderr to `on_line`. With `follow` this
+        returns once the container exits.
+        """
+        raise NotImplementedError
+
+    def events(self, on_event: Callable[[dict], None]) -> int:
+        """ Hand every container and image event from now on to `on_event`
+        as the daemon's JSON record (Type, Action, Actor.Attributes, time).
+        Blocks until the stream ends.
+        """
+        raise NotImplementedError
@@ -0,0 +1,321 @@
+# Imported on every `dboy` invocation, so modules that not every command
+# needs (json) are imported where they are used.
+import subprocess
+import re
+import os
+
+from collections.abc import Callable
+
+from .base import Backend, ContainerInfo, ImageInfo, NameInUse
+from ..labels import for_ref, filters
+from .. import trace
+from ..lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+
+def parse_ps(out: str) -> list[ContainerInfo]:
+    """ Parse `docker ps --format '{{json .}}'` output. """
+    import json
+
+    containers = []
+    for line in out.splitlines():
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        # older daemons don't report State, only the human Status
+        state = row.get("State") or (
+            "running" if row.get("Status", "").startswith("Up") else "exited")
+        # "a=1,b=2"
+        labels = dict(label.partition("=")[::2]
+                      for label in row.get("Labels", "").split(",") if label)
+        for name in row["Names"].split(","):
+            containers.append(ContainerInfo(
+                row["ID"], name, row["Image"], state, row.get("Status", ""),
+                row.get("Command", ""), row.get("CreatedAt", ""), row.get("Ports", ""),
+                labels))
+
+    return containers
+
+
+# docker prints sizes with decimal units, e.g. "1.234GB"
+SIZE_UNITS = {"B": 1, "kB": 10**3, "KB": 10**3, "MB": 10**6, "GB": 10**9, "TB": 10**12,
+              "PB": 10**15}
+
+
+def parse_size(size: str) -> int:
+    number, unit = re.fullmatch(r"([0-9.]+)\s*([kKMGTP]?B)", size.strip()).groups()
+    return int(float(number) * SIZE_UNITS[unit])
+
+
+def parse_images(out: str) -> list[ImageInfo]:
+    """ Parse `docker images --format '{{json .}}'` output. """
+    import json
+
+    images = []
+    for line in out.splitlines():
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        images.append(ImageInfo(row["ID"], row["Repository"], row["Tag"]))
+
+    return images
+
+
+class CliBackend(Backend):
+    """ Shells out to the `docker` CLI, one process per operation. `host` (a
+    `DOCKER_HOST` URL) or `context` points it at another daemon.
+    """
+    name = "cli"
+
+    def __init__(self, docker: str = "docker", host: str = None, context: str = None):
+        self.docker = docker
+        # before the subcommand, on every call
+        self.global_args = ["-H", host] if host else ["--context", context] if context else []
+
+    def _call(self, *args, capture: bool = True) -> subprocess.CompletedProcess:
+        cmd = [self.docker, *self.global_args, *args]
+        logger.debug(f"Running command: {' '.join(cmd)}")
+        with trace.span(f"docker {args[0]}", args) as span:
+            proc = subprocess.run(cmd, capture_output=capture)
+            span.status = proc.returncode
+            if capture:
+                span.out_bytes = len(proc.stdout) + len(proc.stderr)
+        return proc
+
+    def _stream(self, *args, on_line: Callable[[str], None], env: dict = None,
+                context=None) -> int:
+        """ Run a command and hand its merged stdout/stderr to `on_line` as it
+        arrives, without buffering the whole output. A `context` is streamed
+        to the command's stdin as a tar.
+        """
+        cmd = [self.docker, *self.global_args, *args]
+        logger.debug(f"Running command: {' '.join(cmd)}")
+        with trace.span(f"docker {args[0]}", args) as span, \
+                subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 stdin=subprocess.PIPE if context else None,
+                                 env={**os.environ, **(env or {})}) as proc:
+            writer = context.stream_to(proc.stdin) if context else None
+            for line in proc.stdout:
+                span.out_bytes += len(line)
+                on_line(line.decode(errors="replace").rstrip("\n"))
+            if writer is not None:
+                writer.join()
+            span.status = proc.wait()
+        return proc.returncode
+
+    def _ok(self, *args) -> bool:
+        proc = self._call(*args)
+        if proc.returncode != 0:
+            logger.warning(
+                f"docker {args[0]} failed: {proc.stderr.decode().strip()}")
+        return proc.returncode == 0
+
+    @staticmethod
+    def _filters() -> list[str]:
+        return [arg for label in filters() for arg in ("--filter", f"label={label}")]
+
+    def ps(self, all=True):
+        args = ["ps", "--no-trunc", *self._filters(), "--format", "{{json .}}"]
+        if all:
+            args.insert(1, "-a")
+        return parse_ps(self._call(*args).stdout.decode())
+
+    def images(self):
+        return parse_images(self._call("images", *self._filters(),
+                                       "--format", "{{json .}}").stdout.decode())
+
+    def start(self, container):
+        return self._ok("start", container)
+
+    def stop(self, container):
+        return self._ok("stop", container)
+
+    def kill(self, container):
+        return self._ok("kill", container)
+
+    def rm(self, container, force=False):
+        return self._ok("rm", *(["-f"] if force else []), container)
+
+    def rmi(self, image):
+        return self._ok("rmi", image)
+
+    def commit(self, container, ref):
+        import json
+
+        changes = [arg for key, value in for_ref(ref).items()
+                   for arg in ("--change", f"LABEL {key}={json.dumps(value)}")]
+        return self._ok("commit", *changes, container, ref)
+
+    def squash(self, container, ref, changes=()):
+        import json
+
+        changes = [*changes, *(f"LABEL {key}={json.dumps(value)}"
+                               for key, value in for_ref(ref).items())]
+        flags = [arg for change in changes for arg in ("--change", change)]
+        export_cmd = [self.docker, *self.global_args, "export", container]
+        import_cmd = [self.docker, *self.global_args, "import", *flags, "-", ref]
+        logger.debug(f"Running command: {' '.join(export_cmd)} | {' '.join(import_cmd)}")
+        with trace.span("docker squash", [container, ref]) as span:
+            exporter = subprocess.Popen(export_cmd, stdout=subprocess.PIPE)
+            importer = subprocess.Popen(import_cmd, stdin=exporter.stdout,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # only the importer holds the read end now, so it exiting early
+            # stops the exporter too
+            exporter.stdout.close()
+            _, err = importer.communicate()
+            span.status = exporter.wait() or importer.returncode
+        if span.status != 0:
+            logger.warning(f"squashing {container} into {ref} failed: {err.decode().strip()}")
+        return span.status == 0
+
+    def prune(self, kind):
+        if not filters():
+            raise ValueError("Refusing to prune outside of a project's label scope")
+        proc = self._call("container" if kind == "containers" else "image", "prune", "-f",
+                          *self._filters())
+        # "Deleted Containers:\n<id>\n...\n\nTotal reclaimed space: 1.2GB"
+        return [line.split()[-1] for line in proc.stdout.decode().splitlines()[1:]
+                if line.strip() and not line.startswith("Total")]
+
+    def disk_usage(self):
+        import json
+
+        proc = self._call("system", "df", "--format", "{{json .}}")
+        for line in proc.stdout.decode().splitlines():
+            row = json.loads(line)
+            if row["Type"] == "Images":
+                return parse_size(row["Size"])
+        return 0
+
+    def info(self):
+        import json
+
+        proc = self._call("info", "--format", "{{json .}}")
+        if proc.returncode != 0:
+            logger.warning(f"docker info failed: {proc.stderr.decode().strip()}")
+            return None
+        return json.loads(proc.stdout)
+
+    def inspect_image(self, image):
+        import json
+
+        proc = self._call("image", "inspect", image)
+        if proc.returncode != 0:
+            return None
+        return json.loads(proc.stdout)[0]
+
+    def inspect_images(self, images):
+        import json
+
+        if not images:
+            return []
+        # exits non-zero if any is missing, but still prints the others
+        proc = self._call("image", "inspect", *images)
+        return json.loads(proc.stdout or b"[]")
+
+    def build(self, tag, context, on_line: Callable[[str], None] | None = None):
+        if isinstance(context, str):
+            from ..utils.context import BuildContext
+            context = BuildContext(context)
+        # BuildKit only prints parseable step lines in plain progress mode
+        labels = [arg for key, value in for_ref(tag).items()
+                  for arg in ("--label", f"{key}={value}")]
+        return self._stream("build", "-t", tag, *labels, "-", on_line=on_line or print,
+                            env={"BUILDKIT_PROGRESS": "plain"}, context=context)
+
+    def save(self, images, read):
+        cmd = [self.docker, *self.global_args, "save", *images]
+        logger.debug(f"Running command: {' '.join(cmd)}")
+        with trace.span("docker save", images) as span, \
+                subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
+            result = read(proc.stdout)
+            proc.stdout.read()
+            err = proc.stderr.read()
+            span.status = proc.wait()
+        if span.status != 0:
+            raise RuntimeError(f"docker save failed: {err.decode().strip()}")
+        return result
+
+    def load(self, archive, on_line=None):
+        return self._stream("load", on_line=on_line or print, context=archive)
+
+    @staticmethod
+    def _run_options(name, volumes=(), workdir=None, ports=(), gpus=True, env=None,
+                     labels=None):
+        optional = []
+        for host_port, container_port in ports:
+            optional.extend(["-p", f"0.0.0.0:{host_port}:{container_port}"])
+
+        if gpus:
+            optional.extend(["--gpus", "all"])
+
+        optional.extend(["--name", name])
+        for host_dir, container_dir in volumes:
+            optional.extend(["-v", f"{host_dir}:{container_dir}"])
+
+        for key, value in (env or {}).items():
+            optional.extend(["-e", f"{key}={value}"])
+
+        for key, value in (labels or {}).items():
+            optional.extend(["--label", f"{key}={value}"])
+
+        if workdir is not None:
+            optional.extend(["-w", workdir])
+
+        return optional
+
+    def run(self, image, name, cmd, volumes=(), workdir=None, ports=(),
+            interactive=True, remove=True, gpus=True, env=None, on_line=None):
+        optional = []
+        if interactive:
+            optional.append("-it")
+
+        if remove:
+            optional.append("--rm")
+
+        optional.extend(self._run_options(name, volumes, workdir, ports, gpus, env,
+                                          for_ref(image)))
+
+        if on_line is not None:
+            status = self._stream("run", *optional, image, *cmd, on_line=on_line)
+        else:
+            status = self._call("run", *optional, image, *cmd, capture=False).returncode
+        # 125 is docker's own failure rather than the command's, the name
+        # being taken is the one worth telling apart
+        if status == 125 and self._call("container", "inspect", "--format", "{{.Id}}",
+                                        name).returncode == 0:
+            raise NameInUse(name)
+        return status
+
+    def run_detached(self, image, name, cmd, volumes=(), workdir=None, ports=(),
+                     gpus=True, env=None):
+        optional = self._run_options(name, volumes, workdir, ports, gpus, env, for_ref(image))
+        return self._ok("run", "-d", *optional, image, *cmd)
+
+    def exec(self, container, cmd, interactive=True, env=None, on_line=None):
+        flags = ["-it"] if interactive else []
+        for key, value in (env or {}).items():
+            flags.extend(["-e", f"{key}={value}"])
+
+        if on_line is not None:
+            return self._stream("exec", *flags, container, *cmd, on_line=on_line)
+
+        return self._call("exec", *flags, container, *cmd,
+                          capture=False).returncode
+
+    def logs(self, container, on_line, follow=False, tail=None, timestamps=True):
+        flags = ["--timestamps"] if timestamps else []
+        if follow:
+            flags.append("--follow")
+        if tail is not None:
+            flags.extend(["--tail", str(tail)])
+        return self._stream("logs", *flags, container, on_line=on_line)
+
+    def events(self, on_event):
+        import json
+
+        return self._stream("events", "--format", "{{json .}}", "--filter", "type=container",
+                            "--filter", "type=image",
+                            on_line=lambda line: on_event(json.loads(line)))
@@ -0,0 +1,522 @@
+import http.client
+import socket
+import os
+import queue
+import json
+import re
+import sys
+
+from datetime import datetime
+from urllib.parse import urlencode, quote
+from typing import Callable, Optional
+
+from . import DEFAULT_SOCKET
+from .base import Backend, ContainerInfo, ImageInfo, NameInUse
+from .cli import CliBackend
+from ..labels import for_ref, filters
+from .. import trace
+from ..utils.context import BuildContext
+from ..lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+# container/exec/image IDs in a URL, so spans group by endpoint
+ROUTE_IDS = re.compile(r"/(containers|exec|images)/(?!json$|create$)[^/]+")
+
+
+class EngineError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ConnectionPool:
+    """ Keeps up to `size` idle keep-alive connections to the daemon socket.
+
+    Connections are handed out LIFO so the warmest one is reused first; if
+    the pool is empty a new connection is opened. A forked child (`dboy
+    serve` runs every command in one) starts with an empty pool instead of
+    sharing its parent's sockets.
+    """
+
+    def __init__(self, socket_path: str, size: int = 4, timeout: float = None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._pid = os.getpid()
+
+    def get(self) -> UnixHTTPConnection:
+        if self._pid != os.getpid():
+            self._idle = queue.LifoQueue(maxsize=self.size)
+            self._pid = os.getpid()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return UnixHTTPConnection(self.socket_path, self.timeout)
+
+    def put(self, conn: UnixHTTPConnection):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class LineWriter:
+    """ File-like sink that hands complete lines to a callback. """
+
+    def __init__(self, on_line: Callable[[str], None]):
+        self.on_line = on_line
+        self._partial = b""
+
+    def write(self, data: bytes):
+        *lines, self._partial = (self._partial + data).split(b"\n")
+        for line in lines:
+            self.on_line(line.decode(errors="replace"))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._partial:
+            self.on_line(self._partial.decode(errors="replace"))
+            self._partial = b""
+
+
+def read_multiplexed(response, out=None, err=None):
+    """ Demultiplex a non-TTY attach/logs/exec stream into out and err. """
+    out = out or sys.stdout.buffer
+    err = err or sys.stderr.buffer
+    while True:
+        header = response.read(8)
+        if len(header) < 8:
+            break
+        size = int.from_bytes(header[4:], "big")
+        payload = response.read(size)
+        target = err if header[0] == 2 else out
+        target.write(payload)
+        target.flush()
+
+
+class EngineBackend(Backend):
+    """ Speaks the Docker Engine HTTP API over the daemon's unix socket.
+
+    Requests reuse pooled keep-alive connections, so a query costs a round
+    trip on an open socket instead of a fork/exec of the docker CLI.
+    Interactive `run`/`exec` need a hijacked TTY and are delegated to
+    `fallback` (the CLI backend).
+    """
+    name = "engine"
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, pool_size: int = 4,
+                 fallback: Backend = None):
+        self.socket_path = socket_path
+        self.pool = ConnectionPool(socket_path, pool_size)
+        self.fallback = fallback or CliBackend()
+
+    def request(self, method: str, url: str, body=None, headers: dict = None,
+                query: dict = None, stream: bool = False):
+        """ Send a request and return (status, data).
+
+        With `stream=True` the open response is returned instead of its body;
+        call `release(conn, response)` once it has been consumed.
+        """
+        if query:
+            url = f"{url}?{urlencode({k: v for k, v in query.items() if v is not None}, doseq=True)}"
+
+        headers = dict(headers or {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+
+        with trace.span(f"engine {method} {_route(url)}", [method, url]) as span:
+            # a pooled connection may have been closed by the daemon in the
+            # meantime, retry once on a fresh one
+            for attempt in range(2):
+                conn = self.pool.get()
+                try:
+                    conn.request(method, url, body=body, headers=headers)
+                    response = conn.getresponse()
+                    break
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    conn.close()
+                    # a streamed body can't be replayed
+                    if attempt == 1 or not isinstance(body, (bytes, type(None))):
+                        raise
+            span.status, span.http = response.status, True
+
+            if stream:
+                if response.status >= 400:
+                    data = response.read()
+                    self.release(conn, response)
+                    raise EngineError(response.status, _error_message(data))
+                # the body is read by the caller, outside of this span
+                return conn, response
+
+            data = response.read()
+            span.out_bytes = len(data)
+            self.release(conn, response)
+
+        if response.status >= 400:
+            raise EngineError(response.status, _error_message(data))
+
+        if data and response.getheader("Content-Type", "").startswith("application/json"):
+            data = json.loads(data)
+
+        return response.status, data
+
+    def release(self, conn, response):
+        # drain whatever is left so the connection is ready for reuse
+        response.read()
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.put(conn)
+
+    def ping(self) -> bool:
+        try:
+            status, _ = self.request("GET", "/_ping")
+        except (OSError, EngineError, http.client.HTTPException):
+            return False
+        return status == 200
+
+    def _ok(self, method: str, url: str, **kwargs) -> bool:
+        try:
+            self.request(method, url, **kwargs)
+        except EngineError as e:
+            logger.warning(f"{method} {url} failed: {e.message}")
+            return False
+        return True
+
+    @staticmethod
+    def _filters() -> str | None:
+        labels = filters()
+        return json.dumps({"label": labels}) if labels else None
+
+    def ps(self, all=True):
+        _, rows = self.request("GET", "/containers/json",
+                               query={"all": int(all), "filters": self._filters()})
+
+        containers = []
+        for row in rows:
+            ports = ", ".join(
+                f"{p.get('IP', '')}:{p['PublicPort']}->{p['PrivatePort']}/{p['Type']}"
+                if "PublicPort" in p else f"{p['PrivatePort']}/{p['Type']}"
+                for p in row.get("Ports") or [])
+            created = datetime.fromtimestamp(row.get("Created", 0)).isoformat(" ")
+            for name in row["Names"]:
+                containers.append(ContainerInfo(
+                    row["Id"], name.lstrip("/"), row["Image"], row["State"],
+                    row.get("Status", ""), row.get("Command", ""), created, ports,
+                    row.get("Labels")))
+
+        return containers
+
+    def images(self):
+        _, rows = self.request("GET", "/images/json", query={"filters": self._filters()})
+
+        images = []
+        for row in rows:
+            image_id = row["Id"].split(":")[-1][:12]
+            tags = row.get("RepoTags") or ["<none>:<none>"]
+            for tag in tags:
+                repository, _, tag = tag.rpartition(":")
+                images.append(ImageInfo(image_id, repository, tag))
+
+        return images
+
+    def start(self, container):
+        return self._ok("POST", f"/containers/{quote(container)}/start")
+
+    def stop(self, container):
+        return self._ok("POST", f"/containers/{quote(container)}/stop")
+
+    def kill(self, container):
+        return self._ok("POST", f"/containers/{quote(container)}/kill")
+
+    def rm(self, container, force=False):
+        return self._ok("DELETE", f"/containers/{quote(container)}",
+                        query={"force": 1} if force else None)
+
+    def rmi(self, image):
+        return self._ok("DELETE", f"/images/{quote(image)}")
+
+    def commit(self, container, ref):
+        repo, _, tag = ref.partition(":")
+        labels = for_ref(ref)
+        # the daemon merges this into the container's own config
+        return self._ok("POST", "/commit",
+                        query={"container": container, "repo": repo, "tag": tag or None},
+                        body={"Labels": labels} if labels else None)
+
+    @trace.traced("engine squash")
+    def squash(self, container, ref, changes=()):
+        repo, _, tag = ref.partition(":")
+        changes = [*changes, *(f"LABEL {key}={json.dumps(value)}"
+                               for key, value in for_ref(ref).items())]
+        try:
+            export_conn, export = self.request(
+                "GET", f"/containers/{quote(container)}/export", stream=True)
+        except EngineError as e:
+            logger.warning(f"exporting {container} failed: {e.message}")
+            return False
+        try:
+            # the export is piped straight into the import as a chunked body
+            conn, response = self.request(
+                "POST", "/images/create", body=iter(lambda: export.read(1 << 16), b""),
+                query={"fromSrc": "-", "repo": repo, "tag": tag or None, "changes": changes},
+                headers={"Content-Type": "application/x-tar"}, stream=True)
+        except EngineError as e:
+            logger.warning(f"importing {container} as {ref} failed: {e.message}")
+            return False
+        finally:
+            self.release(export_conn, export)
+
+        ok = True
+        for raw in response:
+            if raw.strip() and "error" in json.loads(raw):
+                logger.warning(f"squashing {container} into {ref} failed: "
+                               f"{json.loads(raw)['error']}")
+                ok = False
+        self.release(conn, response)
+        return ok
+
+    def prune(self, kind):
+        if not filters():
+            raise ValueError("Refusing to prune outside of a project's label scope")
+        query = {"filters": self._filters()}
+        if kind == "images":
+            # only untagged images, like `docker image prune` without -a
+            query["filters"] = json.dumps({"label": filters(), "dangling": ["true"]})
+        _, result = self.request("POST", f"/{kind}/prune", query=query)
+        key = "ContainersDeleted" if kind == "containers" else "ImagesDeleted"
+        return [entry if isinstance(entry, str) else entry.get("Deleted") or entry.get("Untagged")
+                for entry in result.get(key) or []]
+
+    def disk_usage(self):
+        _, data = self.request("GET", "/system/df")
+        return data.get("LayersSize", 0)
+
+    def info(self):
+        try:
+            _, info = self.request("GET", "/info")
+        except (OSError, EngineError, http.client.HTTPException) as e:
+            logger.warning(f"GET /info failed: {e}")
+            return None
+        return info
+
+    def inspect_image(self, image):
+        try:
+            _, data = self.request("GET", f"/images/{quote(image)}/json")
+        except EngineError as e:
+            if e.status == 404:
+                return None
+            raise
+        return data
+
+    @trace.traced("engine build")
+    def build(self, tag, context, on_line: Optional[Callable[[str], None]] = None):
+        on_line = on_line or print
+        if isinstance(context, str):
+            context = BuildContext(context)
+
+        # without a Content-Length the tar goes out as a chunked body while
+        # it is being written
+        labels = for_ref(tag)
+        conn, response = self.request(
+            "POST", "/build", body=context.chunks(),
+            query={"t": tag, "labels": json.dumps(labels) if labels else None},
+            headers={"Content-Type": "application/x-tar"}, stream=True)
+
+        status = 0
+        for raw in response:
+            if not raw.strip():
+                continue
+            message = json.loads(raw)
+            if "error" in message:
+                status = 1
+                on_line(message["error"].rstrip("\n"))
+            for line in message.get("stream", "").splitlines():
+                on_line(line)
+        self.release(conn, response)
+
+        return status
+
+    def save(self, images, read):
+        conn, response = self.request("GET", "/images/get", query={"names": list(images)},
+                                      stream=True)
+        try:
+            return read(response)
+        finally:
+            self.release(conn, response)
+
+    @trace.traced("engine load")
+    def load(self, archive, on_line=None):
+        on_line = on_line or print
+        conn, response = self.request(
+            "POST", "/images/load", body=archive.chunks(), query={"quiet": 1},
+            headers={"Content-Type": "application/x-tar"}, stream=True)
+
+        status = 0
+        for raw in response:
+            if not raw.strip():
+                continue
+            message = json.loads(raw)
+            if "error" in message:
+                status = 1
+                on_line(message["error"].rstrip("\n"))
+            for line in message.get("stream", "").splitlines():
+                on_line(line)
+        self.release(conn, response)
+
+        return status
+
+    @trace.traced("engine run")
+    def run(self, image, name, cmd, volumes=(), workdir=None, ports=(),
+            interactive=True, remove=True, gpus=True, env=None, on_line=None):
+        if interactive:
+            return self.fallback.run(image, name, cmd, volumes, workdir, ports,
+                                     interactive, remove, gpus, env, on_line)
+
+        try:
+            container_id = self._create(image, name, cmd, volumes, workdir, ports, gpus, env)
+        except EngineError as e:
+            if e.status == 409:
+                raise NameInUse(name) from e
+            raise
+        self.request("POST", f"/containers/{container_id}/start")
+        conn, response = self.request(
+            "GET", f"/containers/{container_id}/logs",
+            query={"follow": 1, "stdout": 1, "stderr": 1}, stream=True)
+        if on_line is not None:
+            writer = LineWriter(on_line)
+            read_multiplexed(response, writer, writer)
+            writer.close()
+        else:
+            read_multiplexed(response)
+        self.release(conn, response)
+
+        _, result = self.request("POST", f"/containers/{container_id}/wait")
+        # removal is done here rather than with AutoRemove so that waiting on
+        # the exit code can't race the daemon deleting the container
+        if remove:
+            self.rm(container_id)
+
+        return result["StatusCode"]
+
+    def run_detached(self, image, name, cmd, volumes=(), workdir=None, ports=(),
+                     gpus=True, env=None):
+        try:
+            container_id = self._create(image, name, cmd, volumes, workdir, ports, gpus, env)
+        except EngineError as e:
+            logger.warning(f"create {name} failed: {e}")
+            return False
+        return self._ok("POST", f"/containers/{container_id}/start")
+
+    def _create(self, image, name, cmd, volumes, workdir, ports, gpus, env) -> str:
+        host_config = {
+            "Binds": [f"{host_dir}:{container_dir}" for host_dir, container_dir in volumes],
+            "PortBindings": {f"{c}/tcp": [{"HostIp": "0.0.0.0", "HostPort": str(h)}]
+                             for h, c in ports},
+        }
+        if gpus:
+            host_config["DeviceRequests"] = [
+                {"Count": -1, "Capabilities": [["gpu"]]}]
+
+        _, created = self.request("POST", "/containers/create", query={"name": name}, body={
+            "Image": image,
+            "Cmd": list(cmd),
+            "WorkingDir": workdir or "",
+            "Env": [f"{key}={value}" for key, value in (env or {}).items()],
+            "ExposedPorts": {f"{c}/tcp": {} for _, c in ports},
+            "Labels": for_ref(image),
+            "HostConfig": host_config,
+        })
+        return created["Id"]
+
+    @trace.traced("engine exec")
+    def exec(self, container, cmd, interactive=True, env=None, on_line=None):
+        if interactive:
+            return self.fallback.exec(container, cmd, interactive, env, on_line)
+
+        body = {"Cmd": list(cmd), "AttachStdout": True, "AttachStderr": True}
+        if env:
+            body["Env"] = [f"{key}={value}" for key, value in env.items()]
+        _, created = self.request("POST", f"/containers/{quote(container)}/exec", body=body)
+        exec_id = created["Id"]
+
+        conn, response = self.request(
+            "POST", f"/exec/{exec_id}/start",
+            body={"Detach": False, "Tty": False}, stream=True)
+        if on_line is not None:
+            writer = LineWriter(on_line)
+            read_multiplexed(response, writer, writer)
+            writer.close()
+        else:
+            read_multiplexed(response)
+        self.release(conn, response)
+
+        _, result = self.request("GET", f"/exec/{exec_id}/json")
+        return result["ExitCode"]
+
+    def logs(self, container, on_line, follow=False, tail=None, timestamps=True):
+        try:
+            conn, response = self.request(
+                "GET", f"/containers/{quote(container)}/logs", stream=True, query={
+                    "follow": int(follow), "stdout": 1, "stderr": 1,
+                    "timestamps": int(timestamps), "tail": tail})
+        except EngineError as e:
+            logger.warning(f"logs {container} failed: {e.message}")
+            return 1
+
+        writer = LineWriter(on_line)
+        read_multiplexed(response, writer, writer)
+        writer.close()
+        self.release(conn, response)
+        return 0
+
+    def events(self, on_event):
+        try:
+            conn, response = self.request("GET", "/events", stream=True, query={
+                "filters": json.dumps({"type": ["container", "image"]})})
+        except EngineError as e:
+            logger.warning(f"events failed: {e.message}")
+            return 1
+
+        for line in response:
+            if line.strip():
+                on_event(json.loads(line))
+        self.release(conn, response)
+        return 0
+
+
+def _route(url: str) -> str:
+    return ROUTE_IDS.sub(r"/\1/{id}", url.split("?")[0])
+
+
+def _error_message(data: bytes) -> str:
+    try:
+        return json.loads(data)["message"]
+    except (ValueError, KeyError, TypeError):
+        return data.decode(errors="replace").strip()
@@ -0,0 +1,566 @@
+""" A fake Docker Engine API server on a local unix socket.
+
+It keeps containers and images in memory and implements just the endpoints
+`EngineBackend` uses, so the backend can be exercised without a daemon:
+
+    with FakeEngine("/tmp/fake.sock") as engine:
+        backend = EngineBackend(engine.socket_path)
+        backend.run("img", "c", ["echo", "hi"], interactive=False)
+"""
+import socketserver
+import threading
+import tarfile
+import hashlib
+import json
+import time
+import re
+import os
+import io
+
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+
+
+def _id(*parts) -> str:
+    return hashlib.sha256(":".join(map(str, parts)).encode()).hexdigest()
+
+
+def _labelled(labels: dict, filters: str | None) -> bool:
+    """ Does an object with `labels` pass a `filters={"label": [...]}` query? """
+    if not filters:
+        return True
+    for label in json.loads(filters).get("label", []):
+        key, has_value, value = label.partition("=")
+        if key not in labels or (has_value and labels[key] != value):
+            return False
+    return True
+
+
+def layer_content(digest: str) -> bytes:
+    """ Stands in for a layer's tar in /images/get and /images/load. """
+    return f"files of {digest}\n".encode() * 1000
+
+
+def chain_ids(diff_ids: list[str]) -> list[str]:
+    chains = []
+    for diff_id in diff_ids:
+        if chains:
+            diff_id = "sha256:" + hashlib.sha256(f"{chains[-1]} {diff_id}".encode()).hexdigest()
+        chains.append(diff_id)
+    return chains
+
+
+def default_exec_handler(cmd: list[str]) -> tuple[bytes, int]:
+    """ Pretend every command echoes its arguments and succeeds. """
+    return (" ".join(cmd) + "\n").encode(), 0
+
+
+class FakeEngine:
+    def __init__(self, socket_path: str, exec_handler=default_exec_handler,
+                 ncpu: int = None, mem_total: int = 8 << 30):
+        self.socket_path = socket_path
+        self.exec_handler = exec_handler
+        # what /info reports, e.g. to tell several fake hosts apart
+        self.ncpu = ncpu or os.cpu_count()
+        self.mem_total = mem_total
+        self.containers: dict[str, dict] = {}
+        self.images: dict[str, dict] = {}
+        self.execs: dict[str, dict] = {}
+        # layer digest -> bytes, for /system/df
+        self.layer_sizes: dict[str, int] = {}
+        # layers whose tar /images/load had to read, in order
+        self.loaded_layers: list[str] = []
+        # served by /events, appended as requests change containers and images
+        self.events: list[dict] = []
+        self.requests: list[tuple[str, str]] = []
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self._server = None
+        self._thread = None
+
+    # state helpers
+    def add_image(self, ref: str, labels: dict = None, layers: list[str] = None,
+                  size: int = 0) -> dict:
+        if ":" not in ref.rsplit("/", 1)[-1]:
+            ref = f"{ref}:latest"
+        image = {"Id": f"sha256:{_id('image', ref, time.time())}",
+                 "RepoTags": [ref], "Created": int(time.time()),
+                 "Size": size, "Labels": labels or {},
+                 "RootFS": {"Type": "layers",
+                            "Layers": layers or [f"sha256:{_id('layer', ref, time.time())}"]}}
+        # whatever the known layers don't account for is spread over the new ones
+        new = [layer for layer in image["RootFS"]["Layers"] if layer not in self.layer_sizes]
+        known = sum(self.layer_sizes.get(layer, 0) for layer in image["RootFS"]["Layers"])
+        for layer in new:
+            self.layer_sizes[layer] = max(size - known, 0) // len(new)
+        # a re-tagged reference moves off the old image
+        for other in self.images.values():
+            if ref in other["RepoTags"]:
+                other["RepoTags"].remove(ref)
+        self.images[image["Id"]] = image
+        return image
+
+    def find_image(self, ref: str):
+        full = ref if ":" in ref.rsplit("/", 1)[-1] else f"{ref}:latest"
+        for image in self.images.values():
+            if full in image["RepoTags"] or image["Id"].split(":")[-1].startswith(ref) \
+                    or image["Id"] == ref:
+                return image
+        return None
+
+    def find_container(self, name_or_id: str):
+        for container in self.containers.values():
+            if container["Name"] == name_or_id or container["Id"].startswith(name_or_id):
+                return container
+        return None
+
+    def emit(self, type: str, action: str, actor_id: str, attributes: dict):
+        """ Record an event, with the lock held. """
+        now = time.time_ns()
+        self.events.append({"Type": type, "Action": action,
+                            "Actor": {"ID": actor_id, "Attributes": attributes},
+                            "time": now // 10**9, "timeNano": now})
+        self.changed.notify_all()
+
+    def fingerprint(self) -> tuple[dict, dict]:
+        return ({c["Id"]: (c["State"], c["Name"], dict(c["Labels"]))
+                 for c in self.containers.values()},
+                {i["Id"]: tuple(i["RepoTags"]) for i in self.images.values()})
+
+    def emit_changes(self, before: tuple[dict, dict]):
+        """ The events the daemon would have sent for what changed since `before`. """
+        (containers, images), (now_containers, now_images) = before, self.fingerprint()
+        for container_id in containers.keys() | now_containers.keys():
+            old, new = containers.get(container_id), now_containers.get(container_id)
+            if old == new:
+                continue
+            state, name, labels = new or old
+            action = ("destroy" if new is None else "create" if old is None and state == "created"
+                      else "start" if state == "running" else "die")
+            self.emit("container", action, container_id, {**labels, "name": name})
+        for image_id in images.keys() | now_images.keys():
+            old, new = images.get(image_id), now_images.get(image_id)
+            if old != new:
+                action = "delete" if new is None else "tag" if new else "untag"
+                self.emit("image", action, image_id, {"name": (new or old or ("",))[0]})
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        engine = self
+
+        class Handler(_Handler):
+            pass
+        Handler.engine = engine
+
+        self._server = _Server(self.socket_path, Handler)
+        # a short poll interval so stop() doesn't hold up every test by 0.5s
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    engine: FakeEngine = None
+
+    routes = [
+        ("GET", r"/_ping", "ping"),
+        ("GET", r"/info", "info"),
+        ("GET", r"/containers/json", "containers_json"),
+        ("GET", r"/images/json", "images_json"),
+        ("GET", r"/images/(?P<i>.+)/json", "inspect_image"),
+        ("POST", r"/images/prune", "prune_images"),
+        ("GET", r"/images/get", "save"),
+        ("POST", r"/images/load", "load"),
+        ("POST", r"/containers/prune", "prune_containers"),
+        ("GET", r"/system/df", "df"),
+        ("POST", r"/images/create", "import_image"),
+        ("GET", r"/containers/(?P<c>[^/]+)/export", "export"),
+        ("POST", r"/containers/create", "create"),
+        ("POST", r"/containers/(?P<c>[^/]+)/start", "start"),
+        ("POST", r"/containers/(?P<c>[^/]+)/stop", "stop"),
+        ("POST", r"/containers/(?P<c>[^/]+)/kill", "stop"),
+        ("POST", r"/containers/(?P<c>[^/]+)/wait", "wait"),
+        ("GET", r"/containers/(?P<c>[^/]+)/logs", "logs"),
+        ("POST", r"/containers/(?P<c>[^/]+)/exec", "exec_create"),
+        ("DELETE", r"/containers/(?P<c>[^/]+)", "remove"),
+        ("DELETE", r"/images/(?P<i>.+)", "remove_image"),
+        ("POST", r"/commit", "commit"),
+        ("POST", r"/build", "build"),
+        ("POST", r"/exec/(?P<e>[^/]+)/start", "exec_start"),
+        ("GET", r"/exec/(?P<e>[^/]+)/json", "exec_json"),
+        ("GET", r"/events", "events"),
+    ]
+    # these hold the connection open and take the lock themselves
+    streaming = {"events"}
+
+    def log_message(self, *args):
+        pass
+
+    def _dispatch(self):
+        url = urlparse(self.path)
+        path = re.sub(r"^/v[0-9.]+", "", url.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.engine.requests.append((self.command, path))
+
+        for method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, path)
+            if method == self.command and match:
+                kwargs = {k: unquote(v) for k, v in match.groupdict().items()}
+                if handler in self.streaming:
+                    return getattr(self, handler)(**kwargs)
+                with self.engine.lock:
+                    before = self.engine.fingerprint()
+                    getattr(self, handler)(**kwargs)
+                    self.engine.emit_changes(before)
+                    return
+
+        self.send_json({"message": f"page not found: {path}"}, 404)
+
+    do_GET = do_POST = do_DELETE = _dispatch
+
+    # plumbing
+    def body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b"".join(chunks)
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def json_body(self):
+        data = self.body()
+        return json.loads(data) if data else {}
+
+    def send_json(self, obj, status=200):
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_empty(self, status=204):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_stream(self, payload: bytes, content_type="application/vnd.docker.raw-stream"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def not_found(self, what):
+        self.send_json({"message": f"No such container or image: {what}"}, 404)
+
+    @staticmethod
+    def frame(data: bytes, stream: int = 1) -> bytes:
+        return bytes([stream, 0, 0, 0]) + len(data).to_bytes(4, "big") + data
+
+    # endpoints
+    def ping(self):
+        self.send_stream(b"OK", "text/plain")
+
+    def info(self):
+        running = sum(c["State"] == "running" for c in self.engine.containers.values())
+        self.send_json({"NCPU": self.engine.ncpu, "MemTotal": self.engine.mem_total,
+                        "Containers": len(self.engine.containers),
+                        "ContainersRunning": running})
+
+    def containers_json(self):
+        show_all = self.query.get("all") in ("1", "true")
+        self.send_json([
+            {"Id": c["Id"], "Names": ["/" + c["Name"]], "Image": c["Image"],
+             "Command": " ".join(c["Cmd"]), "Created": c["Created"],
+             "State": c["State"], "Status": "Up" if c["State"] == "running" else "Exited (0)",
+             "Ports": [], "Labels": c["Labels"]}
+            for c in self.engine.containers.values()
+            if (show_all or c["State"] == "running")
+            and _labelled(c["Labels"], self.query.get("filters"))])
+
+    def images_json(self):
+        self.send_json([i for i in self.engine.images.values()
+                        if _labelled(i["Labels"], self.query.get("filters"))])
+
+    def prune_containers(self):
+        deleted = [c["Id"] for c in list(self.engine.containers.values())
+                   if c["State"] != "running" and _labelled(c["Labels"], self.query.get("filters"))]
+        for container_id in deleted:
+            del self.engine.containers[container_id]
+        self.send_json({"ContainersDeleted": deleted, "SpaceReclaimed": 0})
+
+    def prune_images(self):
+        used = {c["Image"] for c in self.engine.containers.values()}
+        deleted = [i["Id"] for i in list(self.engine.images.values())
+                   if not i["RepoTags"] and i["Id"] not in used
+                   and _labelled(i["Labels"], self.query.get("filters"))]
+        for image_id in deleted:
+            del self.engine.images[image_id]
+        self.send_json({"ImagesDeleted": [{"Deleted": i} for i in deleted], "SpaceReclaimed": 0})
+
+    def df(self):
+        layers = {layer for i in self.engine.images.values() for layer in i["RootFS"]["Layers"]}
+        self.send_json({"LayersSize": sum(self.engine.layer_sizes.get(l, 0) for l in layers)})
+
+    def inspect_image(self, i):
+        image = self.engine.find_image(i)
+        if image is None:
+            return self.not_found(i)
+        self.send_json({**image, "Config": {"Labels": image["Labels"]}})
+
+    def save(self):
+        """ The classic docker-archive layout, one directory per layer. """
+        buf = io.BytesIO()
+        manifest = []
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            def add(name, data):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+            for ref in parse_qs(urlparse(self.path).query).get("names", []):
+                image = self.engine.find_image(ref)
+                if image is None:
+                    return self.not_found(ref)
+                config = json.dumps({"config": {"Labels": image["Labels"]},
+                                     "rootfs": {"type": "layers",
+                                                "diff_ids": image["RootFS"]["Layers"]}}).encode()
+                config_name = f"{hashlib.sha256(config).hexdigest()}.json"
+                add(config_name, config)
+                paths = []
+                for layer in image["RootFS"]["Layers"]:
+                    paths.append(f"{layer.split(':')[-1]}/layer.tar")
+                    add(paths[-1], layer_content(layer))
+                manifest.append({"Config": config_name, "Layers": paths,
+                                 "RepoTags": image["RepoTags"]})
+            add("manifest.json", json.dumps(manifest).encode())
+        self.send_stream(buf.getvalue(), "application/x-tar")
+
+    def load(self):
+        present = {chain for image in self.engine.images.values()
+                   for chain in chain_ids(image["RootFS"]["Layers"])}
+        with tarfile.open(fileobj=io.BytesIO(self.body())) as tar:
+            files = {m.name: tar.extractfile(m).read() for m in tar.getmembers() if m.isfile()}
+
+        messages = []
+        for entry in json.loads(files["manifest.json"]):
+            config = json.loads(files[entry["Config"]])
+            diff_ids = config["rootfs"]["diff_ids"]
+            for path, diff_id, chain in zip(entry["Layers"], diff_ids, chain_ids(diff_ids)):
+                if chain in present:
+                    continue
+                if path not in files:
+                    return self.send_json({"message": f"open {path}: no such file or directory"},
+                                          500)
+                self.engine.loaded_layers.append(diff_id)
+            for ref in entry["RepoTags"]:
+                image = self.engine.add_image(ref, config["config"]["Labels"], layers=diff_ids)
+                # the ID is the config's digest
+                del self.engine.images[image["Id"]]
+                image["Id"] = f"sha256:{hashlib.sha256(files[entry['Config']]).hexdigest()}"
+                self.engine.images[image["Id"]] = image
+                messages.append({"stream": f"Loaded image: {ref}\n"})
+
+        self.send_stream(b"".join(json.dumps(m).encode() + b"\r\n" for m in messages),
+                         "application/json")
+
+    def export(self, c):
+        container = self.engine.find_container(c)
+        if container is None:
+            return self.not_found(c)
+        self.send_stream(f"rootfs of {container['Id']}".encode(), "application/x-tar")
+
+    def import_image(self):
+        data = self.body()
+        # parse_qs again, `changes` can repeat
+        changes = parse_qs(urlparse(self.path).query).get("changes", [])
+        labels = {}
+        for change in changes:
+            if change.startswith("LABEL "):
+                key, _, value = change[len("LABEL "):].partition("=")
+                labels[key] = json.loads(value)
+        ref = self.query["repo"] + (f":{self.query['tag']}" if self.query.get("tag") else "")
+        image = self.engine.add_image(ref, labels, size=len(data))
+        self.send_stream(json.dumps({"status": image["Id"]}).encode() + b"\r\n",
+                         "application/json")
+
+    def create(self):
+        spec = self.json_body()
+        name = self.query.get("name") or _id("name", time.time())[:12]
+        if self.engine.find_image(spec["Image"]) is None:
+            return self.not_found(spec["Image"])
+        if self.engine.find_container(name) is not None:
+            return self.send_json({"message": f"Conflict: name {name} in use"}, 409)
+
+        container = {"Id": _id("container", name, time.time()), "Name": name,
+                     "Image": spec["Image"], "Cmd": spec.get("Cmd") or [],
+                     "Labels": spec.get("Labels") or {}, "Created": int(time.time()),
+                     "State": "created", "ExitCode": 0, "Output": b"",
+                     # as created, for tests to look at mounts and environment
+                     "Spec": spec}
+        self.engine.containers[container["Id"]] = container
+        self.send_json({"Id": container["Id"], "Warnings": []}, 201)
+
+    def start(self, c):
+        container = self.engine.find_container(c)
+        if container is None:
+            return self.not_found(c)
+        if container["State"] == "running":
+            return self.send_empty(304)
+
+        # sleeping containers (or shell loops around a sleep) stay up,
+        # everything else runs to completion
+        cmd = container["Cmd"]
+        if cmd[:1] == ["sleep"] or cmd[:2] == ["sh", "-c"] and "sleep" in " ".join(cmd[2:]):
+            container["State"] = "running"
+        else:
+            container["Output"], container["ExitCode"] = self.engine.exec_handler(
+                container["Cmd"])
+            container["State"] = "exited"
+        self.send_empty()
+
+    def stop(self, c):
+        container = self.engine.find_container(c)
+        if container is None:
+            return self.not_found(c)
+        container["State"] = "exited"
+        self.send_empty()
+
+    def wait(self, c):
+        container = self.engine.find_container(c)
+        if container is None:
+            return self.not_found(c)
+        self.send_json({"StatusCode": container["ExitCode"]})
+
+    def logs(self, c):
+        container = self.engine.find_container(c)
+        if container is None:
+            return self.not_found(c)
+        self.send_stream(self.frame(container["Output"]) if container["Output"] else b"")
+
+    def remove(self, c):
+        container = self.engine.find_container(c)
+        if container is None:
+            return self.not_found(c)
+        del self.engine.containers[container["Id"]]
+        self.send_empty()
+
+    def remove_image(self, i):
+        image = self.engine.find_image(i)
+        if image is None:
+            return self.not_found(i)
+        del self.engine.images[image["Id"]]
+        self.send_json([{"Deleted": image["Id"]}])
+
+    def commit(self):
+        config = json.loads(self.body() or b"{}")
+        container = self.engine.find_container(self.query.get("container", ""))
+        if container is None:
+            return self.not_found(self.query.get("container"))
+        ref = self.query["repo"] + (f":{self.query['tag']}" if self.query.get("tag") else "")
+        parent = self.engine.find_image(container["Image"]) or {"RootFS": {"Layers": []}, "Size": 0}
+        image = self.engine.add_image(
+            ref, {**container["Labels"], **(config.get("Labels") or {})},
+            layers=[*parent["RootFS"]["Layers"], f"sha256:{_id('layer', ref, time.time())}"],
+            size=parent["Size"] + (5 << 20))
+        self.send_json({"Id": image["Id"]}, 201)
+
+    def build(self):
+        context = self.body()
+        with tarfile.open(fileobj=io.BytesIO(context)) as tar:
+            member = next((m for m in tar.getmembers()
+                           if m.name.lstrip("./") == "Dockerfile"), None)
+            dockerfile = tar.extractfile(member).read().decode() if member else ""
+
+        steps = [line for line in dockerfile.splitlines()
+                 if line.strip() and not line.lstrip().startswith("#")]
+        messages = [{"stream": f"Step {i}/{len(steps)} : {step}\n"}
+                    for i, step in enumerate(steps, 1)]
+        if not steps:
+            messages.append({"error": "the Dockerfile cannot be empty"})
+        else:
+            image = self.engine.add_image(
+                self.query["t"], json.loads(self.query.get("labels", "{}")),
+                layers=[f"sha256:{_id('layer', self.query['t'], i, time.time())}"
+                        for i in range(len(steps))],
+                size=100 << 20)
+            short_id = image["Id"].split(":")[-1][:12]
+            messages.append({"stream": f"Successfully built {short_id}\n"})
+
+        self.send_stream(b"".join(json.dumps(m).encode() + b"\r\n" for m in messages),
+                         "application/json")
+
+    def exec_create(self, c):
+        spec = self.json_body()
+        container = self.engine.find_container(c)
+        if container is None:
+            return self.not_found(c)
+        if container["State"] != "running":
+            return self.send_json({"message": f"Container {c} is not running"}, 409)
+        exec_id = _id("exec", c, time.time())
+        self.engine.execs[exec_id] = {"Cmd": spec["Cmd"], "ExitCode": None}
+        self.engine.emit("container", f"exec_create: {' '.join(spec['Cmd'])}", container["Id"],
+                         {**container["Labels"], "name": container["Name"]})
+        self.send_json({"Id": exec_id}, 201)
+
+    def exec_start(self, e):
+        self.json_body()
+        exec_ = self.engine.execs.get(e)
+        if exec_ is None:
+            return self.not_found(e)
+        output, exec_["ExitCode"] = self.engine.exec_handler(exec_["Cmd"])
+        self.send_stream(self.frame(output) if output else b"")
+
+    def exec_json(self, e):
+        exec_ = self.engine.execs.get(e)
+        if exec_ is None:
+            return self.not_found(e)
+        self.send_json({"ExitCode": exec_["ExitCode"], "Running": False})
+
+    def events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.flush()
+
+        seen = len(self.engine.events)
+        while self.engine._server is not None:
+            with self.engine.changed:
+                self.engine.changed.wait_for(lambda: len(self.engine.events) > seen, timeout=0.2)
+                new, seen = self.engine.events[seen:], len(self.engine.events)
+            try:
+                for event in new:
+                    data = json.dumps(event).encode() + b"\n"
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return
@@ -0,0 +1,257 @@
+""" Many commands exec'd into a few running containers.
+
+A batch leases containers from the spec's warm pool (starting them from the
+current image if needed) and runs every job as a `docker exec` in one of
+them, at most `per_container` at a time in each. A failed job goes back to
+the end of the queue until it has been retried `retries` times. If the
+container itself died, the job is requeued without using up an attempt and
+the container is swapped for a fresh lease. Every job's
+final result is appended to a JSONL file as soon as it is known:
+
+    {"index": 0, "name": "job-0", "cmd": ["python", "eval.py"], "container": "c-pool-0",
+     "attempts": 1, "returncode": 0, "duration": 12.3, "started": "...", "tail": [...]}
+"""
+import itertools
+import threading
+import json
+import time
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .backends import get_backend, current_endpoint, using
+from .wrapper import DockerWrapper
+from .pool import WarmPool
+from .utils.misc import format_table
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+TAIL_LINES = 20
+# a job that took down this many containers counts its attempts again
+MAX_LOST = 3
+
+
+@dataclass
+class BatchJob:
+    index: int
+    name: str
+    cmd: list[str]
+    env: dict = field(default_factory=dict)
+    # per job override of the batch's retries
+    retries: Optional[int] = None
+    container: Optional[str] = None
+    attempts: int = 0
+    # containers that died while running it
+    lost: int = 0
+    returncode: Optional[int] = None
+    duration: Optional[float] = None
+    started: Optional[str] = None
+    tail: deque = field(default_factory=lambda: deque(maxlen=TAIL_LINES), repr=False)
+
+    def result(self) -> dict:
+        return {"index": self.index, "name": self.name, "cmd": self.cmd,
+                "container": self.container, "attempts": self.attempts,
+                "returncode": self.returncode,
+                "duration": None if self.duration is None else round(self.duration, 3),
+                "started": self.started, "tail": list(self.tail)}
+
+
+def make_batch_jobs(jobs: list) -> list[BatchJob]:
+    """ An entry is a full command (a string or a list), or a mapping with
+    `cmd` and optionally `name`, `env` and `retries`.
+    """
+    batch_jobs = []
+    for i, job in enumerate(jobs):
+        spec = job if isinstance(job, dict) else {"cmd": job}
+        if "cmd" not in spec:
+            raise ValueError(f"Batch job {i} has no cmd: {job}")
+
+        cmd = spec["cmd"]
+        cmd = cmd.split() if isinstance(cmd, str) else [str(part) for part in cmd]
+        batch_jobs.append(BatchJob(i, str(spec.get("name", f"job-{i}")), cmd,
+                                   env={k: str(v) for k, v in (spec.get("env") or {}).items()},
+                                   retries=spec.get("retries")))
+
+    names = [job.name for job in batch_jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Batch job names must be unique: {', '.join(duplicates)}")
+    return batch_jobs
+
+
+def run_batch(pool: WarmPool, jobs: list[BatchJob], containers: int = 1,
+              per_container: int = 1, retries: int = 0, results: str = None,
+              verbose: bool = False) -> list[BatchJob]:
+    """ Run every job in one of `containers` leased pool containers, at most
+    `per_container` at a time in each, retrying failed jobs. Results are
+    appended to the `results` JSONL file (truncated first) as jobs finish.
+    """
+    backend = get_backend()
+    endpoint = current_endpoint()
+    print_lock = threading.Lock()
+
+    def say(msg):
+        with print_lock:
+            print(msg, flush=True)
+
+    leased = []
+    for _ in range(max(1, min(containers, len(jobs)))):
+        name = pool.lease()
+        if name is None:
+            break
+        leased.append(name)
+    if not leased:
+        raise RuntimeError("Could not lease a container from the warm pool, "
+                           "check `dboy pool status`")
+    if len(leased) < containers and len(leased) < len(jobs):
+        logger.warning(f"Only {len(leased)} of {containers} containers available "
+                       f"(pool_max is {pool.max_size})")
+
+    pending = deque(jobs)
+    remaining = len(jobs)
+    done = threading.Condition()
+    # containers an exec failed to run in, replaced on release
+    broken = set()
+    # leases whose container was found dead after a failed job; by lease
+    # rather than name, since the replacement may get the same name
+    dead = set()
+    lease_ids = itertools.count()
+    state_lock = threading.Lock()
+    threads = []
+    out = open(results, "w") if results else None
+
+    def finish(job: BatchJob):
+        nonlocal remaining
+        remaining -= 1
+        if out is not None:
+            out.write(json.dumps(job.result()) + "\n")
+            out.flush()
+
+    def run_job(job: BatchJob, container: str):
+        def on_line(line):
+            job.tail.append(line)
+            if verbose:
+                say(f"[{job.name}] {line}")
+
+        job.attempts += 1
+        job.container = container
+        job.started = time.strftime("%Y-%m-%d %H:%M:%S")
+        job.tail.clear()
+        say(f"[{job.name}] started in {container} (attempt {job.attempts}): {' '.join(job.cmd)}")
+        started = time.monotonic()
+        try:
+            job.returncode = backend.exec(container, job.cmd, interactive=False,
+                                          env={**job.env, "DBOY_JOB": job.name},
+                                          on_line=on_line)
+        except Exception as e:
+            logger.error(f"Batch job {job.name} failed to run in {container}: {e}")
+            job.returncode = None
+            job.tail.append(str(e))
+            broken.add(container)
+        job.duration = time.monotonic() - started
+        say(f"[{job.name}] finished with exit code {job.returncode} in {job.duration:.1f}s")
+
+    def container_died(container: str) -> bool:
+        with state_lock, using(endpoint):
+            DockerWrapper.invalidate(images=False)
+            return not DockerWrapper.is_container_running(container)
+
+    def start_workers(container: str):
+        lease = next(lease_ids)
+        for _ in range(max(1, per_container)):
+            thread = threading.Thread(target=worker, args=(container, lease), daemon=True)
+            threads.append(thread)
+            thread.start()
+
+    def replace(container: str):
+        say(f"{container} is no longer running, replacing it")
+        with state_lock, using(endpoint):
+            pool.release(container, recycle=True)
+            replacement = pool.lease()
+        with done:
+            leased.remove(container)
+            if replacement is not None:
+                leased.append(replacement)
+            done.notify_all()
+        if replacement is None:
+            logger.warning(f"No container to replace {container} with, "
+                           f"continuing in {len(leased)}")
+            return
+        start_workers(replacement)
+
+    def worker(container: str, lease: int):
+        while True:
+            with done:
+                while not pending and remaining and lease not in dead:
+                    done.wait()
+                if not remaining or lease in dead:
+                    return
+                job = pending.popleft()
+
+            run_job(job, container)
+
+            lost = job.returncode != 0 and (lease in dead or container_died(container))
+            with done:
+                first = lost and lease not in dead
+                if lost:
+                    job.lost += 1
+                    dead.add(lease)
+                allowed = retries if job.retries is None else job.retries
+                if lost and job.lost < MAX_LOST:
+                    # not the job's fault, so it keeps its attempt
+                    job.attempts -= 1
+                    say(f"[{job.name}] requeued, {container} died under it")
+                    pending.appendleft(job)
+                elif job.returncode != 0 and job.attempts <= allowed:
+                    say(f"[{job.name}] retrying ({job.attempts}/{allowed})")
+                    pending.append(job)
+                else:
+                    finish(job)
+                done.notify_all()
+
+            if lost:
+                if first:
+                    replace(container)
+                return
+
+    print(f"Running {len(jobs)} jobs in {len(leased)} containers, "
+          f"{per_container} at a time in each")
+    try:
+        for container in list(leased):
+            start_workers(container)
+        # replacements add workers while these run
+        while threads:
+            threads.pop(0).join()
+        for job in pending:
+            job.tail.append("no running container was left to run it in")
+            finish(job)
+    finally:
+        if out is not None:
+            out.close()
+        for name in leased:
+            pool.release(name, recycle=name in broken)
+        pool.warm()
+
+    return jobs
+
+
+def summary_table(jobs: list[BatchJob]) -> str:
+    rows = [("job", "container", "attempts", "exit", "time")]
+    for job in jobs:
+        rows.append((job.name, job.container or "-", str(job.attempts),
+                     "-" if job.returncode is None else str(job.returncode),
+                     "-" if job.duration is None else f"{job.duration:.1f}s"))
+
+    lines = format_table(rows)
+
+    failed = [job for job in jobs if job.returncode != 0]
+    lines.append(f"{len(jobs) - len(failed)}/{len(jobs)} jobs succeeded")
+    for job in failed:
+        if job.tail:
+            lines.append(f"--- {job.name} (last lines)")
+            lines.extend(job.tail)
+
+    return "\n".join(lines)
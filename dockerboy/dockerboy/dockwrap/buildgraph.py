@@ -0,0 +1,248 @@
+""" Building a project's images as a DAG.
+
+Next to its own image a config can list more (`images:`), e.g. CPU, GPU and
+debug variants. An image depends on another when a `FROM` line of its
+Dockerfile names that image (`FROM gpu-image`), so parents are built first
+and images that don't depend on each other build at the same time, at most
+`jobs` at once. An image is rebuilt whenever the image ID of one of its
+parents changed since it was last built, whichever command rebuilt it.
+
+When a build fails its descendants are skipped and, unless `keep_going`,
+no new builds are started. The report lists every image's start and
+duration and the critical path: the chain of dependent builds that bounds
+the wall time, so the one worth speeding up.
+"""
+import threading
+import time
+import re
+import os
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .mydocker import MyImage
+from .utils.build import BuildReport
+from .utils.manifest import BuildManifest
+from .utils.misc import split_ref, format_table
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+FROM_LINE = re.compile(r"^FROM\s+(?:--\S+\s+)*(\S+)(?:\s+AS\s+(\S+))?", re.IGNORECASE)
+ARG_LINE = re.compile(r"^ARG\s+([A-Za-z_][A-Za-z0-9_]*)(?:=(\S*))?", re.IGNORECASE)
+VARIABLE = re.compile(r"\$\{?([A-Za-z_][A-Za-z0-9_]*)\}?")
+
+
+def dockerfile_bases(path: str) -> list[str]:
+    """ The base images named by a Dockerfile's `FROM` lines, leaving out
+    earlier stages of a multi-stage build. `ARG` defaults declared before
+    the first `FROM` are substituted.
+    """
+    with open(path, "r") as f:
+        text = re.sub(r"\\\r?\n", " ", f.read())
+
+    args, stages, bases = {}, set(), []
+    seen_from = False
+    for line in text.splitlines():
+        line = line.strip()
+        match = ARG_LINE.match(line)
+        if match and not seen_from:
+            args[match.group(1)] = (match.group(2) or "").strip("\"'")
+            continue
+
+        match = FROM_LINE.match(line)
+        if match is None:
+            continue
+        seen_from = True
+        base = VARIABLE.sub(lambda m: args.get(m.group(1), ""), match.group(1))
+        if base.lower() not in stages and base not in bases:
+            bases.append(base)
+        if match.group(2):
+            stages.add(match.group(2).lower())
+    return bases
+
+
+@dataclass
+class BuildNode:
+    image: MyImage
+    parents: list[str] = field(default_factory=list)
+    # pending, built, up to date, failed, skipped (a parent failed) or
+    # cancelled (stopped early)
+    status: str = "pending"
+    report: Optional[BuildReport] = None
+    # seconds since the graph started
+    started: Optional[float] = None
+    duration: float = 0.0
+
+    @property
+    def name(self):
+        return self.image.name
+
+    @property
+    def ok(self):
+        return self.status in ("built", "up to date")
+
+
+class BuildGraph:
+    def __init__(self, images: list[MyImage]):
+        self.nodes: dict[str, BuildNode] = {}
+        for image in images:
+            if image.name in self.nodes:
+                raise ValueError(f"Image {image.name} is listed twice")
+            self.nodes[image.name] = BuildNode(image)
+
+        for node in self.nodes.values():
+            dockerfile = os.path.join(node.image.dockerfile, "Dockerfile")
+            for base in dockerfile_bases(dockerfile):
+                repository, tag = split_ref(base)
+                if tag in ("", "latest") and repository in self.nodes \
+                        and repository != node.name:
+                    node.parents.append(repository)
+
+        self.order = self._toposort()
+        self.wall = 0.0
+
+    def _toposort(self) -> list[str]:
+        order, state = [], {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                cycle = path[path.index(name):] + [name]
+                raise ValueError(f"Images depend on each other: {' -> '.join(cycle)}")
+            state[name] = "visiting"
+            for parent in self.nodes[name].parents:
+                visit(parent, [*path, name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.nodes:
+            visit(name, [])
+        return order
+
+    def select(self, targets: list[str]):
+        """ Only build `targets` and their ancestors. """
+        keep = set()
+
+        def add(name):
+            if name not in keep:
+                keep.add(name)
+                for parent in self.nodes[name].parents:
+                    add(parent)
+
+        for target in targets:
+            name = target if target in self.nodes else f"{target}-image"
+            if name not in self.nodes:
+                raise ValueError(f"No image {target}, known: {', '.join(self.nodes)}")
+            add(name)
+        self.nodes = {name: node for name, node in self.nodes.items() if name in keep}
+        self.order = [name for name in self.order if name in keep]
+
+    def _descendants(self, name: str) -> list[str]:
+        children = [n for n in self.order if name in self.nodes[n].parents]
+        found = list(children)
+        for child in children:
+            found.extend(d for d in self._descendants(child) if d not in found)
+        return found
+
+    def build(self, jobs: int = 2, force: bool = False, keep_going: bool = False) -> bool:
+        """ Build every image, parents first and up to `jobs` at a time.
+        Returns True if all of them are built or up to date.
+        """
+        print_lock = threading.Lock()
+        manifest = BuildManifest()
+        t0 = time.monotonic()
+
+        def say(name, msg):
+            with print_lock:
+                for line in str(msg).splitlines():
+                    print(f"[{name}] {line}", flush=True)
+
+        def build_one(node: BuildNode):
+            node.started = time.monotonic() - t0
+            try:
+                return node.image.build(force=force,
+                                        on_step=lambda step: say(node.name, step),
+                                        log=lambda msg: say(node.name, msg),
+                                        manifest=manifest, parents=node.parents)
+            finally:
+                node.duration = time.monotonic() - t0 - node.started
+
+        stop = False
+        running = {}
+        print(f"Building {len(self.nodes)} images, {jobs} at a time")
+        jobs = max(1, jobs)
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while True:
+                for name in self.order:
+                    node = self.nodes[name]
+                    # only ever as many as can start, so a failure stops the rest
+                    if stop or len(running) >= jobs:
+                        break
+                    if node.status == "pending" and \
+                            all(self.nodes[p].ok for p in node.parents):
+                        node.status = "building"
+                        running[pool.submit(build_one, node)] = node
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    try:
+                        node.report = future.result()
+                    except Exception as e:
+                        logger.error(f"Building {node.name} failed: {e}")
+                    if node.report:
+                        node.status = "up to date" if node.report.skipped else "built"
+                        continue
+
+                    node.status = "failed"
+                    for name in self._descendants(node.name):
+                        if self.nodes[name].status == "pending":
+                            self.nodes[name].status = "skipped"
+                    if not keep_going:
+                        stop = True
+
+        for node in self.nodes.values():
+            if node.status == "pending":
+                node.status = "cancelled"
+        self.wall = time.monotonic() - t0
+
+        manifest.save()
+        return all(node.ok for node in self.nodes.values())
+
+    def critical_path(self) -> list[str]:
+        """ The chain of dependent builds with the longest total duration. """
+        finish, via = {}, {}
+        for name in self.order:
+            node = self.nodes[name]
+            parent = max(node.parents, key=lambda p: finish[p], default=None)
+            finish[name] = node.duration + (finish[parent] if parent else 0.0)
+            via[name] = parent
+
+        name = max(finish, key=finish.get, default=None)
+        path = []
+        while name is not None:
+            path.append(name)
+            name = via[name]
+        return path[::-1]
+
+    def table(self) -> str:
+        rows = [("image", "from", "status", "start", "time")]
+        for name in self.order:
+            node = self.nodes[name]
+            rows.append((name, ", ".join(node.parents) or "-", node.status,
+                         "-" if node.started is None else f"{node.started:.1f}s",
+                         "-" if node.started is None else f"{node.duration:.1f}s"))
+
+        lines = format_table(rows)
+
+        path = self.critical_path()
+        total = sum(self.nodes[name].duration for name in path)
+        lines.append(f"critical path: {' -> '.join(path)} "
+                     f"({total:.1f}s of {self.wall:.1f}s wall)")
+        return "\n".join(lines)
@@ -0,0 +1,22 @@
+# `dboy cm` command code -> DockerWrapper method. This mirrors the short codes
+# in DockerWrapper's docstrings (see DockerWrapper.get_commands) but is kept
+# static so that building the CLI doesn't have to import the wrapper.
+CM_COMMANDS = {
+    "csc": "commit_stopped_container",
+    "dce": "does_container_exist",
+    "gac": "get_all_containers",
+    "gbi": "get_built_images",
+    "gci": "get_container_id",
+    "gcnfi": "get_container_name_from_id",
+    "gcf": "get_container_ps_format",
+    "gcoi": "get_containers_of_image",
+    "gii": "get_image_id",
+    "grc": "get_running_containers",
+    "icr": "is_container_running",
+    "iir": "is_image_ready",
+    "kc": "kill_container",
+    "rc": "remove_container",
+    "ri": "remove_image",
+    "sd": "shutdown_container",
+    "uarc": "update_and_rebuild_container",
+}
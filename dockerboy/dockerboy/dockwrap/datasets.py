@@ -0,0 +1,215 @@
+""" A content-addressed cache of prepared datasets, shared read-only by every
+container dboy starts.
+
+    <root>/objects/ab/abcdef...     file contents, by sha256
+    <root>/trees/<digest>/<name>/   a prepared dataset, hardlinked to objects
+    <root>/manifests/<name>.json    files, sizes and checksums of the current tree
+    <root>/current/<name>           relative symlink to trees/<digest>/<name>
+
+The whole root is mounted read-only at /dboy-data with TFDS_DATA_DIR set to
+/dboy-data/current, so `tfds.load(name)` finds the dataset already prepared.
+The symlinks are relative so they resolve inside the container too.
+"""
+import hashlib
+import shutil
+import json
+import time
+import uuid
+import os
+
+from .utils.manifest import file_digest
+from .utils.misc import format_table, write_json
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+DEFAULT_CACHE = os.environ.get(
+    "DBOY_DATA_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "dockerboy", "data"))
+CONTAINER_MOUNT = "/dboy-data"
+
+
+class DatasetCache:
+    def __init__(self, root: str = DEFAULT_CACHE):
+        self.root = os.path.abspath(root)
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.root, *parts)
+
+    def manifest(self, name: str) -> dict | None:
+        path = self._path("manifests", f"{name}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def names(self) -> list[str]:
+        if not os.path.isdir(self._path("manifests")):
+            return []
+        return sorted(f[:-len(".json")] for f in os.listdir(self._path("manifests"))
+                      if f.endswith(".json"))
+
+    def mounts(self) -> tuple[list[tuple[str, str]], dict]:
+        """ The (volumes, env) that make every cached dataset visible to tfds
+        in a container. Both are empty until something has been prepared.
+        """
+        if not self.names():
+            return [], {}
+        # the mode rides along in the container path: "-v host:/dboy-data:ro"
+        return [(self.root, f"{CONTAINER_MOUNT}:ro")], \
+            {"TFDS_DATA_DIR": f"{CONTAINER_MOUNT}/current"}
+
+    def _store(self, path: str) -> str:
+        """ Copy a file into objects/ unless its contents are there already. """
+        digest = file_digest(path)
+        obj = self._path("objects", digest[:2], digest)
+        if not os.path.exists(obj):
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            tmp = f"{obj}.{uuid.uuid4().hex}.tmp"
+            shutil.copyfile(path, tmp)
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, obj)
+        return digest
+
+    def add(self, name: str, source_dir: str, origin: str = None) -> dict:
+        """ Import a prepared dataset directory (what tfds writes to
+        `<data_dir>/<name>`) and make it the current version of `name`.
+        Unchanged files are not copied again.
+        """
+        source_dir = os.path.abspath(source_dir)
+        if not os.path.isdir(source_dir):
+            raise FileNotFoundError(f"Dataset directory {source_dir} does not exist")
+
+        files = {}
+        for root, dirs, filenames in os.walk(source_dir):
+            dirs.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(root, filename)
+                relpath = os.path.relpath(path, source_dir)
+                files[relpath] = {"sha256": self._store(path), "size": os.path.getsize(path)}
+
+        tree_hash = _tree_hash(files)
+        tree = self._path("trees", tree_hash, name)
+        if not os.path.isdir(tree):
+            # datasets with identical files share trees/<digest>/, each under its own name
+            staging = self._path("trees", tree_hash, f".{name}.{uuid.uuid4().hex}.tmp")
+            try:
+                for relpath, entry in files.items():
+                    target = os.path.join(staging, relpath)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    _link_or_copy(self._path("objects", entry["sha256"][:2], entry["sha256"]),
+                                  target)
+                try:
+                    os.replace(staging, tree)
+                except OSError:
+                    # a concurrent `add` of the same files got there first
+                    if not os.path.isdir(tree):
+                        raise
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+
+        manifest = {"name": name, "digest": tree_hash, "origin": origin or source_dir,
+                    "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "size": sum(entry["size"] for entry in files.values()), "files": files}
+        os.makedirs(self._path("manifests"), exist_ok=True)
+        write_json(self._path("manifests", f"{name}.json"), manifest)
+
+        # swap the symlink atomically, containers see the old or the new tree
+        os.makedirs(self._path("current"), exist_ok=True)
+        link = self._path("current", name)
+        tmp_link = f"{link}.{uuid.uuid4().hex}.tmp"
+        os.symlink(os.path.join("..", "trees", tree_hash, name), tmp_link)
+        os.replace(tmp_link, link)
+
+        return manifest
+
+    def prepare(self, name: str, image_name: str, run_name: str) -> dict:
+        """ Download and prepare a tfds dataset inside `image_name` (which has
+        tensorflow-datasets installed), then import the result.
+        """
+        from .backends import get_backend
+
+        staging = self._path("tmp", uuid.uuid4().hex)
+        os.makedirs(staging)
+        script = (f"import tensorflow_datasets as tfds; "
+                  f"tfds.builder({name!r}, data_dir='/out').download_and_prepare()")
+        # files written by the container are root's, hand them back to us
+        cmd = ["sh", "-c", f"python -c \"{script}\"; status=$?; "
+                           f"chown -R {os.getuid()}:{os.getgid()} /out; exit $status"]
+        try:
+            returncode = get_backend().run(image_name, run_name, cmd, volumes=[(staging, "/out")],
+                                           interactive=False, remove=True, gpus=False,
+                                           on_line=print)
+            if returncode != 0:
+                raise RuntimeError(f"Preparing {name} in {image_name} failed with exit code {returncode}")
+            return self.add(name, os.path.join(staging, name), origin=f"tfds:{name} in {image_name}")
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def verify(self, name: str) -> list[str]:
+        """ Re-hash the current tree of `name`, returning the files that are
+        missing or don't match the manifest.
+        """
+        manifest = self.manifest(name)
+        if manifest is None:
+            raise KeyError(f"Dataset {name} is not in the cache")
+
+        tree = self._path("trees", manifest["digest"], name)
+        bad = []
+        for relpath, entry in manifest["files"].items():
+            path = os.path.join(tree, relpath)
+            if not os.path.exists(path) or file_digest(path) != entry["sha256"]:
+                bad.append(relpath)
+        return bad
+
+    def remove(self, name: str):
+        for path in (self._path("current", name), self._path("manifests", f"{name}.json")):
+            if os.path.lexists(path):
+                os.remove(path)
+
+    def gc(self) -> int:
+        """ Delete trees and objects no manifest refers to. Returns bytes freed. """
+        manifests = [self.manifest(name) for name in self.names()]
+        live_trees = {(m["digest"], m["name"]) for m in manifests}
+        live_objects = {entry["sha256"] for m in manifests for entry in m["files"].values()}
+
+        freed = 0
+        if os.path.isdir(self._path("trees")):
+            for digest in os.listdir(self._path("trees")):
+                for name in os.listdir(self._path("trees", digest)):
+                    if (digest, name) not in live_trees:
+                        shutil.rmtree(self._path("trees", digest, name), ignore_errors=True)
+                if not os.listdir(self._path("trees", digest)):
+                    os.rmdir(self._path("trees", digest))
+        if os.path.isdir(self._path("objects")):
+            for prefix in os.listdir(self._path("objects")):
+                for digest in os.listdir(self._path("objects", prefix)):
+                    if digest not in live_objects:
+                        path = self._path("objects", prefix, digest)
+                        freed += os.path.getsize(path)
+                        os.remove(path)
+        return freed
+
+    def table(self) -> str:
+        rows = [("dataset", "digest", "files", "size", "prepared", "origin")]
+        for name in self.names():
+            m = self.manifest(name)
+            rows.append((name, m["digest"][:12], str(len(m["files"])),
+                         f"{m['size'] / 2**20:.1f}MB", m["created"], m["origin"]))
+
+        return "\n".join(format_table(rows))
+
+
+def _tree_hash(files: dict) -> str:
+    digest = hashlib.sha256()
+    for relpath, entry in sorted(files.items()):
+        digest.update(f"{relpath}\0{entry['sha256']}\n".encode())
+    return digest.hexdigest()
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g. across filesystems
+        shutil.copyfile(src, dst)
@@ -0,0 +1,190 @@
+""" Spreading a project's containers over several docker daemons.
+
+`endpoints` in `.dboy.yaml` lists the daemons a project may use, each a
+`DOCKER_HOST` URL (`unix:///run/box2.sock`, `tcp://box2:2376`,
+`ssh://me@box2`) or the name of a docker context; `default` is the local
+daemon. A new container goes to the endpoint with the most free capacity
+among those that have its image: the fewest running containers per CPU,
+then the most memory per running container, as their daemons report it.
+Where each container went is kept in `.dboy/placement.json`:
+
+    {"my-container": "tcp://box2:2376"}
+
+so that later commands about it (`dboy sd`, `rm`, `tb`, `logs`, ...) talk to
+that daemon. `dboy -e <endpoint>` (or `DBOY_ENDPOINT`) pins a command to one
+endpoint instead.
+"""
+import threading
+import json
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from .backends import get_backend, current_endpoint, use_endpoint, using, normalize_endpoint
+from .wrapper import DockerWrapper
+from .utils.misc import dboy_path, write_json
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+PLACEMENT_FILE = "placement.json"
+
+# set by `dboy -e`, overrides placement
+_pinned: str | None = None
+
+
+def pin(endpoint: str):
+    """ Send everything to `endpoint`, wherever containers were placed. """
+    global _pinned
+    _pinned = endpoint
+    use_endpoint(endpoint)
+
+
+def pinned() -> bool:
+    return _pinned is not None
+
+
+def describe(endpoint: str | None) -> str:
+    return endpoint or "the local daemon"
+
+
+def hostname(endpoint: str | None) -> str:
+    """ Where ports published on `endpoint` can be reached. """
+    endpoint = normalize_endpoint(endpoint)
+    if endpoint is None or "://" not in endpoint or endpoint.startswith("unix://"):
+        return "localhost"
+    return urlparse(endpoint).hostname or "localhost"
+
+
+class Placement:
+    """ The endpoint each of a project's containers was started on. """
+
+    def __init__(self, path: str = None):
+        self.path = path or dboy_path(PLACEMENT_FILE)
+        self.containers: dict[str, str] = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.containers = json.load(f)
+
+    def save(self):
+        write_json(self.path, self.containers)
+
+    def lookup(self, container: str) -> str | None:
+        return self.containers.get(container)
+
+    def record(self, container: str, endpoint: str | None):
+        self.containers[container] = endpoint or "default"
+        self.save()
+
+
+def endpoint_of(container: str, endpoints: list[str]) -> str | None:
+    """ The endpoint `container` was placed on if it is still one of
+    `endpoints`, else the first of them. A pinned endpoint always wins.
+    """
+    if pinned():
+        return normalize_endpoint(_pinned)
+    recorded = Placement().lookup(container)
+    if recorded is not None and recorded in endpoints:
+        return normalize_endpoint(recorded)
+    return normalize_endpoint(endpoints[0])
+
+
+def select(endpoints: list[str], container: str):
+    """ Point `get_backend()` at the endpoint of `container`, see `endpoint_of`. """
+    use_endpoint(endpoint_of(container, endpoints))
+
+
+class EndpointLoad:
+    def __init__(self, endpoint: str | None, info: dict):
+        self.endpoint = endpoint
+        self.ncpu = max(int(info.get("NCPU") or 1), 1)
+        self.mem_total = int(info.get("MemTotal") or 0)
+        self.running = int(info.get("ContainersRunning") or 0)
+
+    def key(self) -> tuple:
+        # lower is emptier
+        return self.running / self.ncpu, -self.mem_total / (self.running + 1)
+
+    def __repr__(self):
+        return (f"{describe(self.endpoint)}: {self.running} running, {self.ncpu} CPUs, "
+                f"{self.mem_total / 2**30:.1f}GB")
+
+
+class Balancer:
+    """ Least-loaded choice between `endpoints` that have `image`. The
+    daemons are asked once; containers placed through `acquire` count
+    against their endpoint until they are `release`d.
+    """
+
+    def __init__(self, endpoints: list[str], image: str):
+        def measure(endpoint):
+            with using(endpoint):
+                info = get_backend().info()
+                if info is None:
+                    logger.warning(f"Leaving out {describe(endpoint)}: not reachable")
+                    return None
+                if not DockerWrapper.is_image_ready(image):
+                    logger.warning(f"Leaving out {describe(endpoint)}: it has no {image}, "
+                                   f"build it there with `dboy b`")
+                    return None
+                return EndpointLoad(endpoint, info)
+
+        unique = list(dict.fromkeys(normalize_endpoint(endpoint) for endpoint in endpoints))
+        # the daemons may be far away, ask them all at once
+        with ThreadPoolExecutor(max_workers=len(unique) or 1) as pool:
+            self.loads = [load for load in pool.map(measure, unique) if load is not None]
+        self.lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.loads)
+
+    def acquire(self) -> EndpointLoad:
+        with self.lock:
+            load = min(self.loads, key=EndpointLoad.key)
+            load.running += 1
+            return load
+
+    def release(self, load: EndpointLoad):
+        with self.lock:
+            load.running -= 1
+
+
+def place(container: str, image: str, endpoints: list[str]) -> str | None:
+    """ Point `get_backend()` at the least loaded endpoint with `image` for a
+    new `container`, and record it. A container that already exists where
+    it was placed, or a pinned endpoint, stays put.
+    """
+    endpoint = current_endpoint()
+    if len(endpoints) < 2 and not pinned():
+        return endpoint
+    if pinned() or DockerWrapper.does_container_exist(container):
+        Placement().record(container, endpoint)
+        return endpoint
+
+    balancer = Balancer(endpoints, image)
+    if not balancer:
+        logger.warning(f"No endpoint has {image}, staying on {describe(endpoint)}")
+        return endpoint
+
+    load = min(balancer.loads, key=EndpointLoad.key)
+    print(f"Placing {container} on {load}")
+    use_endpoint(load.endpoint)
+    Placement().record(container, load.endpoint)
+    return load.endpoint
+
+
+def each(endpoints: list[str]):
+    """ Yields every endpoint with `get_backend()` pointed at it, e.g. to
+    build the image on all of them. A pinned endpoint is the only one.
+    """
+    saved = current_endpoint()
+    targets = [_pinned] if pinned() else list(dict.fromkeys(endpoints))
+    try:
+        for endpoint in targets:
+            use_endpoint(endpoint)
+            yield normalize_endpoint(endpoint)
+    finally:
+        use_endpoint(saved)
@@ -0,0 +1,436 @@
+""" A local archive of built images, for bringing up a node without
+rebuilding or pulling.
+
+`docker save` writes every layer of an image in full, so archives of
+images that share a base repeat it, and loading one sends all of it to the
+daemon again. The archive instead keeps each layer once, compressed, by
+the digest of its tar:
+
+    <root>/blobs/<sha256>.zst       a layer tar (.gz without `zstandard`)
+    <root>/configs/<sha256>.json    an image config, as docker wrote it
+    <root>/refs/<ref>.json          the config and layers of a saved ref
+
+Exporting an image stores only the layers the archive doesn't have yet,
+and skips `docker save` entirely while the ref still points at the image
+that was archived. Importing streams a `docker load` tar straight out of
+the archive that leaves out the layers the daemon already has, so a node
+that has the base image only receives what was built on top of it. The
+root can be rsynced between nodes, only new blobs are copied.
+"""
+import hashlib
+import tarfile
+import gzip
+import json
+import time
+import uuid
+import os
+import io
+
+from dataclasses import dataclass
+from urllib.parse import quote, unquote
+
+from .backends import get_backend
+from .wrapper import DockerWrapper
+from .utils.context import TarStream
+from .utils.misc import split_ref, format_table, write_json
+from . import labels
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+DEFAULT_ARCHIVE = os.environ.get(
+    "DBOY_IMAGE_ARCHIVE", os.path.join(os.path.expanduser("~"), ".cache", "dockerboy", "images"))
+
+# members of a `docker save` tar smaller than this are kept in memory until
+# the manifest (usually last) says what they are
+SMALL_MEMBER = 1 << 20
+CHUNK = 1 << 20
+
+
+def _zstandard():
+    """ The optional `zstandard` module, or None. """
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def chain_ids(diff_ids: list[str]) -> list[str]:
+    """ The daemon's ID of every layer stack of an image: each layer's
+    together with everything below it.
+    """
+    chains = []
+    for diff_id in diff_ids:
+        if chains:
+            diff_id = "sha256:" + hashlib.sha256(f"{chains[-1]} {diff_id}".encode()).hexdigest()
+        chains.append(diff_id)
+    return chains
+
+
+def full_ref(ref: str) -> str:
+    """ "name" -> "name:latest", as `docker load` wants RepoTags. """
+    repository, tag = split_ref(ref)
+    return f"{repository}:{tag or 'latest'}"
+
+
+class _ReadExactly(io.RawIOBase):
+    """ tarfile copies a member with read(n) and takes a short read for the
+    end of the data, which a decompressing reader may return mid-stream.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self.reader.close()
+        super().close()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.reader.read()
+        parts, left = [], size
+        while left > 0:
+            data = self.reader.read(left)
+            if not data:
+                break
+            parts.append(data)
+            left -= len(data)
+        return b"".join(parts)
+
+
+@dataclass
+class ExportReport:
+    ref: str
+    image_id: str
+    layers: int
+    # uncompressed bytes of layers that were new to the archive, what they
+    # take there compressed, and bytes of layers it already had
+    new_bytes: int = 0
+    stored_bytes: int = 0
+    deduplicated_bytes: int = 0
+    skipped: bool = False
+
+    def __str__(self):
+        if self.skipped:
+            return f"{self.ref} is up to date in the archive ({self.image_id[7:19]})"
+        ratio = f" (compressed to {self.stored_bytes / self.new_bytes:.0%})" if self.new_bytes else ""
+        return (f"Exported {self.ref} ({self.image_id[7:19]}): {self.layers} layers, "
+                f"{self.new_bytes / 2**20:.1f}MB new{ratio}, "
+                f"{self.deduplicated_bytes / 2**20:.1f}MB already archived")
+
+
+@dataclass
+class ImportReport:
+    ref: str
+    image_id: str
+    layers: int
+    # layers sent to the daemon and their uncompressed bytes; the others it had
+    sent: int = 0
+    sent_bytes: int = 0
+    skipped: bool = False
+
+    def __str__(self):
+        if self.skipped:
+            return f"{self.ref} is already loaded ({self.image_id[7:19]})"
+        return (f"Imported {self.ref} ({self.image_id[7:19]}): sent {self.sent} of "
+                f"{self.layers} layers, {self.sent_bytes / 2**20:.1f}MB")
+
+
+class _Spooled:
+    """ A member of a `docker save` tar, compressed into the archive's blob
+    directory under a temporary name while it is hashed.
+    """
+
+    def __init__(self, archive: "ImageArchive", fileobj):
+        self.path = archive._path("blobs", f".{uuid.uuid4().hex}.tmp")
+        digest, self.size = hashlib.sha256(), 0
+        with open(self.path, "wb") as raw, archive._compressor(raw) as out:
+            for chunk in iter(lambda: fileobj.read(CHUNK), b""):
+                digest.update(chunk)
+                self.size += len(chunk)
+                out.write(chunk)
+        self.digest = digest.hexdigest()
+
+
+class RestoreStream(TarStream):
+    """ A `docker load` tar (the classic docker-archive layout) of a ref
+    from the archive, with only the layers in `send`.
+    """
+
+    def __init__(self, archive: "ImageArchive", record: dict, send: list[bool]):
+        self.archive = archive
+        self.record = record
+        self.send = send
+
+    def write_tar(self, fileobj):
+        config_hex = self.record["config"]
+        with open(self.archive._path("configs", f"{config_hex}.json"), "rb") as f:
+            config = f.read()
+
+        with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+            paths, written = [], set()
+            for layer, send in zip(self.record["layers"], self.send):
+                path = f"{layer['blob']}/layer.tar"
+                paths.append(path)
+                if not send or path in written:
+                    continue
+                info = tarfile.TarInfo(path)
+                info.size = layer["size"]
+                with self.archive.open_blob(layer["blob"]) as blob:
+                    tar.addfile(info, blob)
+                written.add(path)
+
+            manifest = [{"Config": f"{config_hex}.json",
+                         "RepoTags": [self.record["ref"]], "Layers": paths}]
+            for name, data in ((f"{config_hex}.json", config),
+                               ("manifest.json", json.dumps(manifest).encode())):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+
+class ImageArchive:
+    def __init__(self, root: str = None):
+        self.root = os.path.abspath(root or DEFAULT_ARCHIVE)
+        self.zstd = _zstandard()
+        self.suffix = ".zst" if self.zstd is not None else ".gz"
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.root, *parts)
+
+    # compression
+    def _compressor(self, raw):
+        if self.zstd is not None:
+            return self.zstd.ZstdCompressor(level=3, threads=-1).stream_writer(raw, closefd=False)
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6, mtime=0)
+
+    def blob_path(self, digest: str) -> str | None:
+        """ The stored layer tar with sha256 `digest`, in either compression. """
+        for suffix in (".zst", ".gz"):
+            path = self._path("blobs", f"{digest}{suffix}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    def open_blob(self, digest: str):
+        """ The uncompressed layer tar with sha256 `digest`, as a stream. """
+        path = self.blob_path(digest)
+        if path is None:
+            raise FileNotFoundError(f"Layer {digest[:12]} is missing from {self.root}")
+        raw = open(path, "rb")
+        if path.endswith(".gz"):
+            return gzip.GzipFile(fileobj=raw, mode="rb")
+        if self.zstd is None:
+            raw.close()
+            raise RuntimeError(f"{path} is zstd-compressed, install `zstandard` to read it")
+        return _ReadExactly(self.zstd.ZstdDecompressor().stream_reader(raw, closefd=True))
+
+    # refs
+    def record(self, ref: str) -> dict | None:
+        path = self._path("refs", f"{quote(full_ref(ref), safe='')}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def refs(self) -> list[str]:
+        if not os.path.isdir(self._path("refs")):
+            return []
+        return sorted(unquote(f[:-len(".json")]) for f in os.listdir(self._path("refs"))
+                      if f.endswith(".json"))
+
+    def _complete(self, record: dict) -> bool:
+        return os.path.exists(self._path("configs", f"{record['config']}.json")) and \
+            all(self.blob_path(layer["blob"]) for layer in record["layers"])
+
+    # export
+    def export(self, ref: str) -> ExportReport:
+        """ Archive image `ref`, storing only layers the archive doesn't have. """
+        ref = full_ref(ref)
+        backend = get_backend()
+        image = backend.inspect_image(ref)
+        if image is None:
+            raise ValueError(f"No image {ref}, build it first")
+
+        record = self.record(ref)
+        if record is not None and record["id"] == image["Id"] and self._complete(record):
+            return ExportReport(ref, image["Id"], len(record["layers"]), skipped=True,
+                                deduplicated_bytes=sum(l["size"] for l in record["layers"]))
+
+        for directory in ("blobs", "configs", "refs"):
+            os.makedirs(self._path(directory), exist_ok=True)
+        return backend.save([ref], lambda fileobj: self._read_save(ref, image["Id"], fileobj))
+
+    def _read_save(self, ref: str, image_id: str, fileobj) -> ExportReport:
+        members: dict[str, bytes] = {}
+        spooled: dict[str, _Spooled] = {}
+        links: dict[str, str] = {}
+        sizes: dict[str, int] = {}
+        try:
+            with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+                for member in tar:
+                    name = os.path.normpath(member.name)
+                    if member.issym():
+                        # the classic layout links repeated layers to one copy
+                        links[name] = os.path.normpath(
+                            os.path.join(os.path.dirname(name), member.linkname))
+                        continue
+                    if not member.isfile():
+                        continue
+                    sizes[name] = member.size
+                    # OCI layouts name blobs by digest, which is all an
+                    # archived layer needs
+                    directory, _, digest = name.rpartition("/")
+                    if directory == "blobs/sha256" and self.blob_path(digest):
+                        continue
+                    f = tar.extractfile(member)
+                    if member.size < SMALL_MEMBER:
+                        members[name] = f.read()
+                    else:
+                        spooled[name] = _Spooled(self, f)
+
+            return self._store(ref, image_id, members, spooled, links, sizes)
+        finally:
+            for spool in spooled.values():
+                if os.path.exists(spool.path):
+                    os.remove(spool.path)
+
+    def _store(self, ref, image_id, members, spooled, links, sizes) -> ExportReport:
+        manifest = json.loads(members["manifest.json"])
+        entry = next((e for e in manifest if ref in (e.get("RepoTags") or [])), manifest[0])
+        config = members[os.path.normpath(entry["Config"])]
+        diff_ids = json.loads(config)["rootfs"]["diff_ids"]
+        config_hex = hashlib.sha256(config).hexdigest()
+        with open(self._path("configs", f"{config_hex}.json"), "wb") as f:
+            f.write(config)
+
+        report = ExportReport(ref, image_id, len(diff_ids))
+        layers = []
+        for path, diff_id in zip(entry["Layers"], diff_ids):
+            path = os.path.normpath(path)
+            while path in links:
+                path = links[path]
+
+            if path in spooled:
+                spool = spooled[path]
+                digest, size = spool.digest, spool.size
+                if self.blob_path(digest) is None:
+                    target = self._path("blobs", f"{digest}{self.suffix}")
+                    os.replace(spool.path, target)
+                    report.new_bytes += size
+                    report.stored_bytes += os.path.getsize(target)
+                else:
+                    report.deduplicated_bytes += size
+            elif path in members:
+                data = members[path]
+                digest, size = hashlib.sha256(data).hexdigest(), len(data)
+                if self.blob_path(digest) is None:
+                    target = self._path("blobs", f"{digest}{self.suffix}")
+                    tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+                    with open(tmp, "wb") as raw, self._compressor(raw) as out:
+                        out.write(data)
+                    os.replace(tmp, target)
+                    report.new_bytes += size
+                    report.stored_bytes += os.path.getsize(target)
+                else:
+                    report.deduplicated_bytes += size
+            else:
+                # skipped while reading, already archived
+                digest, size = path.rpartition("/")[2], sizes[path]
+                report.deduplicated_bytes += size
+            layers.append({"diff_id": diff_id, "blob": digest, "size": size})
+
+        record = {"ref": ref, "id": image_id, "config": config_hex, "layers": layers,
+                  "exported": time.strftime("%Y-%m-%d %H:%M:%S")}
+        write_json(self._path("refs", f"{quote(ref, safe='')}.json"), record)
+        return report
+
+    # import
+    def _daemon_chains(self) -> set[str]:
+        """ Chain IDs of every layer stack the daemon has, whichever project's. """
+        backend = get_backend()
+        with labels.unscoped():
+            ids = list(dict.fromkeys(image.id for image in backend.images()))
+        chains = set()
+        for image in backend.inspect_images(ids):
+            chains.update(chain_ids(image.get("RootFS", {}).get("Layers") or []))
+        return chains
+
+    def restore(self, ref: str, full: bool = False) -> ImportReport:
+        """ `docker load` `ref` from the archive, sending only the layers the
+        daemon doesn't have unless `full`.
+        """
+        ref = full_ref(ref)
+        record = self.record(ref)
+        if record is None:
+            raise ValueError(f"{ref} is not in {self.root}, export it with `dboy image export`")
+
+        backend = get_backend()
+        image = backend.inspect_image(ref)
+        if not full and image is not None and image["Id"] == record["id"]:
+            return ImportReport(ref, record["id"], len(record["layers"]), skipped=True)
+
+        # the daemon only reads a layer's tar when it lacks that stack
+        present = set() if full else self._daemon_chains()
+        send = [chain not in present
+                for chain in chain_ids([layer["diff_id"] for layer in record["layers"]])]
+        report = ImportReport(ref, record["id"], len(send), sent=sum(send),
+                              sent_bytes=sum(layer["size"] for layer, s
+                                             in zip(record["layers"], send) if s))
+
+        status = backend.load(RestoreStream(self, record, send), on_line=logger.info)
+        DockerWrapper.invalidate(containers=False)
+        if status != 0:
+            raise RuntimeError(f"docker load of {ref} failed, retry with --full if the "
+                               f"daemon needs every layer")
+        return report
+
+    # housekeeping
+    def remove(self, ref: str):
+        path = self._path("refs", f"{quote(full_ref(ref), safe='')}.json")
+        if os.path.exists(path):
+            os.remove(path)
+
+    def gc(self) -> int:
+        """ Delete blobs and configs no ref refers to. Returns bytes freed. """
+        records = [self.record(ref) for ref in self.refs()]
+        live = {layer["blob"] for r in records for layer in r["layers"]} | \
+            {r["config"] for r in records}
+
+        freed = 0
+        for directory in ("blobs", "configs"):
+            if not os.path.isdir(self._path(directory)):
+                continue
+            for filename in os.listdir(self._path(directory)):
+                # dotfiles are blobs still being written
+                if not filename.startswith(".") and filename.split(".")[0] not in live:
+                    path = self._path(directory, filename)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+        return freed
+
+    def disk_usage(self) -> int:
+        if not os.path.isdir(self._path("blobs")):
+            return 0
+        return sum(entry.stat().st_size for entry in os.scandir(self._path("blobs")))
+
+    def table(self) -> str:
+        rows = [("ref", "id", "layers", "size", "exported")]
+        total, seen = 0, set()
+        for ref in self.refs():
+            r = self.record(ref)
+            size = sum(layer["size"] for layer in r["layers"])
+            total += sum(layer["size"] for layer in r["layers"] if layer["blob"] not in seen)
+            seen.update(layer["blob"] for layer in r["layers"])
+            rows.append((ref, r["id"][7:19], str(len(r["layers"])),
+                         f"{size / 2**20:.1f}MB", r["exported"]))
+
+        lines = format_table(rows)
+        lines.append(f"{len(seen)} layers, {total / 2**20:.1f}MB stored as "
+                     f"{self.disk_usage() / 2**20:.1f}MB in {self.root}")
+        return "\n".join(lines)
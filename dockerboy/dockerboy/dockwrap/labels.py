@@ -0,0 +1,75 @@
+""" Ownership labels.
+
+Every container and image dboy creates for a project is labelled with
+
+    dockerboy.project   absolute path of the directory holding .dboy.yaml
+    dockerboy.spec      the spec (image_name) it belongs to
+    dockerboy.version   the image version, from a `:vN` tag, else "0"
+
+Once a command has `scope()`d itself to a project, the backends add these
+labels to whatever they build, run or commit, and list only containers and
+images carrying them, filtered by the daemon. Commands without a config
+(`dboy cm`) stay unscoped and see everything.
+"""
+# Imported by the backends on every `dboy` invocation, so only cheap modules.
+from contextlib import contextmanager
+
+PROJECT = "dockerboy.project"
+SPEC = "dockerboy.spec"
+VERSION = "dockerboy.version"
+
+_scope: dict[str, str] = {}
+
+
+def scope(project: str, spec: str):
+    global _scope
+    _scope = {PROJECT: project, SPEC: spec}
+
+
+def unscope():
+    global _scope
+    _scope = {}
+
+
+@contextmanager
+def unscoped():
+    """ Temporarily see every project's objects. """
+    global _scope
+    saved, _scope = _scope, {}
+    try:
+        yield
+    finally:
+        _scope = saved
+
+
+def current() -> dict[str, str]:
+    return dict(_scope)
+
+
+def key() -> tuple:
+    """ The current scope in hashable form, () when unscoped. """
+    return tuple(_scope.items())
+
+
+def version_of(ref: str) -> str:
+    """ "name:v3" -> "3"; anything without a version tag is version 0. """
+    _, _, tag = ref.rpartition(":")
+    if "/" not in tag and tag[:1] == "v" and tag[1:].isdigit():
+        return tag[1:]
+    return "0"
+
+
+def for_ref(ref: str) -> dict[str, str]:
+    """ The labels to put on a container or image made from/as `ref`, or
+    nothing when unscoped.
+    """
+    if not _scope:
+        return {}
+    return {**_scope, VERSION: version_of(ref)}
+
+
+def filters() -> list[str]:
+    """ `key=value` label filters selecting this scope's objects. The daemon
+    ANDs them together.
+    """
+    return [f"{key}={value}" for key, value in _scope.items()]
@@ -0,0 +1,67 @@
+""" Loggers that don't import `logging` until something is logged.
+
+`logging` brings in traceback, linecache and tokenize, which is a good part
+of the startup time of a `dboy` command that never logs (see
+bench/startup.py). Modules use `logger = get_logger(__name__)` instead of
+`logging.getLogger(__name__)`, and `configure` takes the place of
+`logging.basicConfig`.
+"""
+import sys
+
+
+# basicConfig arguments waiting for the first message
+_pending: dict | None = None
+_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+
+def configure(**kwargs):
+    """ `logging.basicConfig(**kwargs)`, right away if logging is already in
+    use and otherwise once the first message is logged.
+    """
+    global _pending
+    _pending = kwargs
+    if "logging" in sys.modules:
+        _logging()
+
+
+def _enabled(level: int) -> bool:
+    # until logging is imported nothing but `configure` can have set a level,
+    # so debug messages (e.g. every docker call's) don't need it imported
+    if "logging" in sys.modules:
+        return True
+    configured = (_pending or {}).get("level", "WARNING")
+    return level >= _LEVELS.get(configured, configured)
+
+
+def _logging():
+    global _pending
+    import logging
+
+    if _pending is not None:
+        kwargs, _pending = _pending, None
+        logging.basicConfig(**kwargs)
+    return logging
+
+
+class LazyLogger:
+    """ Stands in for `logging.getLogger(name)`; every attribute comes from
+    the real logger, which is only looked up when one is used.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(_logging().getLogger(self.name), attr)
+
+    def debug(self, msg, *args, **kwargs):
+        if _enabled(10):
+            _logging().getLogger(self.name).debug(msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        if _enabled(20):
+            _logging().getLogger(self.name).info(msg, *args, **kwargs)
+
+
+def get_logger(name: str) -> LazyLogger:
+    return LazyLogger(name)
@@ -0,0 +1,201 @@
+""" Snapshot versions of a spec's image.
+
+Rebuilding a container (`dboy b -r`, or a run whose stopped container won't
+start) commits it as the next `<image>:vN`. Each version is recorded in
+`.dboy/lineage.json` with its parent, size and layer depth:
+
+    {"images": {"default-image": [{"version": 1, "ref": "default-image:v1",
+                                   "id": "0123456789ab", "parent": "default-image",
+                                   "layers": 14, "size": 2143289344,
+                                   "squashed": false, "created": "..."}, ...]}}
+
+`gc` removes the versions a retention policy doesn't keep, together with the
+project's stopped containers and dangling images.
+"""
+import json
+import time
+import os
+
+from .backends import get_backend
+from .utils.misc import dboy_path, split_ref, update_version, format_table, write_json
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+LINEAGE_FILE = "lineage.json"
+
+
+class Lineage:
+    def __init__(self, path: str = None):
+        self.path = path or dboy_path(LINEAGE_FILE)
+        self.images: dict[str, list[dict]] = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.images = json.load(f).get("images", {})
+
+    def save(self):
+        write_json(self.path, {"images": self.images})
+
+    def versions(self, repository: str) -> list[dict]:
+        """ Oldest first. """
+        return sorted(self.images.get(repository, []), key=lambda entry: entry["version"])
+
+    def next_ref(self, current: str) -> str:
+        """ The ref to snapshot a container running `current` as. Numbers are
+        never reused, even after their version was collected.
+        """
+        repository, _ = split_ref(current)
+        versions = self.versions(repository)
+        if versions:
+            return update_version(versions[-1]["ref"])
+        return update_version(current)
+
+    def record(self, ref: str, image: dict, parent: str, squashed: bool) -> dict:
+        repository, tag = split_ref(ref)
+        entry = {"version": int(tag[1:]), "ref": ref, "id": image["Id"].split(":")[-1][:12],
+                 "parent": parent, "layers": len(image["RootFS"]["Layers"]),
+                 "size": image.get("Size", 0), "squashed": squashed,
+                 "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+        self.images.setdefault(repository, []).append(entry)
+        return entry
+
+    def forget(self, repository: str, refs: set[str]):
+        self.images[repository] = [entry for entry in self.images.get(repository, [])
+                                   if entry["ref"] not in refs]
+        if not self.images[repository]:
+            del self.images[repository]
+
+    def table(self, repository: str) -> str:
+        rows = [("version", "id", "parent", "layers", "size", "created")]
+        for entry in self.versions(repository):
+            rows.append((entry["ref"], entry["id"], entry["parent"],
+                         f"{entry['layers']}{' (squashed)' if entry['squashed'] else ''}",
+                         f"{entry['size'] / 2**20:.1f}MB", entry["created"]))
+
+        return "\n".join(format_table(rows))
+
+
+def config_changes(config: dict) -> list[str]:
+    """ Dockerfile instructions that restore an image's config, which a
+    squash (export | import) drops.
+    """
+    config = config or {}
+    changes = [f"ENV {env.partition('=')[0]}={json.dumps(env.partition('=')[2])}"
+               for env in config.get("Env") or []]
+    if config.get("WorkingDir"):
+        changes.append(f"WORKDIR {config['WorkingDir']}")
+    if config.get("User"):
+        changes.append(f"USER {config['User']}")
+    changes.extend(f"EXPOSE {port}" for port in config.get("ExposedPorts") or {})
+    if config.get("Entrypoint"):
+        changes.append(f"ENTRYPOINT {json.dumps(config['Entrypoint'])}")
+    if config.get("Cmd"):
+        changes.append(f"CMD {json.dumps(config['Cmd'])}")
+    # ownership labels are added by the backend for the new version
+    changes.extend(f"LABEL {key}={json.dumps(value)}"
+                   for key, value in (config.get("Labels") or {}).items()
+                   if not key.startswith("dockerboy."))
+    return changes
+
+
+def snapshot(container, squash_depth: int = 0) -> str:
+    """ Commit a stopped container as the next version of its image. Once
+    the image would be deeper than `squash_depth` layers (0: never) the
+    container is flattened into a single layer instead.
+    """
+    backend = get_backend()
+    lineage = Lineage()
+    ref = lineage.next_ref(container.image)
+
+    parent = backend.inspect_image(container.image)
+    depth = len(parent["RootFS"]["Layers"]) + 1 if parent else 0
+    squash = bool(squash_depth) and depth > squash_depth
+    if squash:
+        print(f"{container.image} is {depth - 1} layers deep, squashing into {ref}")
+        ok = backend.squash(container.id, ref, config_changes(parent.get("Config")))
+    else:
+        ok = backend.commit(container.id, ref)
+    if not ok:
+        raise RuntimeError(f"Snapshotting {container.name} as {ref} failed")
+
+    lineage.record(ref, backend.inspect_image(ref), container.image, squash)
+    lineage.save()
+    return ref
+
+
+def gc(repository: str, keep: int = 3, dry_run: bool = False) -> str:
+    """ Remove the project's stopped containers, every version of
+    `repository` except the last `keep`, those carrying another tag and those
+    a container still uses, and finally the dangling images. Returns a
+    report. Only the project's label scope is touched.
+    """
+    from .wrapper import DockerWrapper
+
+    backend = get_backend()
+    state = DockerWrapper.state()
+    lines = []
+
+    before = None if dry_run else backend.disk_usage()
+
+    stopped = [c.name for c in state.containers.values() if not c.running]
+    if stopped and not dry_run:
+        from .ports import PortRegistry
+
+        backend.prune("containers")
+        PortRegistry().release(*stopped)
+        DockerWrapper.invalidate(images=False)
+    lines.append(f"{'Would remove' if dry_run else 'Removed'} {len(stopped)} stopped containers"
+                 + (f": {', '.join(stopped)}" if stopped else ""))
+
+    lineage = Lineage()
+    refs_by_id = {}
+    for image in state.images:
+        refs_by_id.setdefault(image.id, set()).update(image.refs)
+    # the stopped ones are gone by now (or would be)
+    in_use = {}
+    for c in state.containers.values():
+        if c.running:
+            in_use.setdefault(c.image, c.name)
+
+    versions = lineage.versions(repository)
+    gone = {entry["ref"] for entry in versions if entry["id"] not in refs_by_id}
+    lineage.forget(repository, gone)
+    versions = [entry for entry in versions if entry["ref"] not in gone]
+    lineage_refs = {entry["ref"] for entry in versions}
+
+    remove = []
+    for i, entry in enumerate(reversed(versions)):
+        other_tags = sorted(ref for ref in refs_by_id[entry["id"]]
+                            if ":" in ref and ref not in lineage_refs
+                            and not ref.startswith("<none>"))
+        user = in_use.get(entry["ref"]) or in_use.get(entry["id"])
+        if i < keep:
+            reason = f"one of the last {keep}"
+        elif other_tags:
+            reason = f"tagged {', '.join(other_tags)}"
+        elif user is not None:
+            reason = f"used by {user}"
+        else:
+            remove.append(entry)
+            continue
+        lines.append(f"  keep {entry['ref']}: {reason}")
+
+    for entry in remove:
+        lines.append(f"  {'would remove' if dry_run else 'remove'} {entry['ref']}")
+        if not dry_run and not backend.rmi(entry["ref"]):
+            logger.warning(f"Could not remove {entry['ref']}")
+    if not dry_run:
+        lineage.forget(repository, {entry["ref"] for entry in remove})
+        DockerWrapper.invalidate(containers=False)
+        dangling = backend.prune("images")
+        lines.append(f"Removed {len(remove)} versions and {len(dangling)} dangling images")
+        lines.append(f"Freed {(before - backend.disk_usage()) / 2**20:.1f}MB")
+    else:
+        lines.append(f"Would remove {len(remove)} versions "
+                     f"(up to {sum(entry['size'] for entry in remove) / 2**20:.1f}MB)")
+        return "\n".join(lines)
+
+    lineage.save()
+    return "\n".join(lines)
@@ -0,0 +1,319 @@
+""" Log capture for detached runs, and merged tails of several containers.
+
+A detached run gets a follower process (`python -m dockerboy.dockwrap.logs`)
+that streams the container's timestamped output into
+`host_dir/logs/<container>/output.log`, gzipping it to `output.log.1.gz`,
+`output.log.2.gz`, ... whenever it grows past the size limit.
+"""
+import subprocess
+import threading
+import argparse
+import shutil
+import signal
+import heapq
+import queue
+import gzip
+import sys
+import os
+
+from collections import deque
+
+from .backends import get_backend, current_endpoint, use_endpoint, using
+from .lazylog import get_logger, configure
+
+
+logger = get_logger(__name__)
+
+LOG_FILE = "output.log"
+PID_FILE = "follower.pid"
+
+
+class RotatingLog:
+    """ Appends lines to `<directory>/output.log`. Past `max_bytes` the file
+    is compressed to `output.log.1.gz`, older archives shift up by one and
+    only `backups` of them are kept.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 50 * 2**20, backups: int = 5):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, LOG_FILE)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        # line buffered, so `dboy logs -f` sees lines as they arrive
+        self.file = open(self.path, "a", buffering=1, encoding="utf-8")
+        # in bytes, the unit max_bytes and the file size are in
+        self.size = self.file.tell()
+
+    def archive(self, n: int) -> str:
+        return f"{self.path}.{n}.gz"
+
+    def write(self, line: str):
+        data = line + "\n"
+        n = len(data.encode("utf-8"))
+        if self.size and self.size + n > self.max_bytes:
+            self.rotate()
+        self.file.write(data)
+        self.size += n
+
+    def rotate(self):
+        self.file.close()
+
+        if os.path.exists(self.archive(self.backups)):
+            os.remove(self.archive(self.backups))
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(self.archive(n)):
+                os.replace(self.archive(n), self.archive(n + 1))
+
+        if self.backups > 0:
+            tmp = f"{self.archive(1)}.tmp"
+            with open(self.path, "rb") as src, gzip.open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp, self.archive(1))
+        os.remove(self.path)
+
+        self.file = open(self.path, "a", buffering=1, encoding="utf-8")
+        self.size = 0
+
+    def close(self):
+        self.file.close()
+
+
+def follow_container(container: str, directory: str, max_bytes: int, backups: int,
+                     remove: bool = False) -> int:
+    """ Capture a container's output until it exits. Runs in the follower process. """
+    pid_file = os.path.join(directory, PID_FILE)
+    log = RotatingLog(directory, max_bytes, backups)
+    with open(pid_file, "w") as f:
+        f.write(str(os.getpid()))
+
+    backend = get_backend()
+    try:
+        returncode = backend.logs(container, log.write, follow=True)
+    finally:
+        log.close()
+        if os.path.exists(pid_file):
+            os.remove(pid_file)
+
+    if remove and container not in {c.name for c in backend.ps(all=False)}:
+        from .ports import PortRegistry
+
+        backend.rm(container)
+        PortRegistry().release(container)
+    return returncode
+
+
+def start_follower(container: str, directory: str, max_bytes: int = 50 * 2**20,
+                   backups: int = 5, remove: bool = False) -> int:
+    """ Start a background process capturing `container`'s output into
+    `directory`. It outlives this dboy invocation. Returns its pid.
+    """
+    os.makedirs(directory, exist_ok=True)
+    # a follower left over from an earlier run of the same container would
+    # write to the same files
+    stop_follower(directory)
+
+    cmd = [sys.executable, "-m", __name__, container, directory,
+           "--max-bytes", str(max_bytes), "--backups", str(backups)]
+    if remove:
+        cmd.append("--rm")
+    if current_endpoint() is not None:
+        cmd.extend(["--endpoint", current_endpoint()])
+
+    with open(os.path.join(directory, "follower.err"), "ab") as err:
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                stderr=err, start_new_session=True)
+    # written here too, so `dboy logs -f` right after the run finds it
+    with open(os.path.join(directory, PID_FILE), "w") as f:
+        f.write(str(proc.pid))
+    return proc.pid
+
+
+def stop_follower(directory: str):
+    try:
+        with open(os.path.join(directory, PID_FILE), "r") as f:
+            os.kill(int(f.read()), signal.SIGTERM)
+    except (FileNotFoundError, ValueError, ProcessLookupError):
+        pass
+
+
+def is_following(directory: str) -> bool:
+    try:
+        with open(os.path.join(directory, PID_FILE), "r") as f:
+            os.kill(int(f.read()), 0)
+    except (FileNotFoundError, ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def split_timestamp(line: str) -> tuple[str, str]:
+    """ "2024-05-01T12:00:00.123456789Z text" -> (timestamp, text). Lines
+    without a timestamp get "" and sort first.
+    """
+    head, _, rest = line.partition(" ")
+    if len(head) > 20 and head[4] == "-" and head[10] == "T":
+        return head, rest
+    return "", line
+
+
+def last_lines(path: str, n: int, block: int = 1 << 16) -> list[str]:
+    """ The last `n` lines of a file, reading backwards from its end. """
+    if n <= 0:
+        return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        data = b""
+        while end > 0 and data.count(b"\n") <= n:
+            start = max(0, end - block)
+            f.seek(start)
+            data = f.read(end - start) + data
+            end = start
+    return [line.decode(errors="replace") for line in data.splitlines()[-n:]]
+
+
+class FileSource:
+    """ Lines captured by a follower under `host_dir/logs/<container>`. """
+
+    def __init__(self, name: str, directory: str):
+        self.name = name
+        self.directory = directory
+        self.path = os.path.join(directory, LOG_FILE)
+
+    def tail(self, n: int) -> list[str]:
+        lines = last_lines(self.path, n) if os.path.exists(self.path) else []
+        archive = f"{self.path}.1.gz"
+        if len(lines) < n and os.path.exists(archive):
+            # just rotated, the rest is in the newest archive
+            with gzip.open(archive, "rt", encoding="utf-8", errors="replace") as f:
+                older = deque((line.rstrip("\n") for line in f), maxlen=n - len(lines))
+            lines = [*older, *lines]
+        return lines
+
+    def follow(self, on_line, stop: threading.Event, poll: float = 0.25):
+        """ Like `tail -F`: new lines from the end of the file, across
+        rotations, until the follower exits and everything has been read.
+        """
+        f = open(self.path, "r", encoding="utf-8", errors="replace") if os.path.exists(self.path) else None
+        if f is not None:
+            f.seek(0, os.SEEK_END)
+        partial = ""
+        try:
+            while not stop.is_set():
+                data = f.read(1 << 16) if f is not None else ""
+                if data:
+                    *lines, partial = (partial + data).split("\n")
+                    for line in lines:
+                        on_line(line)
+                    continue
+
+                try:
+                    inode = os.stat(self.path).st_ino
+                except FileNotFoundError:
+                    inode = None
+                if inode is not None and (f is None or inode != os.fstat(f.fileno()).st_ino):
+                    # rotated, or created since we started
+                    if f is not None:
+                        f.close()
+                    f = open(self.path, "r", encoding="utf-8", errors="replace")
+                    continue
+
+                if not is_following(self.directory):
+                    break
+                stop.wait(poll)
+        finally:
+            if partial:
+                on_line(partial)
+            if f is not None:
+                f.close()
+
+
+class DockerSource:
+    """ Output read from the daemon, for containers that weren't started with
+    `dboy r -d`.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # the readers run in threads of their own, see `backends.using`
+        self.endpoint = current_endpoint()
+
+    def tail(self, n: int) -> list[str]:
+        lines = deque(maxlen=max(n, 0))
+        with using(self.endpoint):
+            get_backend().logs(self.name, lines.append, tail=n)
+        return list(lines)
+
+    def follow(self, on_line, stop: threading.Event):
+        # stops when the container does, `stop` can't interrupt the stream
+        with using(self.endpoint):
+            get_backend().logs(self.name, on_line, follow=True, tail=0)
+
+
+def multiplex(sources: list, follow: bool = False, tail: int = 10,
+              timestamps: bool = False, out=print):
+    """ Print the last `tail` lines of every source merged by time, each
+    prefixed with its container, then with `follow` keep printing new lines
+    as they arrive. Memory is bounded by `tail` per source and a fixed-size
+    queue between the readers and the terminal.
+    """
+    width = max((len(source.name) for source in sources), default=0)
+
+    def emit(name: str, line: str):
+        ts, text = split_timestamp(line)
+        out(f"[{name:<{width}}] {ts + ' ' if timestamps and ts else ''}{text}")
+
+    tails = [[(split_timestamp(line)[0], source.name, line) for line in source.tail(tail)]
+             for source in sources]
+    for _, name, line in heapq.merge(*tails):
+        emit(name, line)
+
+    if not follow:
+        return
+
+    lines = queue.Queue(maxsize=1024)
+    stop = threading.Event()
+
+    def reader(source):
+        try:
+            source.follow(lambda line: lines.put((source.name, line)), stop)
+        finally:
+            lines.put((source.name, None))
+
+    for source in sources:
+        threading.Thread(target=reader, args=(source,), daemon=True).start()
+
+    remaining = len(sources)
+    try:
+        while remaining:
+            name, line = lines.get()
+            if line is None:
+                remaining -= 1
+            else:
+                emit(name, line)
+    finally:
+        stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="capture a container's output into rotating logs")
+    parser.add_argument("container")
+    parser.add_argument("directory")
+    parser.add_argument("--max-bytes", type=int, default=50 * 2**20)
+    parser.add_argument("--backups", type=int, default=5)
+    parser.add_argument("--rm", action="store_true", default=False,
+                        help="remove the container once it has exited")
+    parser.add_argument("--endpoint", default=None,
+                        help="the docker endpoint the container runs on")
+    args = parser.parse_args()
+
+    configure(level="INFO")
+    use_endpoint(args.endpoint)
+    sys.exit(follow_container(args.container, args.directory, args.max_bytes,
+                              args.backups, args.rm))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,20 @@
+import time
+import os
+
 from dataclasses import dataclass, field
 from dataclasses import dataclass
 
 from .wrapper import DockerWrapper
-from .utils.build import build
-from .utils.run import exec_or_run
+from .backends import current_endpoint
+from .utils.build import build, print_step, BuildReport
+from .utils.manifest import BuildManifest
+from .utils.context import BuildContext
+from .utils.run import exec_or_run, container_run_detached
+from .sweep import make_jobs, run_sweep, summary_table
+from .pool import WarmPool
+from .ports import PortRegistry
+from .datasets import DatasetCache, DEFAULT_CACHE
+from . import batch, labels, trace
 
 @dataclass
 class MyContainerSpec:
@@ -16,6 +27,53 @@ class MyContainerSpec:
     post_removal: bool
     rebuild: bool
 
+    # extra paths/patterns kept out of the build context, on top of
+    # .dockerignore and host_dir
+    context_excludes: list[str] = field(default_factory=list)
+    context_warn_mb: int = 500
+
+    # warm pool for `dboy r`: idle containers to keep (0 disables it unless
+    # `--pool` is passed), the max including leased ones, and the idle timeout
+    pool_size: int = 0
+    pool_max: int = 4
+    pool_idle_timeout: int = 1800
+
+    # detached runs (`dboy r -d`) log to host_dir/logs/<container>, rotated
+    # and gzipped past log_max_mb, keeping log_backups archives
+    log_max_mb: int = 50
+    log_backups: int = 5
+
+    # prepared datasets (`dboy data`), mounted read-only into every container
+    data_cache: str = DEFAULT_CACHE
+    mount_data: bool = True
+
+    # the directory of the config, labelled on everything dboy creates so
+    # that only this project's containers and images are listed
+    project: str = None
+
+    # snapshot versions (`dboy b -r`): squash once deeper than squash_depth
+    # layers (0 never does), `dboy gc` keeps the last keep_versions
+    squash_depth: int = 0
+    keep_versions: int = 3
+
+    # host ports are leased from this range when the requested one is taken,
+    # see `ports`
+    port_range: tuple[int, int] = (6006, 6106)
+
+    # more images built with this one (`dboy b`), each a mapping with
+    # image_name, dockerfile_path and optionally context_excludes; at most
+    # build_jobs build at once, see `buildgraph`
+    images: list[dict] = field(default_factory=list)
+    build_jobs: int = 2
+
+    # docker daemons to spread containers over (DOCKER_HOST URLs or
+    # contexts), see `endpoints`; empty is just the local one
+    endpoints: list[str] = field(default_factory=list)
+
+    # compressed, layer-deduplicated image archive for `dboy image`, see
+    # `images`; None is images.DEFAULT_ARCHIVE, not imported up front
+    image_archive: str = None
+
     # TODO: Maybe spec shouldn't know about MyContainer and MyImage
     def into_container(self, build=False):
         image = self.into_image()
@@ -26,6 +84,21 @@ class MyContainerSpec:
             self.ports,
             self.interactive,
             self.post_removal)
+        cls.pool_size = self.pool_size
+        cls.pool_max = self.pool_max
+        cls.pool_idle_timeout = self.pool_idle_timeout
+        cls.log_max_mb = self.log_max_mb
+        cls.log_backups = self.log_backups
+        cls.data_cache = self.data_cache
+        cls.mount_data = self.mount_data
+        cls.keep_versions = self.keep_versions
+        cls.images = [{"context_warn_mb": self.context_warn_mb, **image}
+                      for image in self.images]
+        cls.build_jobs = self.build_jobs
+        cls.endpoints = list(self.endpoints)
+        cls.image_archive = self.image_archive
+        DockerWrapper.squash_depth = self.squash_depth
+        PortRegistry.port_range = tuple(self.port_range)
 
         if build:
             cls.build_image()
@@ -33,7 +106,14 @@ class MyContainerSpec:
         return cls
 
     def into_image(self):
-        return MyImage(self.name, self.dockerfile)
+        # before MyImage looks anything up
+        labels.scope(os.path.abspath(self.project or os.getcwd()), self.name)
+        if self.endpoints:
+            from .endpoints import select
+            select(self.endpoints, f"{self.name}-container")
+        return MyImage(self.name, self.dockerfile,
+                       context_excludes=[self.host_dir, *self.context_excludes],
+                       context_warn_mb=self.context_warn_mb)
 
 
 @dataclass
@@ -41,19 +121,69 @@ class MyImage:
     _build_status: bool = field(init=False)
     name: str = field()
     dockerfile: str
+    context_excludes: list[str] = field(default_factory=list)
+    context_warn_mb: int = 500
 
     def __post_init__(self):
         self.name = self.name + "-image"
         self._build_status = None
         self.is_ready()
 
-    def build(self):
-        print("Starting build...")
-        status = build(self.name, self.dockerfile)
-        print(
-            f"image `{self.name}` {'built!' if status else 'failed to build!'}")
-        self._build_status = status
-        return status
+    def build(self, force=False, on_step=print_step, log=print, manifest: BuildManifest = None,
+              parents: list[str] = ()):
+        """ Build the image unless its context hash and the IDs of its
+        `parents` (local images it is built `FROM`) match the last build and
+        that image still exists. `force` always builds.
+
+        Concurrent builds (see `buildgraph`) share one `manifest`, which the
+        caller saves, and prefix their output through `on_step` and `log`.
+        """
+        context = self.context()
+        save = manifest is None
+        if save:
+            manifest = BuildManifest()
+        with trace.span("context hash", [context.path]):
+            context_hash = manifest.context_hash(context.path, context.files())
+
+        # image IDs differ between daemons
+        endpoint = current_endpoint()
+        key = self.name if endpoint is None else f"{self.name}@{endpoint}"
+        last = manifest.lookup(key)
+        parent_ids = {parent: DockerWrapper.get_image_id(parent).split(":")[-1][:12]
+                      for parent in parents}
+        if not force and last is not None and last["hash"] == context_hash \
+                and last.get("parents", {}) == parent_ids \
+                and DockerWrapper.is_image_ready(last["image_id"]):
+            log(
+                f"image `{self.name}` is up to date, skipping build (use --force to rebuild)")
+            if save:
+                manifest.save()
+            self._build_status = True
+            return BuildReport(self.name, returncode=0,
+                               image_id=last["image_id"], skipped=True)
+
+        log("Starting build...")
+        context.check(log=log)
+        report = build(self.name, context, on_step=on_step)
+        if not report:
+            log("\n".join(report.tail))
+        log(report.totals)
+        log(
+            f"image `{self.name}` {'built!' if report else 'failed to build!'}")
+        self._build_status = report.success
+
+        if report:
+            image_id = (report.image_id or DockerWrapper.get_image_id(self.name))
+            manifest.record(key, context_hash,
+                            image_id.split(":")[-1][:12], parent_ids)
+        if save:
+            manifest.save()
+
+        return report
+
+    def context(self) -> BuildContext:
+        return BuildContext(self.dockerfile, self.context_excludes,
+                            self.context_warn_mb)
 
     def is_ready(self):
         """ Returns True if the image was built successfully.
@@ -64,6 +194,14 @@ class MyImage:
 
         return self._build_status
 
+    def usable(self):
+        """ `is_ready`, or an image of this name from before ownership labels,
+        see `DockerWrapper.adopt_image`. For commands that need the image.
+        """
+        if not self.is_ready() and DockerWrapper.adopt_image(self.name):
+            self._build_status = True
+        return self._build_status
+
     @staticmethod
     def from_spec(spec: MyContainerSpec):
         return spec.into_image()
@@ -75,7 +213,7 @@ class MyContainer(MyContainerSpec):
     _alive: bool = field(init=False)
     # TODO: If we decide to standardize the directory structure, we can remove
     # this
-    container_dir: str
+    container_dir: str = None
     # this was passed to image, but it's not used here
     dockerfile: str = field(init=False)
 
@@ -85,7 +223,7 @@ class MyContainer(MyContainerSpec):
         self._configured = False
 
     def run(self, cmd: list[str], build=False,
-            interactive=None, post_removal=None):
+            interactive=None, post_removal=None, pool=None):
         if isinstance(cmd, str):
             cmd = cmd.split()
 
@@ -95,15 +233,28 @@ class MyContainer(MyContainerSpec):
         if build and not self._image._build_status:
             self._image.build()
 
-        if self._image.is_ready():
+        if pool is None:
+            pool = self.pool_size > 0
+        if not pool:
+            self.place()
+
+        if self._image.usable():
             if interactive is None:
                 interactive = self.interactive
             if post_removal is None:
                 post_removal = self.post_removal
 
+            if pool:
+                if self.pool().run(cmd, interactive=interactive) is not None:
+                    return
+                print("Warm pool is full, starting a new container instead")
+
+            volumes, env = self.data_mounts()
+
             new_name = exec_or_run(self._image.name, self.name, self.host_dir, cmd,
                                    container_dir=self.container_dir, interactive=interactive,
-                                   post_removal=post_removal, port=self.ports, rebuild=self.rebuild)
+                                   post_removal=post_removal, port=self.ports, rebuild=self.rebuild,
+                                   volumes=volumes, env=env)
 
             if new_name != self.name:
                 # exec_or_run returns the new container name if it was rebuilt
@@ -116,7 +267,238 @@ class MyContainer(MyContainerSpec):
             print(
                 f"Image {self._image.name} failed to execute, check build status!")
 
+    def run_detached(self, cmd: list[str], post_removal=None):
+        """ Start `cmd` in the background, with its output captured under
+        `log_dir()` by a follower process.
+        """
+        from .logs import start_follower
+
+        if isinstance(cmd, str):
+            cmd = cmd.split()
+
+        if not self._configured:
+            raise ValueError("Container not configured!")
+
+        self.place()
+        if not self._image.usable():
+            print(
+                f"Image {self._image.name} failed to execute, check build status!")
+            return False
+
+        if post_removal is None:
+            post_removal = self.post_removal
+
+        volumes, env = self.data_mounts()
+        if not container_run_detached(self._image.name, self.name, self.host_dir, cmd,
+                                      container_dir=self.container_dir, port=self.ports,
+                                      volumes=volumes, env=env):
+            print(f"Failed to start {self.name}")
+            return False
+
+        log_dir = self.log_dir()
+        start_follower(self.name, log_dir, max_bytes=self.log_max_mb * 2**20,
+                       backups=self.log_backups, remove=post_removal)
+        self._alive = True
+        print(f"Started {self.name} in the background, logging to {log_dir}")
+        print("Follow it with `dboy logs -f`")
+        return True
+
+    def place(self):
+        """ Move to the least loaded of `endpoints` that has the image, unless
+        the container already exists, see `endpoints.place`.
+        """
+        if not self.endpoints:
+            return
+
+        from .endpoints import place
+
+        before = current_endpoint()
+        if place(self.name, self._image.name, self.endpoints) != before:
+            # looked up on the other daemon so far
+            self._image._build_status = None
+            self._alive = DockerWrapper.is_container_running(self.name)
+
+    def endpoint_of(self, name: str = None) -> str | None:
+        """ The endpoint container `name` (default: this one) runs on. """
+        if not self.endpoints:
+            return current_endpoint()
+
+        from .endpoints import endpoint_of
+
+        return endpoint_of(name or self.name, self.endpoints)
+
+    def build_endpoints(self):
+        """ Yields every endpoint `dboy b` builds on, with the backend pointed
+        at it: all of `endpoints`, or just the current daemon.
+        """
+        if not self.endpoints:
+            yield current_endpoint()
+            return
+
+        from .endpoints import each, describe
+
+        for endpoint in each(self.endpoints):
+            if len(self.endpoints) > 1:
+                print(f"Building on {describe(endpoint)}")
+            self._image._build_status = None
+            yield endpoint
+        self._image._build_status = None
+
+    def image_refs(self) -> list[str]:
+        """ This image and the config's other `images`, what `dboy image`
+        exports and imports by default.
+        """
+        return [self._image.name, *(f"{spec['image_name']}-image" for spec in self.images)]
+
+    def export_images(self, refs: list[str] = (), archive: str = None) -> list:
+        """ Save images into the image archive, see `images.ImageArchive`. """
+        from .images import ImageArchive
+
+        archive = ImageArchive(archive or self.image_archive)
+        return [archive.export(ref) for ref in refs or self.image_refs()]
+
+    def import_images(self, refs: list[str] = (), archive: str = None, full: bool = False) -> list:
+        """ Load images from the image archive into the daemon, sending only
+        the layers it doesn't have unless `full`.
+        """
+        from .images import ImageArchive
+
+        archive = ImageArchive(archive or self.image_archive)
+        reports = [archive.restore(ref, full=full) for ref in refs or self.image_refs()]
+        self._image._build_status = None
+        return reports
+
+    def log_dir(self, name: str = None) -> str:
+        return os.path.join(self.host_dir, "logs", name or self.name)
+
+    def sweep(self, cmd: list[str], jobs: list, workers: int = None, verbose: bool = False):
+        """ Fan `cmd` out into one container per job, see `sweep.make_jobs`. """
+        if isinstance(cmd, str):
+            cmd = cmd.split()
+
+        if not self._configured:
+            raise ValueError("Container not configured!")
+
+        if not self._image.usable():
+            print(
+                f"Image {self._image.name} failed to execute, check build status!")
+            return []
+
+        sweep_jobs = make_jobs(self.name, cmd, jobs)
+        volumes, env = self.data_mounts()
+        run_sweep(self._image.name, self.host_dir, self.container_dir,
+                  sweep_jobs, workers=workers, verbose=verbose, volumes=volumes, env=env,
+                  endpoints=self.endpoints)
+        print(summary_table(sweep_jobs))
+
+        return sweep_jobs
+
+    def batch(self, jobs: list, containers: int = 1, per_container: int = 1,
+              retries: int = 0, results: str = None, verbose: bool = False):
+        """ Exec every job into running pool containers, see `batch.run_batch`. """
+        if not self._configured:
+            raise ValueError("Container not configured!")
+
+        if not self._image.usable():
+            print(
+                f"Image {self._image.name} failed to execute, check build status!")
+            return []
+
+        batch_jobs = batch.make_batch_jobs(jobs)
+        batch.run_batch(self.pool(), batch_jobs, containers=containers,
+                        per_container=per_container, retries=retries,
+                        results=results, verbose=verbose)
+        print(batch.summary_table(batch_jobs))
+        if results:
+            print(f"Results written to {results}")
+
+        return batch_jobs
+
+    def pool(self) -> WarmPool:
+        volumes, env = self.data_mounts()
+        return WarmPool(self.name, self._image.name, self.host_dir, self.container_dir,
+                        size=max(self.pool_size, 1), max_size=self.pool_max,
+                        idle_timeout=self.pool_idle_timeout, volumes=volumes, env=env)
+
+    def datasets(self) -> DatasetCache:
+        return DatasetCache(self.data_cache)
+
+    def data_mounts(self) -> tuple[list[tuple[str, str]], dict]:
+        """ The dataset cache volume and TFDS_DATA_DIR for containers this
+        starts, or nothing if `mount_data` is off or the cache is empty.
+        """
+        if not self.mount_data:
+            return [], {}
+        return self.datasets().mounts()
+
+    def prepare_dataset(self, name: str, from_dir: str = None) -> dict:
+        """ Put a dataset into the cache, either a directory tfds already
+        prepared or by running `download_and_prepare` in this image.
+        """
+        if from_dir is not None:
+            return self.datasets().add(name, from_dir)
+
+        if not self._image.usable():
+            raise ValueError(f"Image {self._image.name} is not built, run `dboy b` first")
+        return self.datasets().prepare(name, self._image.name, f"{self.name}-data-{name}")
+
+    def stats(self, interval: float = 1.0, capacity: int = 3600, root: str = None):
+        """ A cgroup sampler for this container, see `stats.StatsSampler`. """
+        from .stats import StatsSampler, CGROUP_ROOT
+
+        return StatsSampler.for_container(self.name, interval, capacity, root or CGROUP_ROOT)
+
+    def stats_logdir(self) -> str:
+        """ Where `dboy stats --tb` writes, next to the training runs in tb_logs. """
+        return os.path.join(self.host_dir, "tb_logs", "dboy-stats",
+                            f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}")
+
+    def tb_logdir(self) -> str:
+        return os.path.join(self.host_dir, "tb_logs")
+
+    def tensorboard(self, logdirs: list[str] = (), compact: bool = False) -> int | None:
+        """ Start a TensorBoard sidecar showing this project's tb_logs next to
+        `logdirs` ([name=]path), see `tensorboard`. Returns its host port.
+        """
+        from .tensorboard import start
+
+        if not self._configured:
+            raise ValueError("Container not configured!")
+
+        if not self._image.usable():
+            print(
+                f"Image {self._image.name} failed to execute, check build status!")
+            return None
+
+        # training writes into it later, TensorBoard picks that up
+        os.makedirs(self.tb_logdir(), exist_ok=True)
+        own = f"{self.name.removesuffix('-container')}={self.tb_logdir()}"
+        return start(self._image.name, self.name, [own, *logdirs], compact=compact)
+
+    def stop_tensorboard(self) -> bool:
+        from .tensorboard import stop
+
+        return stop(self.name)
+
+    def compact_tensorboard(self, logdirs: list[str] = (), **limits) -> list[tuple[str, int, int]]:
+        """ Downsample the large event files of this project's tb_logs and
+        `logdirs` into `<logdir>_compact` copies, see `tensorboard.compact`.
+        """
+        from .tensorboard import compact
+
+        compacted = []
+        for logdir in [self.tb_logdir(), *(path.partition("=")[2] or path for path in logdirs)]:
+            if not os.path.isdir(logdir):
+                print(f"{logdir} does not exist, skipping it")
+                continue
+            compacted.extend((os.path.join(logdir, path), before, after)
+                             for path, before, after in compact(logdir, **limits))
+        return compacted
+
     def shutdown(self):
+        if not self._alive and not DockerWrapper.does_container_exist(self.name) \
+                and DockerWrapper.adopt_container(self.name) is not None:
+            self._alive = DockerWrapper.is_container_running(self.name)
         if self._alive:
             DockerWrapper.shutdown_container(self.name)
             self._alive = DockerWrapper.is_container_running(self.name)
@@ -124,20 +506,75 @@ class MyContainer(MyContainerSpec):
             print(f"Shutdown status: {not self._alive}")
 
     def remove(self):
-        if self._alive:
-            self.shutdown()
+        # also adopts a container from before ownership labels, see shutdown
+        self.shutdown()
 
         DockerWrapper.remove_container(self.name)
 
-    def build_image(self):
-        return self._image.build()
-
-    def rebuild(self):
-        self.name = DockerWrapper.update_and_rebuild_container(self.name)
-        self._image = MyImage(self.name, self._image.dockerfile)
+    def build_image(self, force=False):
+        reports = []
+        for _ in self.build_endpoints():
+            report = self._image.build(force=force)
+            if report and not report.skipped:
+                # pool containers from the previous image are now stale
+                self.pool().prune()
+            reports.append(report)
+        # the first failure, if any
+        return next((report for report in reports if not report), reports[-1])
+
+    def build_images(self, targets: list[str] = (), force=False, jobs: int = None,
+                     keep_going=False) -> bool:
+        """ Build this image and the config's other `images` as a DAG, see
+        `buildgraph.BuildGraph`. `targets` limits it to those images and
+        their ancestors.
+        """
+        from .buildgraph import BuildGraph
+
+        images = [self._image]
+        for spec in self.images:
+            images.append(MyImage(spec["image_name"], spec["dockerfile_path"],
+                                  context_excludes=[self.host_dir,
+                                                    *spec.get("context_excludes", [])],
+                                  context_warn_mb=spec["context_warn_mb"]))
+
+        ok = True
+        for _ in self.build_endpoints():
+            graph = BuildGraph(images)
+            if targets:
+                graph.select(targets)
+            ok = graph.build(jobs or self.build_jobs, force=force, keep_going=keep_going) and ok
+            print(graph.table())
+
+            main = graph.nodes.get(self._image.name)
+            if main is not None and main.status == "built":
+                # pool containers from the previous image are now stale
+                self.pool().prune()
+        return ok
+
+    # not `rebuild`, the spec field of that name shadows it on instances
+    def snapshot_and_rebuild(self):
+        """ Snapshot the container as the next version of its image (see
+        `lineage`), then build the image again.
+        """
+        if DockerWrapper.does_container_exist(self.name):
+            image_name = DockerWrapper.update_and_rebuild_container(self.name)
+            print(f"Snapshotted {self.name} as {image_name}")
 
         self.build_image()
 
+    def gc(self, keep: int = None, dry_run: bool = False) -> str:
+        """ Reclaim superseded snapshot versions, stopped containers and
+        dangling images of this project, see `lineage.gc`.
+        """
+        from .lineage import gc
+
+        return gc(self._image.name, self.keep_versions if keep is None else keep, dry_run)
+
+    def versions(self) -> str:
+        from .lineage import Lineage
+
+        return Lineage().table(self._image.name)
+
     @staticmethod
     def from_image(image: MyImage, build=False):
         cls = MyContainer(
@@ -0,0 +1,282 @@
+import fcntl
+import json
+import time
+import os
+
+from contextlib import contextmanager
+
+from .backends import get_backend
+from .wrapper import DockerWrapper
+from .utils.misc import dboy_path, format_table, write_json
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+POOL_FILE = "pool.json"
+# pool containers only have to stay up until a command is exec'd into them
+SLEEP_CMD = ["sleep", "infinity"]
+# how often the idle watchdog looks for exec'd processes, at most
+WATCHDOG_STEP = 60
+
+
+def _watchdog_cmd(idle_timeout: int) -> list[str]:
+    """ Entrypoint that exits once nothing has been exec'd into the container
+    for `idle_timeout` seconds, so pool containers go away even if dboy never
+    reconciles the pool again. The shell counts the container's processes
+    by globbing /proc (no subprocess of its own); more than itself means an
+    exec is running.
+    """
+    if not idle_timeout:
+        return SLEEP_CMD
+
+    step = min(idle_timeout, WATCHDOG_STEP)
+    return ["sh", "-c",
+            f"trap 'exit 0' TERM; idle=0; "
+            f"while [ $idle -lt {idle_timeout} ]; do "
+            f"sleep {step} & wait $!; set -- /proc/[0-9]*; "
+            f"if [ $# -gt 1 ]; then idle=0; else idle=$((idle + {step})); fi; "
+            f"done"]
+
+
+def _short_id(image_id: str) -> str:
+    # the CLI and the Engine API report image IDs in different lengths
+    return image_id.split(":")[-1][:12]
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WarmPool:
+    """ Idle containers kept running from the current image, so that running a
+    command is a `docker exec` instead of a cold container start.
+
+    Pool containers are named `<container>-pool-<n>`, run an idle watchdog
+    (see `_watchdog_cmd`) with `host_dir` mounted, and are tracked in
+    `.dboy/pool.json` under a file lock. Whenever the pool is used it is reconciled first: containers started
+    from an older image, idle for longer than `idle_timeout` seconds, or leased
+    by a dboy process that no longer exists are removed.
+    """
+
+    def __init__(self, container_name: str, image_name: str, host_dir: str,
+                 container_dir: str, size: int = 1, max_size: int = 4,
+                 idle_timeout: int = 1800, max_uses: int = 0, path: str = None,
+                 volumes: list[tuple[str, str]] = (), env: dict = None):
+        self.container_name = container_name
+        self.image_name = image_name
+        self.host_dir = host_dir
+        self.container_dir = container_dir
+        # idle containers to keep around, and the cap including leased ones
+        self.size = size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        # recycle a container after this many commands, 0 never does
+        self.max_uses = max_uses
+        self.path = path or dboy_path(POOL_FILE)
+        # extra mounts and environment, e.g. the dataset cache
+        self.volumes = list(volumes)
+        self.env = env
+
+    @contextmanager
+    def _locked(self):
+        """ Yields this pool's entries ({container name: entry}) while holding
+        the registry lock, and writes them back afterwards.
+        """
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            registry = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r") as f:
+                    registry = json.load(f)
+
+            entries = registry.setdefault(self.container_name, {})
+            yield entries
+
+            if not entries:
+                del registry[self.container_name]
+            write_json(self.path, registry)
+
+    def _image_id(self) -> str:
+        return _short_id(DockerWrapper.get_image_id(self.image_name))
+
+    def _discard(self, reasons: dict[str, str]):
+        """ Force-remove pool containers ({name: reason}) concurrently. """
+        if not reasons:
+            return
+
+        import asyncio
+        from .aio import AsyncDockerWrapper
+
+        for name, reason in reasons.items():
+            logger.info(f"Removing pool container {name}: {reason}")
+        asyncio.run(AsyncDockerWrapper().remove_many(reasons, force=True))
+        for name in reasons:
+            DockerWrapper.state().containers.pop(name, None)
+
+    def _reconcile(self, entries: dict):
+        if not entries:
+            return
+
+        image_id = self._image_id()
+        now = time.time()
+        discard = {}
+        for name, entry in list(entries.items()):
+            container = DockerWrapper.state().containers.get(name)
+            if container is None or not container.running:
+                reason = "not running"
+            elif entry["image_id"] != image_id:
+                reason = "the image was rebuilt"
+            elif entry["state"] == "leased" and not _pid_alive(entry["pid"]):
+                reason = "its lease holder exited"
+            elif entry["state"] == "idle" and self.idle_timeout \
+                    and now - entry["last_used"] > self.idle_timeout:
+                reason = "idle timeout"
+            else:
+                continue
+
+            if container is not None:
+                discard[name] = reason
+            del entries[name]
+
+        # the cap may have been lowered since these were started
+        idle = sorted((e["last_used"], n) for n, e in entries.items() if e["state"] == "idle")
+        for _, name in idle[:max(0, len(entries) - self.max_size)]:
+            discard[name] = "pool is above its max size"
+            del entries[name]
+
+        self._discard(discard)
+
+    def _start(self, entries: dict) -> str | None:
+        image_id = self._image_id()
+        if not image_id:
+            logger.warning(f"Image {self.image_name} does not exist, can't start a pool container")
+            return None
+
+        n = 0
+        while f"{self.container_name}-pool-{n}" in entries or \
+                DockerWrapper.does_container_exist(f"{self.container_name}-pool-{n}"):
+            n += 1
+        name = f"{self.container_name}-pool-{n}"
+
+        ok = get_backend().run_detached(
+            self.image_name, name, _watchdog_cmd(self.idle_timeout),
+            volumes=[(self.host_dir, self.container_dir), *self.volumes],
+            workdir=self.container_dir, env=self.env)
+        DockerWrapper.invalidate(images=False)
+        if not ok:
+            return None
+
+        entries[name] = {"image_id": image_id, "state": "idle", "pid": None,
+                         "last_used": time.time(), "uses": 0}
+        return name
+
+    def _fill(self, entries: dict, target: int) -> int:
+        started = 0
+        while sum(e["state"] == "idle" for e in entries.values()) < target \
+                and len(entries) < self.max_size:
+            if self._start(entries) is None:
+                break
+            started += 1
+        return started
+
+    def warm(self, n: int = None) -> int:
+        """ Start containers until `n` (default: `size`) are idle. Returns how
+        many were started.
+        """
+        with self._locked() as entries:
+            self._reconcile(entries)
+            return self._fill(entries, self.size if n is None else n)
+
+    def lease(self) -> str | None:
+        """ Take an idle container, starting one if there is room. Returns None
+        if the pool is at its max size with every container leased.
+        """
+        with self._locked() as entries:
+            self._reconcile(entries)
+
+            idle = [(e["last_used"], n) for n, e in entries.items() if e["state"] == "idle"]
+            if idle:
+                name = max(idle)[1]
+            elif len(entries) < self.max_size:
+                name = self._start(entries)
+                if name is None:
+                    return None
+            else:
+                return None
+
+            entries[name].update(state="leased", pid=os.getpid())
+            return name
+
+    def release(self, name: str, recycle: bool = False):
+        """ Return a leased container to the pool, or remove it if `recycle` is
+        set or it has served `max_uses` commands.
+        """
+        with self._locked() as entries:
+            entry = entries.get(name)
+            if entry is None:
+                return
+
+            entry["uses"] += 1
+            if recycle or (self.max_uses and entry["uses"] >= self.max_uses):
+                self._discard({name: "recycled"})
+                del entries[name]
+            else:
+                entry.update(state="idle", pid=None, last_used=time.time())
+
+    def run(self, cmd: list[str], interactive: bool = True) -> int | None:
+        """ Exec `cmd` in a leased container and refill the pool afterwards.
+        Returns the exit code, or None if no container could be leased.
+        """
+        name = self.lease()
+        if name is None:
+            return None
+
+        print(f"Executing \"{' '.join(cmd)}\" in pool container {name}")
+        returncode = None
+        try:
+            returncode = get_backend().exec(name, cmd, interactive=interactive)
+        finally:
+            # a failed exec may have left the container in any state
+            self.release(name, recycle=returncode is None)
+
+        self.warm()
+        return returncode
+
+    def drain(self) -> int:
+        """ Remove every pool container. Returns how many were removed. """
+        with self._locked() as entries:
+            for name, entry in entries.items():
+                if entry["state"] == "leased" and _pid_alive(entry["pid"]):
+                    logger.warning(f"Removing {name} while it is leased by pid {entry['pid']}")
+            self._discard({name: "drained" for name in entries
+                           if DockerWrapper.does_container_exist(name)})
+            removed = len(entries)
+            entries.clear()
+            return removed
+
+    def prune(self):
+        """ Reconcile without leasing, e.g. right after a rebuild. """
+        with self._locked() as entries:
+            self._reconcile(entries)
+
+    def status(self) -> str:
+        with self._locked() as entries:
+            self._reconcile(entries)
+            rows = [("container", "state", "uses", "idle for")]
+            now = time.time()
+            for name, entry in sorted(entries.items()):
+                idle_for = f"{now - entry['last_used']:.0f}s" if entry["state"] == "idle" else "-"
+                state = entry["state"] if entry["state"] == "idle" else f"leased by {entry['pid']}"
+                rows.append((name, state, str(entry["uses"]), idle_for))
+
+        lines = format_table(rows)
+        lines.append(f"{len(rows) - 1}/{self.max_size} containers, "
+                     f"target {self.size} idle, idle timeout {self.idle_timeout}s")
+        return "\n".join(lines)
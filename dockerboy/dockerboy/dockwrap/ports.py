@@ -0,0 +1,151 @@
+""" Host ports for the containers dboy starts.
+
+Every spec asks for the same ports (6006 for TensorBoard by default), so a
+second project's container would fail to bind them. Before a container is
+created its host ports are leased from a registry shared by every project on
+the host (`~/.cache/dockerboy/ports.json`, or `DBOY_PORT_REGISTRY`), under a
+file lock:
+
+    {"6006": {"container": "a-container", "container_port": 6006,
+              "project": "/home/me/a", "since": 1700000000.0}}
+
+A requested host port is kept if it is free, otherwise the first free one in
+`port_range` is taken instead. A port is free when no lease holds it and
+nothing on the host listens on it. Leases are released when dboy removes the
+container, and those of containers that no longer exist are dropped once
+they get in the way.
+
+Ports of another endpoint's host (see `endpoints`) are leased as
+`"6006@tcp://gpu-box:2376"`; whether they are bound there can't be checked
+from here.
+"""
+import socket
+import fcntl
+import json
+import time
+import os
+
+from contextlib import contextmanager
+
+from .backends import get_backend, current_endpoint
+from .utils.misc import write_json
+from . import labels
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+DEFAULT_REGISTRY = os.path.join(os.path.expanduser("~"), ".cache", "dockerboy", "ports.json")
+
+
+def _bindable(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        try:
+            s.bind(("0.0.0.0", port))
+        except OSError:
+            return False
+    return True
+
+
+def _key(port: int) -> str:
+    endpoint = current_endpoint()
+    return str(port) if endpoint is None else f"{port}@{endpoint}"
+
+
+def _on_current_endpoint(key: str) -> bool:
+    return key.partition("@")[2] == (current_endpoint() or "")
+
+
+class PortRegistry:
+    # set from the config, like DockerWrapper.squash_depth
+    port_range: tuple[int, int] = (6006, 6106)
+
+    def __init__(self, path: str = None):
+        self.path = path or os.environ.get("DBOY_PORT_REGISTRY", DEFAULT_REGISTRY)
+
+    @contextmanager
+    def _locked(self):
+        """ Yields the leases ({port: lease}) while holding the registry lock,
+        and writes them back afterwards.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            leases = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r") as f:
+                    leases = json.load(f)
+
+            yield leases
+
+            write_json(self.path, leases)
+
+    @staticmethod
+    def _reconcile(leases: dict):
+        # every project's containers, not just this one's
+        with labels.unscoped():
+            existing = {c.name for c in get_backend().ps(all=True)}
+        for key, lease in list(leases.items()):
+            if _on_current_endpoint(key) and lease["container"] not in existing:
+                logger.info(f"Dropping the lease on port {key}: "
+                            f"{lease['container']} no longer exists")
+                del leases[key]
+
+    def allocate(self, container: str, ports: list[tuple[int, int]]) -> list[tuple[int, int]]:
+        """ Lease a host port for every (host, container) mapping, keeping the
+        requested host port when it's free. Returns the mappings to publish.
+        """
+        if not ports:
+            return []
+
+        low, high = self.port_range
+        allocated = []
+        with self._locked() as leases:
+            # a container being recreated gives its old ports back first
+            for key, lease in list(leases.items()):
+                if lease["container"] == container and _on_current_endpoint(key):
+                    del leases[key]
+
+            local = current_endpoint() is None
+            reconciled = False
+            for host_port, container_port in ports:
+                for port in [host_port, *(p for p in range(low, high + 1) if p != host_port)]:
+                    if _key(port) in leases and not reconciled:
+                        self._reconcile(leases)
+                        reconciled = True
+                    if _key(port) not in leases and (not local or _bindable(port)):
+                        break
+                else:
+                    raise RuntimeError(f"No free host port for {container_port} "
+                                       f"in {low}-{high}, see {self.path}")
+
+                leases[_key(port)] = {"container": container, "container_port": container_port,
+                                     "project": labels.current().get(labels.PROJECT),
+                                     "since": time.time()}
+                allocated.append((port, container_port))
+                moved = f" ({host_port} is taken)" if port != host_port else ""
+                print(f"Publishing port {container_port} of {container} "
+                      f"on host port {port}{moved}")
+        return allocated
+
+    def release(self, *containers: str) -> list[int]:
+        """ Give back every port leased to `containers`. """
+        if not os.path.exists(self.path):
+            return []
+
+        released = []
+        with self._locked() as leases:
+            for key, lease in list(leases.items()):
+                if lease["container"] in containers and _on_current_endpoint(key):
+                    del leases[key]
+                    released.append(int(key.partition("@")[0]))
+        return released
+
+    def leased(self, container: str) -> list[tuple[int, int]]:
+        """ The (host, container) ports leased to `container`. """
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r") as f:
+            return sorted((int(key.partition("@")[0]), lease["container_port"])
+                          for key, lease in json.load(f).items()
+                          if lease["container"] == container and _on_current_endpoint(key))
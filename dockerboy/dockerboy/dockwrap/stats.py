@@ -0,0 +1,206 @@
+import threading
+import time
+import csv
+import os
+
+from collections import deque, namedtuple
+
+from .utils.tfevents import EventWriter
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+CGROUP_ROOT = os.environ.get("DBOY_CGROUP_ROOT", "/sys/fs/cgroup")
+
+# raw counters as read from the cgroup, in the units the kernel reports
+Sample = namedtuple("Sample", [
+    "time", "cpu_usec", "cpu_user_usec", "cpu_system_usec", "throttled_usec",
+    "memory_bytes", "io_read_bytes", "io_write_bytes"])
+
+# what the exports show: rates over the interval before each sample
+COLUMNS = ["time", "cpu_percent", "memory_mb", "io_read_mb_s", "io_write_mb_s", "throttled_percent"]
+
+
+def find_cgroup(container_id: str, root: str = CGROUP_ROOT) -> str | None:
+    """ The cgroup v2 directory of a container, for both the systemd and the
+    cgroupfs cgroup drivers, or None if it isn't there (not running, or not
+    cgroup v2).
+    """
+    for candidate in (f"system.slice/docker-{container_id}.scope", f"docker/{container_id}"):
+        path = os.path.join(root, candidate)
+        if os.path.isdir(path):
+            return path
+
+    # rootless docker and custom cgroup parents nest it further down
+    for dirpath, dirnames, _ in os.walk(root):
+        for d in dirnames:
+            if container_id in d:
+                return os.path.join(dirpath, d)
+    return None
+
+
+class CgroupReader:
+    """ Keeps the cgroup's stat files open and re-reads them with pread, so a
+    sample is a handful of syscalls rather than path lookups and opens.
+    Controllers that aren't enabled for the cgroup read as zero.
+    """
+    FILES = ("cpu.stat", "memory.current", "io.stat")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fds = {}
+        for name in self.FILES:
+            try:
+                self.fds[name] = os.open(os.path.join(path, name), os.O_RDONLY)
+            except FileNotFoundError:
+                logger.debug(f"{name} not available in {path}")
+
+        if not self.fds:
+            raise FileNotFoundError(f"No cgroup stat files in {path}")
+
+    def _read(self, name: str) -> str:
+        fd = self.fds.get(name)
+        if fd is None:
+            return ""
+        return os.pread(fd, 1 << 16, 0).decode()
+
+    def read(self) -> Sample:
+        """ Raises OSError once the cgroup is gone, i.e. the container stopped. """
+        if not os.path.isdir(self.path):
+            raise FileNotFoundError(self.path)
+        now = time.time()
+
+        cpu = {}
+        for line in self._read("cpu.stat").splitlines():
+            key, _, value = line.partition(" ")
+            cpu[key] = int(value)
+
+        memory = self._read("memory.current").strip()
+
+        read_bytes = write_bytes = 0
+        # "8:0 rbytes=1 wbytes=2 rios=3 ..." per device
+        for line in self._read("io.stat").splitlines():
+            for field in line.split()[1:]:
+                key, _, value = field.partition("=")
+                if key == "rbytes":
+                    read_bytes += int(value)
+                elif key == "wbytes":
+                    write_bytes += int(value)
+
+        return Sample(now, cpu.get("usage_usec", 0), cpu.get("user_usec", 0),
+                      cpu.get("system_usec", 0), cpu.get("throttled_usec", 0),
+                      int(memory or 0), read_bytes, write_bytes)
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
+
+class StatsSampler:
+    """ Samples a container's cgroup every `interval` seconds into a ring
+    buffer of the last `capacity` samples.
+
+        sampler = StatsSampler.for_container("default-container")
+        sampler.start()
+        ...
+        sampler.stop()
+        sampler.to_csv("stats.csv")
+    """
+
+    def __init__(self, name: str, cgroup_path: str, interval: float = 1.0, capacity: int = 3600):
+        self.name = name
+        self.cgroup_path = cgroup_path
+        self.interval = interval
+        self.samples: deque[Sample] = deque(maxlen=capacity)
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def for_container(container_name: str, interval: float = 1.0, capacity: int = 3600,
+                      root: str = CGROUP_ROOT) -> "StatsSampler":
+        from .wrapper import DockerWrapper
+
+        container_id = DockerWrapper.get_container_id(container_name)
+        if not DockerWrapper.is_container_running(container_name):
+            raise ValueError(f"Container {container_name} is not running")
+
+        path = find_cgroup(container_id, root)
+        if path is None:
+            raise FileNotFoundError(
+                f"No cgroup v2 directory for {container_name} ({container_id[:12]}) under {root}")
+        return StatsSampler(container_name, path, interval, capacity)
+
+    def run(self, duration: float = None, on_sample=None):
+        """ Sample until the container stops, `duration` seconds pass or
+        `stop()` is called. `on_sample(row)` gets each exported row.
+        """
+        reader = CgroupReader(self.cgroup_path)
+        deadline = None if duration is None else time.monotonic() + duration
+        try:
+            while not self._stop.is_set():
+                try:
+                    sample = reader.read()
+                except OSError:
+                    logger.info(f"cgroup of {self.name} is gone, stopping")
+                    break
+
+                previous = self.samples[-1] if self.samples else None
+                self.samples.append(sample)
+                if on_sample is not None and previous is not None:
+                    on_sample(_row(previous, sample, self.samples[0].time))
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                # sleep to the next tick, not a full interval after the read
+                self._stop.wait(self.interval - (time.time() - sample.time) % self.interval)
+        finally:
+            reader.close()
+
+    def start(self, duration: float = None) -> threading.Thread:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, args=(duration,), daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def rows(self) -> list[dict]:
+        samples = list(self.samples)
+        if not samples:
+            return []
+        return [_row(a, b, samples[0].time) for a, b in zip(samples, samples[1:])]
+
+    def to_csv(self, path: str) -> int:
+        rows = self.rows()
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        return len(rows)
+
+    def to_tensorboard(self, logdir: str) -> str:
+        """ Write the rows as scalars under `stats/`, one step per sample. """
+        with EventWriter(logdir) as writer:
+            for step, (row, sample) in enumerate(zip(self.rows(), list(self.samples)[1:])):
+                for column in COLUMNS[1:]:
+                    writer.add_scalar(f"stats/{column}", row[column], step, wall_time=sample.time)
+        return writer.path
+
+
+def _row(a: Sample, b: Sample, origin: float) -> dict:
+    elapsed = max(b.time - a.time, 1e-9)
+    return {
+        "time": round(b.time - origin, 3),
+        # 100% is one core
+        "cpu_percent": round((b.cpu_usec - a.cpu_usec) / elapsed / 1e4, 2),
+        "memory_mb": round(b.memory_bytes / 2**20, 2),
+        "io_read_mb_s": round((b.io_read_bytes - a.io_read_bytes) / elapsed / 2**20, 3),
+        "io_write_mb_s": round((b.io_write_bytes - a.io_write_bytes) / elapsed / 2**20, 3),
+        "throttled_percent": round((b.throttled_usec - a.throttled_usec) / elapsed / 1e4, 2),
+    }
@@ -0,0 +1,179 @@
+import itertools
+import threading
+import time
+import re
+import os
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .backends import get_backend, using
+from .wrapper import DockerWrapper
+from .utils.misc import format_table
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+@dataclass
+class SweepJob:
+    index: int
+    name: str
+    cmd: list[str]
+    params: dict = field(default_factory=dict)
+    returncode: Optional[int] = None
+    duration: Optional[float] = None
+    # set when the sweep is spread over several endpoints
+    endpoint: Optional[str] = None
+    # last lines of output, shown for failed jobs
+    tail: deque = field(default_factory=lambda: deque(maxlen=10), repr=False)
+
+    @property
+    def label(self):
+        if not self.params:
+            return " ".join(self.cmd)
+        return " ".join(f"{k}={v}" for k, v in self.params.items())
+
+
+def expand_grid(grid: dict[str, list]) -> list[dict]:
+    """ Cartesian product of a parameter grid: {"lr": [1, 2], "bs": [3]} -> [{lr: 1, bs: 3}, {lr: 2, bs: 3}] """
+    keys = list(grid)
+    values = [v if isinstance(v, list) else [v] for v in grid.values()]
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def make_jobs(container_name: str, cmd: list[str], jobs: list) -> list[SweepJob]:
+    """ Derive one uniquely named job per entry.
+
+    An entry is either a dict of parameters or a full command (a string or a
+    list). Parameters are substituted into `{placeholders}` in `cmd`, or
+    appended as `--key=value` flags if `cmd` has no placeholders. `{name}`
+    and `{index}` are always available, e.g. to give each job its own log dir.
+    Braces that don't name one of these are left alone (`python -c "d={}"`).
+    """
+    sweep_jobs = []
+    for i, job in enumerate(jobs):
+        name = f"{container_name}-sweep-{i}"
+        if isinstance(job, dict):
+            fmt = {"name": name, "index": i, **job}
+            if any(key in fmt for part in cmd for key in PLACEHOLDER.findall(part)):
+                job_cmd = [_fill(part, fmt) for part in cmd]
+            else:
+                job_cmd = [*cmd, *(f"--{k}={v}" for k, v in job.items())]
+            sweep_jobs.append(SweepJob(i, name, job_cmd, dict(job)))
+        else:
+            job_cmd = job.split() if isinstance(job, str) else [str(part) for part in job]
+            sweep_jobs.append(SweepJob(i, name, job_cmd))
+
+    return sweep_jobs
+
+
+def _fill(part: str, fmt: dict) -> str:
+    return PLACEHOLDER.sub(lambda m: str(fmt[m[1]]) if m[1] in fmt else m[0], part)
+
+
+def run_sweep(image_name: str, host_dir: str, container_dir: str, jobs: list[SweepJob],
+              workers: int = None, verbose: bool = False,
+              volumes: list[tuple[str, str]] = (), env: dict = None,
+              endpoints: list[str] = ()) -> list[SweepJob]:
+    """ Run every job in its own `--rm` container, at most `workers` at a time.
+    With several `endpoints` each job starts on the least loaded one that
+    has the image, see `endpoints.Balancer`.
+
+    Status is printed as jobs start and finish; exit codes and wall times are
+    collected on the jobs themselves.
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    print_lock = threading.Lock()
+
+    balancer = None
+    if len(endpoints) > 1:
+        from .endpoints import Balancer, pinned
+
+        if not pinned():
+            balancer = Balancer(endpoints, image_name)
+            if not balancer:
+                raise RuntimeError(f"None of the endpoints can run {image_name}")
+
+    def say(msg):
+        with print_lock:
+            print(msg, flush=True)
+
+    def run_job(job: SweepJob):
+        def on_line(line):
+            job.tail.append(line)
+            if verbose:
+                say(f"[{job.name}] {line}")
+
+        if balancer is None:
+            return run_on(job, on_line, "")
+
+        load = balancer.acquire()
+        job.endpoint = load.endpoint or "default"
+        try:
+            with using(load.endpoint):
+                return run_on(job, on_line, f" on {job.endpoint}")
+        finally:
+            balancer.release(load)
+
+    def run_on(job: SweepJob, on_line, where: str):
+        backend = get_backend()
+        # a leftover container from an earlier sweep would block the name
+        if DockerWrapper.does_container_exist(job.name):
+            backend.rm(job.name)
+
+        say(f"[{job.name}] started{where}: {job.label}")
+        started = time.monotonic()
+        job.returncode = backend.run(
+            image_name, job.name, job.cmd, volumes=[(host_dir, container_dir), *volumes],
+            workdir=container_dir, interactive=False, remove=True,
+            env={**(env or {}), "DBOY_JOB": job.name}, on_line=on_line)
+        job.duration = time.monotonic() - started
+        say(f"[{job.name}] finished with exit code {job.returncode} in {job.duration:.1f}s")
+        return job
+
+    # load the snapshots once before the threads share them
+    for load in balancer.loads if balancer else ():
+        with using(load.endpoint):
+            DockerWrapper.state().containers
+    DockerWrapper.state().containers
+
+    print(f"Running {len(jobs)} jobs with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_job, job) for job in jobs]
+        for future in as_completed(futures):
+            exc = future.exception()
+            if exc is not None:
+                logger.error(f"Sweep job failed to run: {exc}")
+
+    for load in balancer.loads if balancer else ():
+        with using(load.endpoint):
+            DockerWrapper.invalidate(images=False)
+    DockerWrapper.invalidate(images=False)
+    return jobs
+
+
+def summary_table(jobs: list[SweepJob]) -> str:
+    spread = any(job.endpoint is not None for job in jobs)
+    rows = [("job", "params", *(("endpoint",) if spread else ()), "exit", "time")]
+    for job in jobs:
+        rows.append((job.name, job.label,
+                     *((job.endpoint,) if spread else ()),
+                     "-" if job.returncode is None else str(job.returncode),
+                     "-" if job.duration is None else f"{job.duration:.1f}s"))
+
+    lines = format_table(rows)
+
+    failed = [job for job in jobs if job.returncode != 0]
+    lines.append(f"{len(jobs) - len(failed)}/{len(jobs)} jobs succeeded")
+    for job in failed:
+        if job.tail:
+            lines.append(f"--- {job.name} (last lines)")
+            lines.extend(job.tail)
+
+    return "\n".join(lines)
@@ -0,0 +1,151 @@
+""" TensorBoard in a container of its own.
+
+`dboy tb` used to exec TensorBoard into the training container, where it
+competed with training for CPU and went away with the container. The
+sidecar is a separate container from the same image, without GPUs, that
+mounts any number of `tb_logs` directories read-only under one logdir:
+
+    /tb/<run>  <-  host_dir/tb_logs, ../other/shared/tb_logs, ...
+
+so every run shows up side by side. Its host port is leased like any other
+(see `ports`).
+
+Event files of long runs take TensorBoard a long time to load. `compact`
+mirrors a logdir into `<logdir>_compact`, with large event files downsampled
+(see `tfevents.downsample`) and everything else hard-linked, and the sidecar
+can serve those copies instead.
+"""
+import shutil
+import os
+
+from .backends import get_backend
+from .wrapper import DockerWrapper
+from .ports import PortRegistry
+from .utils.tfevents import downsample
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+MOUNT_ROOT = "/tb"
+PORT = 6006
+COMPACT_SUFFIX = "_compact"
+
+
+def sidecar_name(container: str) -> str:
+    return f"{container}-tb"
+
+
+def run_names(logdirs: list[str]) -> dict[str, str]:
+    """ A unique run name per logdir: `name=path` names it explicitly,
+    otherwise it is the directory name, or its parent's for `tb_logs`.
+    """
+    runs = {}
+    for logdir in logdirs:
+        name, sep, path = logdir.partition("=")
+        if not sep:
+            path = logdir
+            name = os.path.basename(os.path.abspath(path))
+            if name == "tb_logs":
+                name = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        unique, n = name, 2
+        while unique in runs:
+            unique, n = f"{name}-{n}", n + 1
+        runs[unique] = os.path.abspath(path)
+    return runs
+
+
+def start(image: str, container: str, logdirs: list[str], compact: bool = False) -> int | None:
+    """ (Re)start the sidecar serving `logdirs`. Returns its host port, or
+    None if it failed to start.
+    """
+    name = sidecar_name(container)
+    runs = run_names(logdirs)
+    if compact:
+        runs = {run: f"{path}{COMPACT_SUFFIX}" if os.path.isdir(f"{path}{COMPACT_SUFFIX}")
+                else path for run, path in runs.items()}
+
+    volumes = []
+    for run, path in list(runs.items()):
+        if not os.path.isdir(path):
+            logger.warning(f"{path} does not exist, leaving {run} out")
+            del runs[run]
+            continue
+        volumes.append((path, f"{MOUNT_ROOT}/{run}:ro"))
+    if not volumes:
+        raise ValueError(f"None of {', '.join(logdirs)} exist")
+
+    if DockerWrapper.does_container_exist(name):
+        if DockerWrapper.is_container_running(name):
+            DockerWrapper.shutdown_container(name)
+        DockerWrapper.remove_container(name)
+
+    registry = PortRegistry()
+    ports = registry.allocate(name, [(PORT, PORT)])
+    cmd = ["tensorboard", "--logdir", MOUNT_ROOT, "--bind_all", "--port", str(PORT)]
+    ok = get_backend().run_detached(image, name, cmd, volumes=volumes, workdir=MOUNT_ROOT,
+                                    ports=ports, gpus=False)
+    DockerWrapper.invalidate(images=False)
+    if not ok:
+        registry.release(name)
+        return None
+
+    for run, path in runs.items():
+        print(f"  {run}: {path}")
+    return ports[0][0]
+
+
+def stop(container: str) -> bool:
+    name = sidecar_name(container)
+    if not DockerWrapper.does_container_exist(name):
+        return False
+    if DockerWrapper.is_container_running(name):
+        DockerWrapper.shutdown_container(name)
+    DockerWrapper.remove_container(name)
+    return True
+
+
+def is_event_file(filename: str) -> bool:
+    return "tfevents" in filename
+
+
+def compact(logdir: str, out: str = None, min_mb: float = 10.0, max_scalars: int = 1000,
+            max_other: int = 100) -> list[tuple[str, int, int]]:
+    """ Mirror `logdir` into `out` (default `<logdir>_compact`), downsampling
+    event files of at least `min_mb` and hard-linking the rest. Files whose
+    copy is newer than them are skipped, so running it again is cheap.
+    Returns (path, bytes before, bytes after) for every file downsampled.
+    """
+    logdir = os.path.abspath(logdir)
+    out = os.path.abspath(out or f"{logdir}{COMPACT_SUFFIX}")
+    compacted = []
+    for root, dirs, files in os.walk(logdir):
+        dirs.sort()
+        target_dir = os.path.join(out, os.path.relpath(root, logdir))
+        os.makedirs(target_dir, exist_ok=True)
+        for filename in sorted(files):
+            src = os.path.join(root, filename)
+            dst = os.path.join(target_dir, filename)
+            size = os.path.getsize(src)
+            large = is_event_file(filename) and size >= min_mb * 2**20
+            if os.path.exists(dst):
+                # a link is up to date until the file grows large, a copy
+                # until the file changes
+                linked = os.path.samefile(src, dst)
+                if (linked and not large) or \
+                        (not linked and os.path.getmtime(dst) >= os.path.getmtime(src)):
+                    continue
+
+            if large:
+                values_in, values_out = downsample(src, dst, max_scalars, max_other)
+                logger.info(f"{src}: kept {values_out} of {values_in} values")
+                compacted.append((os.path.relpath(src, logdir), size, os.path.getsize(dst)))
+                continue
+
+            if os.path.exists(dst):
+                os.remove(dst)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+    return compacted
@@ -0,0 +1,179 @@
+""" Spans for every docker interaction.
+
+The backends wrap each docker CLI call and Engine API request in a `span`.
+Nothing is kept unless a hook is registered; a hook is any callable taking
+the finished Span:
+
+    from dockerboy.dockwrap import trace
+
+    recorder = trace.add_hook(trace.Recorder())
+    ...
+    print(recorder.summary())
+    recorder.write_chrome_trace("dboy-trace.json")
+
+or, to feed your own metrics:
+
+    trace.add_hook(lambda span: statsd.timing(span.name, span.duration * 1000))
+"""
+# Imported by the backends on every `dboy` invocation, so only cheap modules.
+import functools
+import threading
+import time
+import os
+
+from .utils.misc import format_table
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+_hooks: list = []
+# open spans per thread, to find each span's parent
+_local = threading.local()
+
+
+class Span:
+    """ One timed operation. `status` is the exit code, or the HTTP status if
+    `http` is set (or "error" if it raised), `out_bytes` the size of the
+    output read back and `parent` the name of the span it ran in, if any.
+    """
+    __slots__ = ("name", "args", "start", "duration", "status", "http", "out_bytes",
+                 "tid", "parent", "nest")
+
+    def __init__(self, name: str, args=(), nest: bool = True):
+        self.name = name
+        self.args = [str(arg) for arg in args]
+        self.start = None
+        self.duration = None
+        self.status = None
+        self.http = False
+        self.out_bytes = 0
+        self.tid = threading.get_ident()
+        self.parent = None
+        self.nest = nest
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault("stack", [])
+        self.parent = stack[-1].name if stack else None
+        if self.nest:
+            stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if self.nest:
+            _local.stack.remove(self)
+        if exc_type is not None and self.status is None:
+            self.status = "error"
+        for hook in list(_hooks):
+            try:
+                hook(self)
+            except Exception as e:
+                logger.warning(f"Trace hook {hook!r} failed: {e}")
+        return False
+
+    @property
+    def failed(self) -> bool:
+        if self.status == "error":
+            return True
+        if isinstance(self.status, int):
+            return not 200 <= self.status < 400 if self.http else self.status != 0
+        return False
+
+    def __repr__(self):
+        duration = "-" if self.duration is None else f"{self.duration * 1000:.1f}ms"
+        return f"Span({self.name!r}, {duration}, status={self.status!r})"
+
+
+def span(name: str, args=(), nest: bool = True) -> Span:
+    """ Time the block it wraps. Spans that can overlap on one thread, like
+    concurrent asyncio calls, should pass `nest=False` so they don't become
+    each other's parents.
+    """
+    return Span(name, args, nest)
+
+
+def traced(name: str):
+    """ Method decorator: wrap each call in a span, with an int return value
+    as its status.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with span(name, args) as s:
+                result = method(self, *args, **kwargs)
+                if isinstance(result, int):
+                    s.status = result
+            return result
+        return wrapper
+    return decorate
+
+
+def add_hook(hook):
+    """ Call `hook(span)` for every finished span. Returns the hook. """
+    _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def _is_docker(name: str) -> bool:
+    return name.startswith(("docker ", "engine "))
+
+
+class Recorder:
+    """ A hook that keeps every span, for `dboy --profile`. """
+
+    def __init__(self):
+        self.spans: list[Span] = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def __call__(self, span: Span):
+        with self.lock:
+            self.spans.append(span)
+
+    def summary(self) -> str:
+        groups = {}
+        for s in self.spans:
+            groups.setdefault(s.name, []).append(s)
+
+        rows = [("operation", "calls", "total", "mean", "max", "bytes", "failed")]
+        for name, spans in sorted(groups.items(), key=lambda g: -sum(s.duration for s in g[1])):
+            durations = [s.duration * 1000 for s in spans]
+            rows.append((name, str(len(spans)), f"{sum(durations):.1f}ms",
+                         f"{sum(durations) / len(spans):.1f}ms", f"{max(durations):.1f}ms",
+                         str(sum(s.out_bytes for s in spans)),
+                         str(sum(s.failed for s in spans))))
+
+        lines = format_table(rows, right_align=True)
+
+        wall = (time.perf_counter() - self.origin) * 1000
+        # spans inside other docker spans (Engine API requests made for one
+        # run) would be counted twice
+        docker = sum(s.duration for s in self.spans if _is_docker(s.name)
+                     and not (s.parent and _is_docker(s.parent))) * 1000
+        lines.append(f"{len(self.spans)} spans, {docker:.1f}ms of {wall:.1f}ms in docker calls")
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> dict:
+        """ The spans as Chrome trace events, for chrome://tracing or Perfetto. """
+        pid = os.getpid()
+        events = [{
+            "name": s.name, "cat": "docker", "ph": "X", "pid": pid, "tid": s.tid,
+            "ts": round((s.start - self.origin) * 1e6, 1),
+            "dur": round(s.duration * 1e6, 1),
+            "args": {"args": " ".join(s.args), "status": s.status,
+                     "out_bytes": s.out_bytes, "parent": s.parent},
+        } for s in self.spans]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path: str):
+        import json
+
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
@@ -1,13 +1,171 @@
 # image management
-import subprocess
+import time
+import re
 
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Optional
 
-def build(image_name, dockerfile_path="."):
-    results = subprocess.run(["docker", "build", "-t", image_name, dockerfile_path],
-                             capture_output=True).stdout.decode()
+from ..backends import get_backend
+from ..wrapper import DockerWrapper
+from .context import BuildContext
 
-    # if the image was built successfully, return True
-    if "Successfully built" in results:
-        return True
-    else:
-        return False
+
+# classic builder: "Step 2/5 : RUN pip install ..."
+CLASSIC_STEP = re.compile(r"^Step (\d+)/(\d+) : (.*)$")
+CLASSIC_BUILT = re.compile(r"^Successfully built ([0-9a-f]+)")
+# BuildKit plain progress: "#7 [2/5] RUN pip install ...", "#7 CACHED", "#7 DONE 3.1s"
+BUILDKIT_VERTEX = re.compile(r"^#(\d+) (.*)$")
+BUILDKIT_STEP = re.compile(r"^\[(?:[\w.-]+ )?(\d+)/(\d+)\] (.*)$")
+BUILDKIT_DONE = re.compile(r"^DONE (\d+(?:\.\d+)?)s$")
+BUILDKIT_IMAGE = re.compile(r"writing image (sha256:[0-9a-f]+)")
+
+
+@dataclass
+class BuildStep:
+    index: int
+    total: int
+    instruction: str
+    cached: bool = False
+    duration: Optional[float] = None
+    _started: float = field(default=0.0, repr=False)
+
+    def __str__(self):
+        status = "cached" if self.cached else "built"
+        took = f"{self.duration:.2f}s" if self.duration is not None else "-"
+        return f"[{self.index}/{self.total}] {self.instruction} ({status}, {took})"
+
+
+@dataclass
+class BuildReport:
+    image_name: str
+    returncode: Optional[int] = None
+    image_id: Optional[str] = None
+    # set when the build was skipped because the context didn't change
+    skipped: bool = False
+    duration: float = 0.0
+    steps: list[BuildStep] = field(default_factory=list)
+    # only the last lines are kept so memory doesn't grow with the log
+    tail: deque = field(default_factory=lambda: deque(maxlen=20))
+
+    @property
+    def success(self):
+        return self.returncode == 0
+
+    @property
+    def cache_hits(self):
+        return sum(step.cached for step in self.steps)
+
+    def __bool__(self):
+        return self.success
+
+    @property
+    def totals(self) -> str:
+        if self.skipped:
+            return "build skipped, context unchanged"
+        return (f"{len(self.steps)} steps, {self.cache_hits} cached, "
+                f"{self.duration:.2f}s total")
+
+    def summary(self) -> str:
+        return "\n".join([*(str(step) for step in self.steps), self.totals])
+
+
+class BuildParser:
+    """ Turns build output into BuildSteps one line at a time.
+
+    Understands both the classic builder's "Step N/M" output and BuildKit's
+    plain progress output. `on_step` is called with each step once it is
+    finished.
+    """
+
+    def __init__(self, report: BuildReport,
+                 on_step: Optional[Callable[[BuildStep], None]] = None):
+        self.report = report
+        self.on_step = on_step
+        self._current: Optional[BuildStep] = None
+        self._vertices: dict[str, BuildStep] = {}
+
+    def _finish(self, step: BuildStep, duration: float = None):
+        if step.duration is not None:
+            return
+        step.duration = duration if duration is not None else time.monotonic() - step._started
+        if self.on_step is not None:
+            self.on_step(step)
+
+    def _start(self, index, total, instruction) -> BuildStep:
+        step = BuildStep(int(index), int(total), instruction.strip(),
+                         _started=time.monotonic())
+        self.report.steps.append(step)
+        return step
+
+    def feed(self, line: str):
+        line = line.rstrip()
+        self.report.tail.append(line)
+
+        match = CLASSIC_STEP.match(line)
+        if match:
+            if self._current is not None:
+                self._finish(self._current)
+            self._current = self._start(*match.groups())
+            return
+
+        if line.strip() == "---> Using cache" and self._current is not None:
+            self._current.cached = True
+            return
+
+        match = CLASSIC_BUILT.match(line)
+        if match:
+            self.report.image_id = match.group(1)
+            if self._current is not None:
+                self._finish(self._current)
+                self._current = None
+            return
+
+        match = BUILDKIT_VERTEX.match(line)
+        if match:
+            vertex, message = match.groups()
+            step = self._vertices.get(vertex)
+
+            started = BUILDKIT_STEP.match(message)
+            if started and step is None:
+                self._vertices[vertex] = self._start(*started.groups())
+            elif step is not None and message == "CACHED":
+                step.cached = True
+                self._finish(step, 0.0)
+            elif step is not None and BUILDKIT_DONE.match(message):
+                self._finish(step, float(BUILDKIT_DONE.match(message).group(1)))
+
+            image = BUILDKIT_IMAGE.search(message)
+            if image:
+                self.report.image_id = image.group(1)
+
+    def close(self):
+        if self._current is not None:
+            self._finish(self._current)
+            self._current = None
+
+
+def print_step(step: BuildStep):
+    print(step)
+
+
+def build(image_name, context: BuildContext | str = ".",
+          on_step: Optional[Callable[[BuildStep], None]] = print_step) -> BuildReport:
+    """ Build an image while streaming its output through a BuildParser.
+
+    `context` is a BuildContext or a directory. Success is decided by the
+    builder's exit status, so it works the same with or without BuildKit.
+    The returned BuildReport is truthy on success.
+    """
+    report = BuildReport(image_name)
+    parser = BuildParser(report, on_step)
+
+    started = time.monotonic()
+    report.returncode = get_backend().build(
+        image_name, context, on_line=parser.feed)
+    parser.close()
+    report.duration = time.monotonic() - started
+
+    DockerWrapper.invalidate(containers=False)
+
+    return report
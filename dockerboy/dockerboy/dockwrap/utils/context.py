@@ -0,0 +1,236 @@
+import threading
+import tarfile
+import heapq
+import re
+import os
+
+from dataclasses import dataclass, field
+
+from .misc import DBOY_DIR
+from ..lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+# files docker always sends, whatever .dockerignore says
+ALWAYS_SENT = ("Dockerfile", ".dockerignore")
+
+
+def _pattern_to_regex(pattern: str) -> re.Pattern:
+    """ Translate a .dockerignore pattern (Go filepath.Match plus `**`) to a regex. """
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**", i):
+            # "**/" matches zero or more directories
+            if pattern.startswith("**/", i):
+                out.append("(?:.*/)?")
+                i += 3
+            else:
+                out.append(".*")
+                i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body[:1] in ("!", "^"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile("".join(out) + "$")
+
+
+class IgnoreRules:
+    """ .dockerignore-style matching: the last matching pattern wins and `!`
+    patterns re-include paths. A pattern matching a directory excludes
+    everything below it.
+    """
+
+    def __init__(self, patterns: list[str] = ()):
+        self.rules: list[tuple[bool, re.Pattern]] = []
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern: str):
+        pattern = pattern.strip()
+        if not pattern or pattern.startswith("#"):
+            return
+
+        negate = pattern.startswith("!")
+        if negate:
+            pattern = pattern[1:].strip()
+
+        pattern = os.path.normpath(pattern).lstrip("/")
+        if pattern == ".":
+            return
+        self.rules.append((negate, _pattern_to_regex(pattern)))
+
+    @property
+    def has_exceptions(self):
+        return any(negate for negate, _ in self.rules)
+
+    def is_excluded(self, relpath: str) -> bool:
+        parts = relpath.split("/")
+        # a path is also matched through any of its parent directories
+        candidates = ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+        excluded = False
+        for negate, regex in self.rules:
+            if any(regex.match(c) for c in candidates):
+                excluded = not negate
+        return excluded
+
+    @staticmethod
+    def from_file(path: str) -> "IgnoreRules":
+        rules = IgnoreRules()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    rules.add(line)
+        return rules
+
+
+@dataclass
+class ContextReport:
+    total_bytes: int = 0
+    file_count: int = 0
+    largest: list[tuple[int, str]] = field(default_factory=list)
+
+    def __str__(self):
+        lines = [f"Build context: {self.file_count} files, {_human(self.total_bytes)}"]
+        lines += [f"  {_human(size):>10}  {path}" for size, path in self.largest]
+        return "\n".join(lines)
+
+
+def _human(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+class TarStream:
+    """ A tar written by `write_tar` straight to a pipe, for docker's stdin
+    or a chunked HTTP body, so it is never held in memory.
+    """
+
+    def write_tar(self, fileobj):
+        raise NotImplementedError
+
+    def stream_to(self, fd_or_file, close: bool = True) -> threading.Thread:
+        """ Write the tar to a pipe from a background thread, so the reader
+        (docker's stdin or an HTTP body) can consume it as it is produced.
+        """
+        fileobj = os.fdopen(fd_or_file, "wb") if isinstance(fd_or_file, int) else fd_or_file
+
+        def writer():
+            try:
+                self.write_tar(fileobj)
+            except BrokenPipeError:
+                logger.warning(f"{type(self).__name__} stream closed early")
+            finally:
+                if close:
+                    try:
+                        fileobj.close()
+                    except BrokenPipeError:
+                        pass
+
+        thread = threading.Thread(target=writer, daemon=True)
+        thread.start()
+        return thread
+
+    def chunks(self, size: int = 1 << 16):
+        """ Iterate over the tar in chunks, e.g. as a chunked HTTP body. """
+        read_fd, write_fd = os.pipe()
+        thread = self.stream_to(write_fd)
+        with os.fdopen(read_fd, "rb") as reader:
+            for chunk in iter(lambda: reader.read(size), b""):
+                yield chunk
+        thread.join()
+
+
+class BuildContext(TarStream):
+    """ The set of files sent to the daemon for a build.
+
+    Honours the context's `.dockerignore` plus dockerboy's own `excludes`
+    (absolute paths inside the context, or patterns). The tar is written
+    straight to a stream, so the context is never held in memory.
+    """
+
+    def __init__(self, path: str, excludes: list[str] = (), warn_mb: int = 500):
+        self.path = os.path.abspath(path)
+        self.warn_mb = warn_mb
+
+        self.rules = IgnoreRules.from_file(os.path.join(self.path, ".dockerignore"))
+        self.rules.add(DBOY_DIR)
+        for exclude in excludes:
+            if exclude is None:
+                continue
+            if os.path.isabs(exclude):
+                exclude = os.path.relpath(os.path.abspath(exclude), self.path)
+                # paths outside the context can't end up in it anyway
+                if exclude.startswith(".."):
+                    continue
+            self.rules.add(exclude)
+
+    def files(self):
+        """ Yields (relative path, absolute path) for every file sent, sorted. """
+        # excluded directories can only be skipped wholesale if no `!` rule
+        # could re-include something below them
+        prune = not self.rules.has_exceptions
+
+        for root, dirs, files in os.walk(self.path):
+            reldir = os.path.relpath(root, self.path)
+            reldir = "" if reldir == "." else reldir + "/"
+
+            if prune:
+                dirs[:] = [d for d in dirs if not self.rules.is_excluded(reldir + d)]
+            dirs.sort()
+
+            for name in sorted(files):
+                relpath = reldir + name
+                if relpath in ALWAYS_SENT or not self.rules.is_excluded(relpath):
+                    yield relpath, os.path.join(root, name)
+
+    def report(self, top: int = 5) -> ContextReport:
+        report = ContextReport()
+        heap = []
+        for relpath, path in self.files():
+            size = os.lstat(path).st_size
+            report.total_bytes += size
+            report.file_count += 1
+            if len(heap) < top:
+                heapq.heappush(heap, (size, relpath))
+            else:
+                heapq.heappushpop(heap, (size, relpath))
+
+        report.largest = sorted(heap, reverse=True)
+        return report
+
+    def check(self, top: int = 5, log=print) -> ContextReport:
+        """ Print the context size and largest files, warning above `warn_mb`. """
+        report = self.report(top)
+        log(str(report))
+        if report.total_bytes > self.warn_mb * 1024 * 1024:
+            logger.warning(
+                f"Build context is {_human(report.total_bytes)}, above the "
+                f"{self.warn_mb}MB threshold. Add the large paths to .dockerignore "
+                f"or `context_excludes`.")
+        return report
+
+    def write_tar(self, fileobj):
+        with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+            for relpath, path in self.files():
+                tar.add(path, arcname=relpath, recursive=False)
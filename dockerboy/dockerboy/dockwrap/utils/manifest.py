@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+from .misc import dboy_path, write_json, DBOY_DIR
+
+
+MANIFEST_FILE = "manifest.json"
+
+
+def iter_context_files(context_path: str):
+    """ Yields (relative path, absolute path) for every file in the build context, sorted. """
+    for root, dirs, files in os.walk(context_path):
+        # dockerboy's own state changes on every build, never hash it
+        if root == context_path and DBOY_DIR in dirs:
+            dirs.remove(DBOY_DIR)
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, context_path), path
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BuildManifest:
+    """ Maps image names to the context hash, parent image IDs and image ID
+    they were last built from.
+
+    Stored as JSON under `.dboy/`. It also caches per-file digests keyed by
+    (size, mtime, inode) so unchanged files aren't re-read on every check.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or dboy_path(MANIFEST_FILE)
+        self.images: dict[str, dict] = {}
+        self.files: dict[str, list] = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            self.images = data.get("images", {})
+            self.files = data.get("files", {})
+
+    def save(self):
+        write_json(self.path, {"images": self.images, "files": self.files})
+
+    def _cached_digest(self, path: str) -> str:
+        st = os.stat(path)
+        key = [st.st_size, st.st_mtime_ns, st.st_ino]
+        cached = self.files.get(path)
+        if cached is not None and cached[:3] == key:
+            return cached[3]
+
+        digest = file_digest(path)
+        self.files[path] = [*key, digest]
+        return digest
+
+    def context_hash(self, context_path: str, files=None) -> str:
+        """ Hash of every file's relative path, mode and content in the context.
+
+        `files` can be an iterable of (relative path, absolute path) to hash
+        instead of walking the whole directory.
+        """
+        context_path = os.path.abspath(context_path)
+        if files is None:
+            files = iter_context_files(context_path)
+
+        digest = hashlib.sha256()
+        seen = set()
+        for relpath, path in files:
+            path = os.path.abspath(path)
+            seen.add(path)
+            digest.update(relpath.encode())
+            digest.update(oct(os.stat(path).st_mode & 0o777).encode())
+            digest.update(self._cached_digest(path).encode())
+
+        # forget digests of files that left this context
+        prefix = context_path.rstrip(os.sep) + os.sep
+        for path in [p for p in self.files if p.startswith(prefix) and p not in seen]:
+            del self.files[path]
+
+        return digest.hexdigest()
+
+    def lookup(self, image_name: str):
+        return self.images.get(image_name)
+
+    def record(self, image_name: str, context_hash: str, image_id: str,
+               parents: dict = None):
+        """ `parents` maps the local images it was built `FROM` to their IDs
+        at the time, so the image is rebuilt when one of them changes.
+        """
+        self.images[image_name] = {"hash": context_hash, "image_id": image_id,
+                                   "parents": parents or {}}
@@ -1,3 +1,6 @@
+import os
+
+
 def format_port(port: tuple[int, int]):
     """ Ports can be malformed: (a,a) (a,) (,b) (a,b) """
     if isinstance(port[0], int) or isinstance(port[1], int):
@@ -23,11 +26,22 @@ def format_ports(ports: list[tuple[int, int]]):
         return ports
 
 
-def update_version(container_name: str):
-    # parse the version number
-    name, version = container_name.split(":")
-    version = int(version[1:])
-    return f"{name}:v{version}"
+def split_ref(ref: str) -> tuple[str, str]:
+    """ "repo:tag" -> ("repo", "tag"), "" for no tag. A registry port
+    ("host:5000/repo") isn't a tag.
+    """
+    repository, sep, tag = ref.rpartition(":")
+    if not sep or "/" in tag:
+        return ref, ""
+    return repository, tag
+
+
+def update_version(ref: str):
+    """ "name:v3" -> "name:v4"; anything without a version tag becomes "name:v1". """
+    name, tag = split_ref(ref)
+    if tag[:1] == "v" and tag[1:].isdigit():
+        return f"{name}:v{int(tag[1:]) + 1}"
+    return f"{name}:v1"
 
 
 def image_to_container_name(image_name: str):
@@ -35,3 +49,36 @@ def image_to_container_name(image_name: str):
     The image name always ends with "image" and the container name always ends with "container".
     """
     return image_name.replace("image", "container")
+
+
+DBOY_DIR = ".dboy"
+
+
+def dboy_path(*parts: str) -> str:
+    """Path inside the project's local state dir (`.dboy/`), which is created on demand."""
+    os.makedirs(DBOY_DIR, exist_ok=True)
+    return os.path.join(DBOY_DIR, *parts)
+
+
+def write_json(path: str, data):
+    """ Replace `path` with `data` as JSON in one step, so readers never see
+    a half-written file.
+    """
+    import json
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+
+def format_table(rows: list[tuple[str, ...]], right_align: bool = False) -> list[str]:
+    """ The lines of `rows` in aligned columns, with a dashed line under the
+    first (the header). `right_align` aligns every column but the first to
+    the right, for numbers.
+    """
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ["  ".join(cell.rjust(w) if i and right_align else cell.ljust(w)
+                       for i, (cell, w) in enumerate(zip(row, widths))) for row in rows]
+    lines.insert(1, "  ".join("-" * w for w in widths))
+    return lines
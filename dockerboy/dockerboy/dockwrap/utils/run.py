@@ -1,47 +1,82 @@
-import subprocess
-import logging
 
+from ..backends import get_backend, NameInUse
 from ..wrapper import DockerWrapper
+from ..ports import PortRegistry
 from .misc import format_port
+from ..lazylog import get_logger
 
-logger = logging.getLogger(__name__)
+logger = get_logger(__name__)
 
 
-def container_run(image_name: str, container_name: str, host_dir: str,
-                  cmd: list[str], container_dir: str = None, port: list[tuple] | tuple = (None, None),
-                  interactive: bool = True, post_removal: bool = True
-                  ):
-    optional = []
-
+def publish(container_name: str, port: list[tuple] | tuple) -> list[tuple[int, int]]:
+    """ Lease host ports for a new container's (host, container) port
+    mappings, see `ports.PortRegistry`.
+    """
     if isinstance(port, list):
-        for p in port:
-            p = format_port(p)
-            optional.extend(["-p", f"0.0.0.0:{p[0]}:{p[1]}"])
+        ports = [format_port(p) for p in port]
     else:
-        port = format_port(port)
-        optional.extend(["-p", f"0.0.0.0:{port[0]}:{port[1]}"])
+        ports = [format_port(port)]
+    return PortRegistry().allocate(container_name, [p for p in ports if p is not None])
 
-    if interactive:
-        optional.append("-it")
 
-    if post_removal:
-        optional.append("--rm")
+def container_run(image_name: str, container_name: str, host_dir: str,
+                  cmd: list[str], container_dir: str = None, port: list[tuple] | tuple = (None, None),
+                  interactive: bool = True, post_removal: bool = True,
+                  volumes: list[tuple[str, str]] = (), env: dict = None
+                  ) -> int:
+    ports = publish(container_name, port)
 
     # if container_dir is not specified, use the last directory in host_dir
     if container_dir is None:
         container_dir = host_dir.split("/")[-1]
 
-    final_cmd = ["docker", "run", *optional, "--gpus", "all",
-                 "--name", container_name, "-v", f"{host_dir}:{container_dir}",
-                 "-w", container_dir, image_name, *cmd]
+    try:
+        status = get_backend().run(image_name, container_name, cmd,
+                                   volumes=[(host_dir, container_dir), *volumes],
+                                   workdir=container_dir, ports=ports, interactive=interactive,
+                                   remove=post_removal, env=env)
+    finally:
+        if post_removal and ports:
+            PortRegistry().release(container_name)
+        # the run created (and maybe already removed) a container
+        DockerWrapper.invalidate(images=False)
+    return status
+
+
+def container_run_detached(image_name: str, container_name: str, host_dir: str,
+                           cmd: list[str], container_dir: str = None,
+                           port: list[tuple] | tuple = (None, None),
+                           volumes: list[tuple[str, str]] = (), env: dict = None,
+                           adopt: bool = True) -> bool:
+    """ Start a container in the background, replacing one of the same name. """
+    if container_dir is None:
+        container_dir = host_dir.split("/")[-1]
+
+    if DockerWrapper.does_container_exist(container_name):
+        if DockerWrapper.is_container_running(container_name):
+            DockerWrapper.shutdown_container(container_name)
+        DockerWrapper.remove_container(container_name)
+
+    ports = publish(container_name, port)
+    ok = get_backend().run_detached(image_name, container_name, cmd,
+                                    volumes=[(host_dir, container_dir), *volumes],
+                                    workdir=container_dir, ports=ports, env=env)
+    if not ok and ports:
+        PortRegistry().release(container_name)
+    DockerWrapper.invalidate(images=False)
 
-    logger.debug(f"Running command: {' '.join(final_cmd)}")
-    subprocess.run(final_cmd)
+    if not ok and adopt and DockerWrapper.adopt_container(container_name) is not None:
+        # the name was taken by a container from before ownership labels,
+        # replace it like any other
+        return container_run_detached(image_name, container_name, host_dir, cmd,
+                                      container_dir, port, volumes, env, adopt=False)
+    return ok
 
 
 def cmd_new_container(image_name: str, container_name: str, host_dir: str,
                       cmd: list[str], container_dir: str = None, port: list[tuple] | tuple = (None, None),
-                      interactive: bool = True, post_removal: bool = True):
+                      interactive: bool = True, post_removal: bool = True,
+                      volumes: list[tuple[str, str]] = (), env: dict = None):
     # https://stackoverflow.com/questions/32353055/how-to-start-a-stopped-docker-container-with-a-different-command
     # https://www.thorsten-hans.com/how-to-run-commands-in-stopped-docker-containers/
 
@@ -51,7 +86,7 @@ def cmd_new_container(image_name: str, container_name: str, host_dir: str,
 
         DockerWrapper.remove_container(container_name)
 
-    container_run(
+    return container_run(
         image_name,
         container_name,
         host_dir,
@@ -59,32 +94,35 @@ def cmd_new_container(image_name: str, container_name: str, host_dir: str,
         container_dir,
         port,
         interactive,
-        post_removal)
+        post_removal,
+        volumes,
+        env)
 
 
 def exec_or_run(image_name: str, container_name: str, host_dir: str,
                 cmd: list[str], container_dir: str = None, port: list[tuple] | tuple = (None, None),
-                interactive: bool = True, post_removal: bool = True, rebuild: bool = False
+                interactive: bool = True, post_removal: bool = True, rebuild: bool = False,
+                volumes: list[tuple[str, str]] = (), env: dict = None
                 ):
     # If the container is already running, just execute the command in it
     if DockerWrapper.is_container_running(container_name):
         print(
             f"Container {container_name} already exists. Executing \"{cmd}\" in it.")
-        subprocess.run(["docker", "exec", "-it", container_name, *cmd])
+        for host_port, container_port in PortRegistry().leased(container_name):
+            print(f"Port {container_port} is published on host port {host_port}")
+        get_backend().exec(container_name, cmd, interactive=interactive)
     elif DockerWrapper.does_container_exist(container_name):
         # TODO: Restart with new command either by rebuilding from image or by using docker commit
         # This probably only works for containers that were originally started with a living process
         # such as python or bash.
         print(
             f"Container {container_name} already exists, but is not running. Starting it and executing \"{cmd}\"")
-        start_str = subprocess.run(
-            ["docker", "start", container_name], capture_output=True).stdout.decode()
-        if "Error" in start_str:
+        if not get_backend().start(container_name):
             print(
                 "Error starting container. Creating a new one and executing the command.")
             if rebuild:
                 print("Rebuilding container")
-                container_name = DockerWrapper.update_and_rebuild_container(
+                image_name = DockerWrapper.update_and_rebuild_container(
                     container_name)
                 container_run(
                     image_name,
@@ -94,7 +132,9 @@ def exec_or_run(image_name: str, container_name: str, host_dir: str,
                     container_dir,
                     port,
                     interactive,
-                    post_removal)
+                    post_removal,
+                    volumes,
+                    env)
             else:
                 cmd_new_container(
                     image_name,
@@ -104,21 +144,34 @@ def exec_or_run(image_name: str, container_name: str, host_dir: str,
                     container_dir,
                     port,
                     interactive,
-                    post_removal)
+                    post_removal,
+                    volumes,
+                    env)
         else:
             print("Started container")
-            subprocess.run(["docker", "exec", "-it", container_name, *cmd])
+            DockerWrapper.state().containers[container_name].state = "running"
+            get_backend().exec(container_name, cmd, interactive=interactive)
     else:
         print(
             f"Container {container_name} does not exist. Creating it and executing \"{cmd}\"")
-        cmd_new_container(
-            image_name,
-            container_name,
-            host_dir,
-            cmd,
-            container_dir,
-            port,
-            interactive,
-            post_removal)
+        try:
+            cmd_new_container(
+                image_name,
+                container_name,
+                host_dir,
+                cmd,
+                container_dir,
+                port,
+                interactive,
+                post_removal,
+                volumes,
+                env)
+        except NameInUse:
+            if DockerWrapper.adopt_container(container_name) is None:
+                raise
+            # the name is taken by a container from before ownership labels,
+            # which the scoped listing doesn't show: use that one
+            return exec_or_run(image_name, container_name, host_dir, cmd, container_dir,
+                               port, interactive, post_removal, rebuild, volumes, env)
 
     return container_name
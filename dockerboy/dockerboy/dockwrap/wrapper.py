@@ -1,16 +1,157 @@
-import subprocess
-import logging
-
-from typing import Literal
-
-from .utils.misc import image_to_container_name, update_version
-
-
-logger = logging.getLogger(__name__)
+import time
+
+from . import labels
+from .backends import get_backend, current_endpoint, ContainerInfo, ImageInfo
+from .utils.misc import image_to_container_name, split_ref
+from .lazylog import get_logger
+
+
+logger = get_logger(__name__)
+
+# first item of the state keys of endpoints other than the local daemon
+ENDPOINT_KEY = "endpoint"
+
+
+class ContainerIndex(dict):
+    """ Containers by name, also indexed by ID (full and 12-character short
+    form) and by image. Removing a container by name keeps the other
+    indexes in step.
+    """
+
+    def __init__(self, containers=()):
+        super().__init__()
+        self._by_id: dict[str, ContainerInfo] = {}
+        self._by_image: dict[str, dict[str, ContainerInfo]] = {}
+        for container in containers:
+            self[container.name] = container
+
+    def __setitem__(self, name: str, container: ContainerInfo):
+        if name in self:
+            self._unindex(self[name])
+        super().__setitem__(name, container)
+        self._by_id[container.id] = container
+        self._by_id[container.id[:12]] = container
+        self._by_image.setdefault(container.image, {})[name] = container
+
+    def _unindex(self, container: ContainerInfo):
+        for key in (container.id, container.id[:12]):
+            if self._by_id.get(key) is container:
+                del self._by_id[key]
+        self._by_image.get(container.image, {}).pop(container.name, None)
+
+    def __delitem__(self, name: str):
+        self._unindex(self[name])
+        super().__delitem__(name)
+
+    def pop(self, name: str, *default):
+        if name in self:
+            self._unindex(self[name])
+        return super().pop(name, *default)
+
+    def by_id(self, container_id: str) -> ContainerInfo | None:
+        container = self._by_id.get(container_id) or self._by_id.get(container_id[:12])
+        if container is not None and container.id.startswith(container_id):
+            return container
+        if len(container_id) < 12:
+            # a short prefix, rare enough to scan for
+            for container in self.values():
+                if container.id.startswith(container_id):
+                    return container
+        return None
+
+    def by_image(self, image: str) -> list[ContainerInfo]:
+        return list(self._by_image.get(image, {}).values())
+
+    def __reduce__(self):
+        # rebuild the indexes on unpickling instead of restoring them
+        return ContainerIndex, (list(self.values()),)
+
+
+class DockerState:
+    """ In-memory view of the daemon, filled by one structured container
+    listing and one image listing from the active backend. Each half is loaded
+    lazily so that a container-only invalidation doesn't cost an images
+    round-trip.
+
+    When a project is in scope (see `labels`), the daemon only returns that
+    project's containers and images, so lookups don't get slower with the
+    number of unrelated containers on the host.
+
+    `loaded_at` and `invalidated_at` record when each half was last listed
+    and dropped, which `dboy serve` uses to tell whether a snapshot kept
+    across commands is still current.
+    """
+
+    def __init__(self):
+        self._containers: ContainerIndex | None = None
+        self._images: list[ImageInfo] | None = None
+        self._image_refs: set[str] | None = None
+        self.loaded_at = {"containers": 0.0, "images": 0.0}
+        self.invalidated_at = {"containers": 0.0, "images": 0.0}
+
+    @property
+    def containers(self) -> ContainerIndex:
+        if self._containers is None:
+            self.loaded_at["containers"] = time.time()
+            self._containers = ContainerIndex(get_backend().ps(all=True))
+        return self._containers
+
+    @property
+    def images(self) -> list[ImageInfo]:
+        if self._images is None:
+            self.loaded_at["images"] = time.time()
+            self._images = get_backend().images()
+            self._image_refs = None
+        return self._images
+
+    @property
+    def image_refs(self) -> set[str]:
+        """ Every ID, repository and repository:tag known to the daemon. """
+        images = self.images
+        if self._image_refs is None:
+            self._image_refs = {ref for image in images for ref in image.refs}
+        return self._image_refs
+
+    def __repr__(self):
+        return f"DockerState(containers={self._containers}, images={self._images})"
+
+    def loaded(self, half: str) -> bool:
+        return getattr(self, f"_{half}") is not None
+
+    def invalidate(self, containers=True, images=True):
+        if containers:
+            self._containers = None
+            self.invalidated_at["containers"] = time.time()
+        if images:
+            self._images = None
+            self._image_refs = None
+            self.invalidated_at["images"] = time.time()
+
+    def merge(self, other: "DockerState", stale_since: dict[str, float]):
+        """ Keep the more recent listing of each half of `self` and `other`,
+        or neither if it was made before `stale_since[half]`.
+        """
+        for half in ("containers", "images"):
+            if other.loaded(half) and other.loaded_at[half] > self.loaded_at[half]:
+                setattr(self, f"_{half}", getattr(other, f"_{half}"))
+                self.loaded_at[half] = other.loaded_at[half]
+            if self.loaded_at[half] <= stale_since[half]:
+                setattr(self, f"_{half}", None)
+        self._image_refs = None
+
+    def find_container(self, name_or_id: str) -> ContainerInfo | None:
+        if name_or_id in self.containers:
+            return self.containers[name_or_id]
+        return self.containers.by_id(name_or_id)
 
 
 # container management
 class DockerWrapper:
+    # snapshots of daemon state per label scope, see `state()`
+    _states: dict[tuple, DockerState] = {}
+    # snapshots deeper than this many layers are squashed, 0 never does
+    squash_depth: int = 0
+
     # get statics from class without instantiating
     @staticmethod
     def get_commands():
@@ -23,8 +164,11 @@ class DockerWrapper:
         method_cmds = {}
         for method in dir(DockerWrapper):
             m = getattr(DockerWrapper, method)
-            if callable(m) and not (method.startswith("__")
-                                    or method == "get_commands" or method == "run_method"):
+            # the snapshot's plumbing, not commands
+            if callable(m) and not (method.startswith("_")
+                                    or method in ("get_commands", "run_method", "state",
+                                                  "invalidate", "adopt_container",
+                                                  "adopt_image")):
                 method_cmds[method] = m.__doc__.strip()
 
         return method_cmds
@@ -34,101 +178,194 @@ class DockerWrapper:
         method = getattr(DockerWrapper, method_name)
         return method(*args, **kwargs)
 
+    @staticmethod
+    def state() -> DockerState:
+        """ The snapshot of the current label scope and endpoint. """
+        key = labels.key()
+        endpoint = current_endpoint()
+        if endpoint is not None:
+            # every daemon has containers and images of its own
+            key = ((ENDPOINT_KEY, endpoint), *key)
+        state = DockerWrapper._states.get(key)
+        if state is None:
+            state = DockerWrapper._states[key] = DockerState()
+        return state
+
+    @staticmethod
+    def invalidate(containers: bool = True, images: bool = True):
+        """ Drop the snapshot's containers and/or images, so they are listed
+        again on next use.
+        """
+        DockerWrapper.state().invalidate(containers, images)
+
+    # objects from before ownership labels
+
+    @staticmethod
+    def adopt_container(container_name: str) -> ContainerInfo | None:
+        """ A container named `container_name` that a scoped lookup missed
+        because it predates the ownership labels (see `labels`). It is
+        added to the snapshot so that this command can use it. Only asked
+        once a lookup has failed, it costs an unscoped listing.
+        """
+        if not labels.current():
+            return None
+        with labels.unscoped():
+            found = next((c for c in get_backend().ps(all=True) if c.name == container_name), None)
+        if found is None:
+            return None
+
+        owner = found.labels.get(labels.PROJECT)
+        if owner is not None:
+            if owner != labels.current()[labels.PROJECT]:
+                logger.warning(f"Container {container_name} belongs to the project in {owner}")
+            return None
+        logger.warning(f"Container {container_name} was created before dboy labelled its "
+                       f"containers, using it anyway. Remove it (`dboy rm`) to have it "
+                       f"recreated with labels")
+        DockerWrapper.state().containers[container_name] = found
+        return found
+
+    @staticmethod
+    def adopt_image(image_name: str) -> bool:
+        """ The image counterpart of `adopt_container`: True if `image_name`
+        exists without ownership labels. `dboy b --force` rebuilds it with them.
+        """
+        if not labels.current():
+            return False
+        image = get_backend().inspect_image(image_name)
+        if image is None:
+            return False
+
+        owner = ((image.get("Config") or {}).get("Labels") or {}).get(labels.PROJECT)
+        if owner is not None:
+            if owner != labels.current()[labels.PROJECT]:
+                logger.warning(f"Image {image_name} belongs to the project in {owner}")
+            return False
+        logger.warning(f"Image {image_name} was built before dboy labelled its images, "
+                       f"using it anyway. `dboy b --force` rebuilds it with labels")
+        repository, tag = split_ref(image_name)
+        state = DockerWrapper.state()
+        state.images.append(ImageInfo(image["Id"].split(":")[-1][:12], repository, tag or "latest"))
+        state._image_refs = None
+        return True
+
     @staticmethod
     def shutdown_container(container_name: str):
         """sd"""
-        subprocess.run(["docker", "stop", container_name])
+        get_backend().stop(container_name)
+
+        container = DockerWrapper.state().find_container(container_name)
+        if container is not None:
+            container.state = "exited"
 
     @staticmethod
     def remove_container(container_name: str):
         """rc"""
-        subprocess.run(
-            ["docker", "rm", DockerWrapper.get_container_id(container_name)])
+        container = DockerWrapper.state().find_container(container_name) or \
+            DockerWrapper.adopt_container(container_name)
+        if container is None:
+            logger.warning(f"Container {container_name} does not exist")
+            return
+
+        from .ports import PortRegistry
+
+        get_backend().rm(container.id)
+        DockerWrapper.state().containers.pop(container.name, None)
+        PortRegistry().release(container.name)
 
     @staticmethod
     def remove_image(image_name: str):
         """ri"""
-        subprocess.run(["docker", "rmi", image_name])
+        get_backend().rmi(image_name)
+        DockerWrapper.invalidate(containers=False)
 
     # container state
 
     @staticmethod
     def get_running_containers() -> list[str]:
         """grc"""
-        return subprocess.run(["docker", "ps"],
-                              capture_output=True).stdout.decode().split()[1::]
+        return [name for name, c in DockerWrapper.state().containers.items()
+                if c.running]
 
     @staticmethod
     def get_all_containers() -> list[str]:
         """gac"""
-        return subprocess.run(["docker", "ps", "-a"],
-                              capture_output=True).stdout.decode().split()[1::]
+        return list(DockerWrapper.state().containers)
+
+    @staticmethod
+    def get_containers_of_image(image_name: str) -> list[str]:
+        """gcoi"""
+        return [c.name for c in DockerWrapper.state().containers.by_image(image_name)]
 
     @staticmethod
     def is_container_running(container_name: str):
         """icr"""
-        return container_name in DockerWrapper.get_running_containers()
+        container = DockerWrapper.state().containers.get(container_name)
+        return container is not None and container.running
 
     @staticmethod
     def does_container_exist(container_name: str):
         """dce"""
-        return container_name in DockerWrapper.get_all_containers()
+        return container_name in DockerWrapper.state().containers
 
+    @staticmethod
     def get_container_name_from_id(container_id: str):
         """gcnfi"""
-        return subprocess.run(["docker", "ps", "-a", "--filter", f"id={container_id}", "--format", "{{.Names}}"],
-                              capture_output=True).stdout.decode().strip()
+        container = DockerWrapper.state().find_container(container_id)
+        return container.name if container is not None else ""
 
+    @staticmethod
     def is_image_ready(image_name: str):
         """iir"""
-        images = subprocess.run(
-            ["docker", "images", "-a"], capture_output=True).stdout.decode().split()
-        if images.count(image_name) >= 1:
-            return True
-        else:
-            return False
+        return image_name in DockerWrapper.state().image_refs
+
+    @staticmethod
+    def get_image_id(image_name: str):
+        """gii"""
+        for image in DockerWrapper.state().images:
+            if image_name in image.refs:
+                return image.id
+        return ""
 
     @staticmethod
     def get_container_id(container_name: str):
         """gci"""
-        # TODO: presumes only one container with the same name exists
-        ids = subprocess.run(["docker", "ps", "-a", "--filter", f"name={container_name}", "--format", "{{.ID}}"],
-                             capture_output=True).stdout.decode().strip()
-        # check if there are multiple ids separated by a newline
-        if "\n" in ids:
-            ids = ids.split("\n")
-            logger.warning(
-                f"Multiple containers matching {container_name} exist: {ids}")
-            return ids[0]
-        else:
-            return ids
+        container = DockerWrapper.state().containers.get(container_name)
+        return container.id if container is not None else ""
 
     @staticmethod
     def get_container_ps_format(
-            container_name: str, format_type: Literal["ID", "Image", "Command", "Created", "Status", "Ports", "Names"]):
+            container_name: str, format_type: str):
         """gcf"""
-        return subprocess.run(["docker", "ps", "-a", "--filter", f"name={container_name}", "--format", f"{{.{format_type}}}"],
-                              capture_output=True).stdout.decode().strip()
+        # format_type: one of ID, Image, Command, Created, Status, Ports, Names
+        container = DockerWrapper.state().containers.get(container_name)
+        if container is None:
+            return ""
+
+        if format_type == "Names":
+            return container.name
+        return getattr(container, format_type.lower())
 
     @staticmethod
     def commit_stopped_container(container_name: str):
         """csc"""
-        # TODO: presumes only one container with the same name exists
-        container_id = DockerWrapper.get_container_id(container_name)
-        if not isinstance(container_id, str):
-            raise ValueError(
-                f"Multiple containers matching {container_name} exist: {container_id}")
+        from .lineage import snapshot
 
-        # Update the container_name by appending a version number
-        container_name = update_version(container_name)
+        container = DockerWrapper.state().containers.get(container_name)
+        if container is None:
+            raise ValueError(f"Container {container_name} does not exist")
 
-        subprocess.run(["docker", "commit", container_id, container_name])
+        # committed as the next version of its image, see `lineage`
+        ref = snapshot(container, DockerWrapper.squash_depth)
+        DockerWrapper.invalidate(containers=False)
 
-        return container_name
+        return ref
 
     @staticmethod
     def update_and_rebuild_container(container_name: str):
         """uarc"""
+        # Snapshots the container as a new image version and removes it,
+        # returning the new image. The container name stays the same.
         # Does the container exist?
         if not DockerWrapper.does_container_exist(container_name):
             raise ValueError(f"Container {container_name} does not exist")
@@ -138,22 +375,25 @@ class DockerWrapper:
             DockerWrapper.shutdown_container(container_name)
 
         # First, commit the container
-        new_container_name = DockerWrapper.commit_stopped_container(
-            container_name)
+        image_name = DockerWrapper.commit_stopped_container(container_name)
 
         # Then, remove the old container
         DockerWrapper.remove_container(container_name)
 
-        return new_container_name
+        return image_name
 
     @staticmethod
     def get_built_images(container_name: str):
         """gbi"""
         image_name = image_to_container_name(container_name)
-        return subprocess.run(["docker", "images", "--filter", f"reference={image_name}", "--format", "{{.Repository}}"],
-                              capture_output=True).stdout.decode().strip()
+        return "\n".join(image.repository for image in DockerWrapper.state().images
+                         if image_name in (image.repository, f"{image.repository}:{image.tag}"))
 
     @staticmethod
     def kill_container(container_name: str):
         """kc"""
-        subprocess.run(["docker", "kill", container_name])
+        get_backend().kill(container_name)
+
+        container = DockerWrapper.state().find_container(container_name)
+        if container is not None:
+            container.state = "exited"
@@ -0,0 +1,544 @@
+""" `dboy serve`: a resident process the `dboy` CLI hands its commands to.
+
+The daemon listens on a unix socket. A `dboy` invocation that finds it sends
+its arguments, working directory and environment along with its own stdin,
+stdout and stderr file descriptors, and the daemon forks a child that runs
+the command on them, so output, exit codes, Ctrl-C and interactive terminals
+behave as if `dboy` had run the command itself. When there is no daemon,
+`dboy` runs the command directly.
+
+Each child starts from what the daemon keeps warm: the imported modules,
+the chosen backend, parsed configs (reloaded when the file changes) and the
+container and image listings of every project (`DockerWrapper._states`).
+Children report their listings back when they finish, and a `docker events`
+stream drops the ones that something changed since, so a command only asks
+the daemon for what it can't know is still current.
+
+The socket lives in a directory only its user can enter
+(`$XDG_RUNTIME_DIR/dockerboy/` or `/tmp/dockerboy-<uid>/`), and both sides
+check that the socket file and the process at the other end belong to the
+same user before sending or accepting anything: the client hands over its
+environment and terminal, the daemon runs whatever it is sent.
+
+Only this module's client half (`forward`) is imported by every `dboy`
+invocation, and most of those find no socket: everything but `os` and `sys`
+is imported where it's used.
+"""
+import sys
+import os
+
+
+SOCKET_ENV = "DBOY_SOCKET"
+# container event actions that change what `docker ps -a` shows
+CONTAINER_CHANGES = {"create", "start", "restart", "die", "kill", "stop", "pause",
+                     "unpause", "rename", "update", "destroy", "oom"}
+# listings from before the event stream is this old may have missed events
+WATCH_GRACE = 1.0
+
+
+def socket_path() -> str:
+    return os.environ.get(SOCKET_ENV) or default_socket_path()
+
+
+def default_socket_path() -> str:
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "dockerboy", "dboy.sock")
+    return f"/tmp/dockerboy-{os.getuid()}/dboy.sock"
+
+
+def private_dir(path: str):
+    """ Create `path` for the socket, or make sure an existing one is a real
+    directory of ours that nobody else can enter.
+    """
+    import stat
+
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(f"{path} is not a directory owned by uid {os.getuid()}")
+    if st.st_mode & 0o077:
+        os.chmod(path, 0o700)
+
+
+def _peer_uid(sock: "socket.socket") -> int | None:
+    """ The uid of the process at the other end, None where the platform
+    can't tell.
+    """
+    import socket
+    import struct
+
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def _owned_socket(path: str) -> bool:
+    import stat
+
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        print(f"dboy: ignoring {path}, it is not a socket owned by uid {os.getuid()}",
+              file=sys.stderr)
+        return False
+    return True
+
+
+def _connect(path: str) -> "socket.socket | None":
+    """ Connect to the daemon at `path` if it is our own user's. """
+    import socket
+
+    if not _owned_socket(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        peer = _peer_uid(sock)
+    except OSError:
+        sock.close()
+        return None
+    if peer != os.getuid():
+        print(f"dboy: ignoring {path}, the process listening on it runs as uid {peer}",
+              file=sys.stderr)
+        sock.close()
+        return None
+    return sock
+
+
+def _send(sock: "socket.socket", message: dict, fds: list[int] = ()):
+    import socket
+    import json
+
+    data = json.dumps(message).encode() + b"\n"
+    if fds:
+        socket.send_fds(sock, [data], list(fds))
+    else:
+        sock.sendall(data)
+
+
+def forward(argv: list[str]) -> int | None:
+    """ Run a command in the daemon and return its exit status, or None if
+    no daemon is listening.
+    """
+    path = socket_path()
+    if not os.path.lexists(path):
+        return None
+    sock = _connect(path)
+    if sock is None:
+        return None
+
+    import signal
+    import json
+
+    try:
+        _send(sock, {"op": "run", "argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)},
+              [0, 1, 2])
+        replies = sock.makefile("rb")
+        hello = replies.readline()
+    except OSError:
+        return None
+    if not hello:
+        # shutting down, or couldn't fork
+        return None
+
+    # the terminal signals our process group, pass it on to the command's
+    pid = json.loads(hello)["pid"]
+
+    def relay(signum, frame):
+        try:
+            os.killpg(pid, signum)
+        except ProcessLookupError:
+            pass
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT):
+        signal.signal(signum, relay)
+
+    result = replies.readline()
+    if not result:
+        print(f"dboy: the daemon's process for this command (pid {pid}) died",
+              file=sys.stderr)
+        return 1
+    return json.loads(result)["exit"]
+
+
+def request(op: str) -> dict | None:
+    """ Send a control request ("status" or "stop"), None if no daemon is listening. """
+    import json
+
+    sock = _connect(socket_path())
+    if sock is None:
+        return None
+    with sock:
+        _send(sock, {"op": op})
+        reply = sock.makefile("rb").readline()
+    return json.loads(reply) if reply else None
+
+
+def _exit_status(code) -> int:
+    """ What the interpreter would exit with for `sys.exit(code)`. """
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+class Daemon:
+    """ Accepts commands on `path` and runs each in a forked child.
+
+    The main thread only accepts connections, forks and merges what the
+    children report back; a watcher thread follows the daemon's events.
+    """
+
+    def __init__(self, path: str = None):
+        import threading
+
+        self.path = os.path.abspath(path or socket_path())
+        self.lock = threading.Lock()
+        self.running = False
+        self.watching = False
+        # listings made before this may have missed events
+        self.trusted_from = float("inf")
+        # (scope key or None for every scope, half) -> time of the last change
+        self.changed: dict[tuple, float] = {}
+        # report pipe -> child pid
+        self.children: dict[int, int] = {}
+        self.pids: set[int] = set()
+        self.started = 0.0
+        self.served = 0
+
+    # lifecycle
+    def serve(self):
+        import selectors
+        import threading
+        import socket
+        import signal
+        import time
+
+        self._warm_imports()
+        if self.path == default_socket_path():
+            private_dir(os.path.dirname(self.path))
+        if os.path.lexists(self.path):
+            if _connect(self.path) is not None:
+                raise RuntimeError(f"A dboy daemon is already listening on {self.path}")
+            os.unlink(self.path)
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # no window in which the socket is open to others
+        umask = os.umask(0o077)
+        try:
+            self.listener.bind(self.path)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0o600)
+        self.listener.listen(64)
+        self.started = time.time()
+        self.running = True
+
+        threading.Thread(target=self._watch, name="dboy-events", daemon=True).start()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_stop)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        print(f"dboy serve: listening on {self.path}", flush=True)
+        try:
+            while self.running:
+                ready = self.selector.select(timeout=1.0)
+                # children's reports before new commands, so a command never
+                # starts from a listing the previous one already knew was stale
+                for key, _ in sorted(ready, key=lambda item: item[0].fileobj is self.listener):
+                    if key.fileobj is self.listener:
+                        self._accept()
+                    else:
+                        self._read_report(key.fileobj)
+                self._reap()
+        finally:
+            self.selector.close()
+            self.listener.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def _on_stop(self, signum, frame):
+        self.running = False
+
+    @staticmethod
+    def _warm_imports():
+        """ Everything the command handlers import lazily. """
+        import importlib
+
+        for module in ("yaml", "dockerboy.utils.config", "dockerboy.dockwrap.mydocker",
+                       "dockerboy.dockwrap.wrapper", "dockerboy.dockwrap.utils.run",
+                       "dockerboy.dockwrap.utils.build", "dockerboy.dockwrap.utils.context",
+                       "dockerboy.dockwrap.utils.manifest", "dockerboy.dockwrap.commands",
+                       "dockerboy.dockwrap.pool", "dockerboy.dockwrap.sweep",
+                       "dockerboy.dockwrap.logs", "dockerboy.dockwrap.stats",
+                       "dockerboy.dockwrap.datasets", "dockerboy.dockwrap.lineage",
+                       "dockerboy.dockwrap.trace"):
+            importlib.import_module(module)
+
+        from .dockwrap.backends import get_backend
+        if get_backend().name == "engine":
+            importlib.import_module("dockerboy.dockwrap.backends.engine")
+
+    # state
+    def _stale_since(self, key: tuple) -> dict[str, float]:
+        return {"containers": max(self.trusted_from, self.changed.get((key, "containers"), 0.0)),
+                "images": max(self.trusted_from, self.changed.get((key, "images"), 0.0),
+                              self.changed.get((None, "images"), 0.0))}
+
+    def _forget(self, key: tuple | None, half: str, when: float):
+        """ Mark `half` of scope `key` (None: every scope) changed at `when`. """
+        from .dockwrap.wrapper import DockerWrapper
+
+        self.changed[(key, half)] = max(when, self.changed.get((key, half), 0.0))
+        for scope, state in DockerWrapper._states.items():
+            if key is None or scope == key:
+                state.invalidate(containers=half == "containers", images=half == "images")
+
+    def _merge(self, reported: dict):
+        from .dockwrap.wrapper import DockerWrapper, DockerState, ENDPOINT_KEY
+
+        with self.lock:
+            for key, theirs in reported.items():
+                if key[:1] and key[0][0] == ENDPOINT_KEY:
+                    # only the local daemon's events are watched
+                    continue
+                for half, when in theirs.invalidated_at.items():
+                    self.changed[(key, half)] = max(when, self.changed.get((key, half), 0.0))
+                ours = DockerWrapper._states.setdefault(key, DockerState())
+                ours.merge(theirs, self._stale_since(key))
+
+    def _on_event(self, event: dict):
+        import time
+
+        from .dockwrap import labels
+
+        now = time.time()
+        attributes = event.get("Actor", {}).get("Attributes", {})
+        with self.lock:
+            if event.get("Type") == "image":
+                self._forget(None, "images", now)
+            elif event.get("Action", "").split(":")[0] in CONTAINER_CHANGES:
+                # unscoped listings (`dboy cm`) see every container
+                self._forget((), "containers", now)
+                if labels.PROJECT in attributes and labels.SPEC in attributes:
+                    self._forget(((labels.PROJECT, attributes[labels.PROJECT]),
+                                  (labels.SPEC, attributes[labels.SPEC])), "containers", now)
+
+    def _watch(self):
+        import time
+
+        from .dockwrap.backends import get_backend
+        from .dockwrap.lazylog import get_logger
+        from .dockwrap.wrapper import DockerWrapper
+
+        logger = get_logger(__name__)
+        while self.running:
+            with self.lock:
+                DockerWrapper._states.clear()
+                self.trusted_from = time.time() + WATCH_GRACE
+                self.watching = True
+            try:
+                status = get_backend().events(self._on_event)
+                logger.warning(f"docker events ended ({status}), reconnecting")
+            except Exception as e:
+                logger.warning(f"docker events failed: {e}")
+            with self.lock:
+                self.watching = False
+                self.trusted_from = float("inf")
+                DockerWrapper._states.clear()
+            time.sleep(1.0)
+
+    # requests
+    def _accept(self):
+        import socket
+        import json
+
+        conn, _ = self.listener.accept()
+        if _peer_uid(conn) != os.getuid():
+            # other users don't get to run commands as us
+            conn.close()
+            return
+        conn.settimeout(5.0)
+        fds = []
+        try:
+            data, fds, _, _ = socket.recv_fds(conn, 1 << 16, 3)
+            while not data.endswith(b"\n"):
+                more = conn.recv(1 << 16)
+                if not more:
+                    raise ConnectionError("client went away")
+                data += more
+            message = json.loads(data)
+        except (OSError, ValueError):
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+            return
+
+        if message.get("op") == "status":
+            _send(conn, self.status())
+        elif message.get("op") == "stop":
+            self.running = False
+            _send(conn, {"stopping": True})
+        elif message.get("op") == "run" and len(fds) == 3:
+            self._fork(conn, fds, message)
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+
+    def _fork(self, conn: "socket.socket", fds: list[int], message: dict):
+        import selectors
+
+        self._warm_config(message)
+        report_r, report_w = os.pipe()
+        # not while the watcher is halfway through an update
+        with self.lock:
+            pid = os.fork()
+        if pid == 0:
+            os.close(report_r)
+            self._child(conn, fds, message, report_w)
+        os.close(report_w)
+        self.children[report_r] = pid
+        self.pids.add(pid)
+        self.selector.register(report_r, selectors.EVENT_READ)
+        self.served += 1
+
+    def _warm_config(self, message: dict):
+        """ Parse the command's config here, so its child and later commands
+        start with it loaded.
+        """
+        from .utils.config import load_config
+
+        argv, cfg_file = message["argv"], ".dboy.yaml"
+        for i, value in enumerate(argv):
+            if value in ("-c", "--config") and i + 1 < len(argv):
+                cfg_file = argv[i + 1]
+            elif value.startswith("--config="):
+                cfg_file = value.partition("=")[2]
+        try:
+            os.chdir(message["cwd"])
+            if os.path.exists(cfg_file):
+                load_config(cfg_file)
+        except Exception:
+            # the command reports it
+            pass
+
+    def _read_report(self, fd: int):
+        """ A child writes its report and closes the pipe just before it
+        answers the client, so once there is something to read the rest
+        follows right away.
+        """
+        import pickle
+
+        data = bytearray()
+        while True:
+            chunk = os.read(fd, 1 << 16)
+            if not chunk:
+                break
+            data.extend(chunk)
+        self.selector.unregister(fd)
+        os.close(fd)
+        del self.children[fd]
+        if data:
+            try:
+                self._merge(pickle.loads(data))
+            except Exception:
+                pass
+
+    def _reap(self):
+        # only our commands, the backend waits for its own processes
+        for pid in list(self.pids):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                self.pids.discard(pid)
+
+    def _child(self, conn: "socket.socket", fds: list[int], message: dict, report: int):
+        """ Runs in the forked child and never returns. """
+        import signal
+        import pickle
+
+        status = 1
+        fds = list(fds)
+        try:
+            os.setpgid(0, 0)
+            self.listener.close()
+            for fd in self.children:
+                os.close(fd)
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+                os.close(fd)
+            # buffered like a fresh process on these descriptors would be
+            sys.stdout.reconfigure(line_buffering=os.isatty(1))
+            sys.stderr.reconfigure(line_buffering=True)
+            for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT):
+                signal.signal(signum, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+
+            os.chdir(message["cwd"])
+            self._adopt_env(message["env"])
+            _send(conn, {"pid": os.getpid()})
+
+            from .__main__ import main
+            try:
+                status = _exit_status(main(message["argv"], forward=False))
+            except SystemExit as e:
+                status = _exit_status(e.code)
+            except KeyboardInterrupt:
+                status = 130
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            except OSError:
+                pass
+            try:
+                from .dockwrap.wrapper import DockerWrapper
+                with os.fdopen(report, "wb") as f:
+                    pickle.dump(DockerWrapper._states, f)
+                _send(conn, {"exit": status})
+            except BaseException:
+                pass
+            os._exit(status)
+
+    def _adopt_env(self, env: dict):
+        from .dockwrap.backends import set_backend
+        from .dockwrap.wrapper import DockerWrapper
+
+        backend_env = ("DBOY_BACKEND", "DOCKER_HOST", "PATH")
+        if any(os.environ.get(name) != env.get(name) for name in backend_env):
+            # another daemon (or docker binary) than the one we watch
+            set_backend(None)
+            DockerWrapper._states.clear()
+        elif not self.watching:
+            DockerWrapper._states.clear()
+        os.environ.clear()
+        os.environ.update(env)
+
+    def status(self) -> dict:
+        import time
+
+        from .dockwrap.backends import get_backend
+        from .dockwrap.wrapper import DockerWrapper
+
+        with self.lock:
+            scopes = [{"project": dict(key).get("dockerboy.project", "*"),
+                       "spec": dict(key).get("dockerboy.spec", "*"),
+                       "cached": [half for half in ("containers", "images")
+                                  if state.loaded(half)]}
+                      for key, state in DockerWrapper._states.items()]
+        return {"pid": os.getpid(), "socket": self.path, "backend": get_backend().name,
+                "uptime": round(time.time() - self.started, 1), "served": self.served,
+                "running": len(self.children), "watching": self.watching, "scopes": scopes}
@@ -3,6 +3,8 @@ import yaml
 from os.path import join
 
 from ..dockwrap.mydocker import MyContainerSpec
+from ..dockwrap.sweep import expand_grid
+from ..dockwrap.datasets import DEFAULT_CACHE
 from ..dockwrap.utils.misc import format_ports
 
 
@@ -15,22 +17,129 @@ def default_config():
         "ports": [(6006, 6006)],
         "interactive": True,
         "post_removal": True,
-        "rebuild": True
+        "rebuild": True,
+        # kept out of the build context on top of .dockerignore and host_dir
+        "context_excludes": [],
+        "context_warn_mb": 500,
+        # warm container pool for `dboy r`, see `dboy pool -h`
+        "pool_size": 0,
+        "pool_max": 4,
+        "pool_idle_timeout": 1800,
+        # log rotation for detached runs (`dboy r -d`)
+        "log_max_mb": 50,
+        "log_backups": 5,
+        # prepared datasets, see `dboy data -h`
+        "data_cache": DEFAULT_CACHE,
+        "mount_data": True,
+        # ownership label value, defaults to the directory of the config
+        "project": None,
+        # snapshot versions, see `dboy gc -h`
+        "squash_depth": 0,
+        "keep_versions": 3,
+        # host ports taken when a requested one is in use, see `dboy r`
+        "port_range": (6006, 6106),
+        # more images built with `dboy b`, e.g.
+        # [{image_name: gpu, dockerfile_path: docker/gpu/}], built as a DAG
+        # of their FROM lines, build_jobs at a time
+        "images": [],
+        "build_jobs": 2,
+        # docker daemons (DOCKER_HOST URLs or contexts) new containers are
+        # placed on, the least loaded first; empty is just the local one
+        "endpoints": [],
+        # where `dboy image export` archives images (default:
+        # ~/.cache/dockerboy/images or DBOY_IMAGE_ARCHIVE), see `dboy image -h`
+        "image_archive": None
     }
 
 
+def spec_from_config(config: dict) -> MyContainerSpec:
+    """ Turn a config dict (as written by `dboy cfg`) into a MyContainerSpec. """
+    config = {**default_config(), **config}
+    return MyContainerSpec(
+        name=config["image_name"],
+        dockerfile=config["dockerfile_path"],
+        host_dir=config["host_dir"],
+        ports=config["ports"],
+        interactive=config["interactive"],
+        post_removal=config["post_removal"],
+        rebuild=config["rebuild"],
+        context_excludes=config["context_excludes"],
+        context_warn_mb=config["context_warn_mb"],
+        pool_size=config["pool_size"],
+        pool_max=config["pool_max"],
+        pool_idle_timeout=config["pool_idle_timeout"],
+        log_max_mb=config["log_max_mb"],
+        log_backups=config["log_backups"],
+        data_cache=config["data_cache"],
+        mount_data=config["mount_data"],
+        project=config["project"],
+        squash_depth=config["squash_depth"],
+        keep_versions=config["keep_versions"],
+        port_range=config["port_range"],
+        images=config["images"],
+        build_jobs=config["build_jobs"],
+        endpoints=config["endpoints"],
+        image_archive=config["image_archive"])
+
+
+# (path, mtime, cwd) -> spec: `dboy serve` loads each config once and its
+# commands reuse it until the file changes
+_loaded: dict[tuple, MyContainerSpec] = {}
+
+
 def load_config(cfg_file):
+    try:
+        # the defaults depend on the working directory
+        key = (os.path.abspath(cfg_file), os.stat(cfg_file).st_mtime_ns, os.getcwd())
+    except FileNotFoundError:
+        key = None
+    if key in _loaded:
+        return _loaded[key]
+
     try:
         with open(cfg_file, "r") as f:
             # TODO: Safe load config file
             config = yaml.unsafe_load(f)
     except FileNotFoundError:
         print(f"Config file {cfg_file} not found, using default config")
-        config = MyContainerSpec(**default_config())
+        config = default_config()
 
+    if isinstance(config, dict):
+        config = spec_from_config(config)
+    if getattr(config, "project", None) is None:
+        config.project = os.path.dirname(os.path.abspath(cfg_file))
+
+    if key is not None:
+        _loaded[key] = config
     return config
 
 
+def load_sweep(sweep_file):
+    """ A sweep file is either a parameter grid (a mapping of lists) or a job
+    list (parameter mappings or full commands).
+    """
+    with open(sweep_file, "r") as f:
+        sweep = yaml.safe_load(f)
+
+    if isinstance(sweep, dict):
+        return expand_grid(sweep)
+    return sweep
+
+
+def load_batch(batch_file):
+    """ A batch file is a job list, or a mapping with the list under `jobs`
+    and defaults for `containers`, `per_container` and `retries`. Returns the
+    jobs and the defaults.
+    """
+    with open(batch_file, "r") as f:
+        batch = yaml.safe_load(f) or []
+
+    if isinstance(batch, dict):
+        settings = {k: v for k, v in batch.items() if k != "jobs"}
+        return batch.get("jobs") or [], settings
+    return batch, {}
+
+
 def save_config(config, cfg_file):
     # if file exists back it up
     if os.path.exists(cfg_file):
@@ -0,0 +1,75 @@
+import tempfile
+import struct
+import sys
+import os
+
+import pytest
+
+# bench/regress.py imports fake_docker as a top-level module
+BENCH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench")
+sys.path.insert(0, BENCH_DIR)
+
+from dockerboy.dockwrap import labels
+from dockerboy.dockwrap.backends import set_backend
+from dockerboy.dockwrap.backends.engine import EngineBackend
+from dockerboy.dockwrap.backends.fake import FakeEngine
+from dockerboy.dockwrap.wrapper import DockerWrapper
+from dockerboy.dockwrap.utils.tfevents import read_records, summary_values, iter_fields
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """ A scratch project directory as the cwd, so `.dboy/` state and leased
+    ports stay out of the user's.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DBOY_PORT_REGISTRY", str(tmp_path / "ports.json"))
+    return tmp_path
+
+
+@pytest.fixture
+def socket_dir():
+    # unix socket paths are limited to ~108 bytes, pytest's tmp_path can be longer
+    with tempfile.TemporaryDirectory(prefix="dboy-") as path:
+        yield path
+
+
+@pytest.fixture
+def engine(socket_dir):
+    with FakeEngine(os.path.join(socket_dir, "docker.sock")) as engine:
+        yield engine
+
+
+@pytest.fixture
+def backend(engine, project):
+    """ An EngineBackend on the fake engine, used by everything in the test. """
+    backend = EngineBackend(engine.socket_path)
+    set_backend(backend)
+    yield backend
+    set_backend(None)
+    DockerWrapper._states.clear()
+    labels.unscope()
+    backend.pool.close()
+
+
+def add_container(engine: FakeEngine, name: str, image: str, running: bool = True,
+                  labels: dict = None, cmd: list[str] = None, id: str = None) -> dict:
+    """ Put a container straight into the fake engine's state. """
+    container = {"Id": id or f"{len(engine.containers):04d}{name}".ljust(64, "0"),
+                 "Name": name, "Image": image, "Cmd": cmd or ["sleep", "infinity"],
+                 "Labels": labels or {}, "Created": 0,
+                 "State": "running" if running else "exited", "ExitCode": 0, "Output": b""}
+    engine.containers[container["Id"]] = container
+    return container
+
+
+def read_scalars(path: str) -> dict[str, list[tuple[int, float]]]:
+    """ {tag: [(step, value)]} of the simple_value scalars in an event file. """
+    scalars = {}
+    for record in read_records(path):
+        event = summary_values(record)
+        for value in event[2] if event else ():
+            fields = {number: field for number, _, field in iter_fields(value)}
+            scalars.setdefault(fields[1].decode(), []).append(
+                (event[1], struct.unpack("<f", fields[2])[0]))
+    return scalars
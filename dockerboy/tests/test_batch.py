@@ -0,0 +1,92 @@
+""" Batch jobs exec'd into warm pool containers: retries and requeueing. """
+import json
+
+import pytest
+
+from dockerboy.dockwrap.batch import make_batch_jobs, run_batch, summary_table
+from dockerboy.dockwrap.pool import WarmPool
+
+
+@pytest.fixture
+def pool(backend, engine, project):
+    engine.add_image("img")
+    return WarmPool("c", "img", str(project), "/app", size=1, max_size=3, idle_timeout=60)
+
+
+def handler(outcomes: dict):
+    """ An exec handler answering each job's runs in turn: an exit code, or a
+    callable run first and returning one.
+    """
+    def handle(cmd):
+        outcome = outcomes[cmd[-1]].pop(0)
+        code = outcome() if callable(outcome) else outcome
+        return f"{cmd[-1]} exited {code}\n".encode(), code
+    return handle
+
+
+def kill_all(engine) -> list[str]:
+    """ Stop every container, as if the host ran out of memory. """
+    killed = []
+    for container in engine.containers.values():
+        container["State"] = "exited"
+        killed.append(container["Id"])
+    return killed
+
+
+def test_make_batch_jobs():
+    jobs = make_batch_jobs(["python a.py", {"cmd": ["python", "b.py", 2], "name": "b",
+                                            "env": {"N": 2}, "retries": 3}])
+    assert [(job.name, job.cmd) for job in jobs] == [("job-0", ["python", "a.py"]),
+                                                     ("b", ["python", "b.py", "2"])]
+    assert (jobs[1].env, jobs[1].retries) == ({"N": "2"}, 3)
+
+    with pytest.raises(ValueError):
+        make_batch_jobs([{"name": "x"}])
+    with pytest.raises(ValueError):
+        make_batch_jobs([{"cmd": "a", "name": "x"}, {"cmd": "b", "name": "x"}])
+
+
+def test_retries(pool, engine, project):
+    engine.exec_handler = handler({"ok": [0], "flaky": [1, 0], "broken": [2, 2]})
+    jobs = make_batch_jobs([["run", "ok"], ["run", "flaky"], ["run", "broken"]])
+    results = project / "results.jsonl"
+    run_batch(pool, jobs, retries=1, results=str(results))
+
+    assert [(job.attempts, job.returncode) for job in jobs] == [(1, 0), (2, 0), (2, 2)]
+    lines = [json.loads(line) for line in results.read_text().splitlines()]
+    # one line per job, once it's final
+    assert sorted(line["name"] for line in lines) == ["job-0", "job-1", "job-2"]
+    assert next(line for line in lines if line["name"] == "job-2")["tail"] == \
+        ["broken exited 2"]
+
+    table = summary_table(jobs).splitlines()
+    assert table[0].split() == ["job", "container", "attempts", "exit", "time"]
+    assert "2/3 jobs succeeded" in table
+    assert table[-2:] == ["--- job-2 (last lines)", "broken exited 2"]
+
+
+def test_dead_container_is_replaced_and_job_requeued(pool, engine):
+    killed = []
+
+    def die():
+        # the container goes down with the job
+        killed.extend(kill_all(engine))
+        return 137
+
+    engine.exec_handler = handler({"fragile": [die, 0]})
+    jobs = make_batch_jobs([["run", "fragile"]])
+    run_batch(pool, jobs, retries=0)
+
+    job = jobs[0]
+    # ran again in a fresh container without using up an attempt
+    assert (job.returncode, job.attempts, job.lost) == (0, 1, 1)
+    # the replacement may reuse the name, but it's another container
+    assert engine.find_container(job.container)["Id"] not in killed
+    assert not any(engine.find_container(id) for id in killed)
+
+
+def test_job_that_keeps_killing_containers_gives_up(pool, engine):
+    engine.exec_handler = handler({"poison": [lambda: kill_all(engine) and 137] * 3})
+    jobs = make_batch_jobs([["run", "poison"]])
+    run_batch(pool, jobs, retries=0)
+    assert (jobs[0].returncode, jobs[0].lost) == (137, 3)
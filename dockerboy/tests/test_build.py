@@ -0,0 +1,65 @@
+from dockerboy.dockwrap.utils.build import BuildParser, BuildReport
+
+
+def feed(lines: list[str]) -> tuple[BuildReport, list]:
+    report, finished = BuildReport("img"), []
+    parser = BuildParser(report, finished.append)
+    for line in lines:
+        parser.feed(line)
+    parser.close()
+    return report, finished
+
+
+def test_classic_output():
+    report, finished = feed([
+        "Step 1/3 : FROM python:3.11",
+        " ---> 0123456789ab",
+        "Step 2/3 : COPY . /app",
+        " ---> Using cache",
+        " ---> 1123456789ab",
+        "Step 3/3 : RUN pip install -e /app",
+        " ---> Running in 2123456789ab",
+        "Successfully built 3123456789ab",
+        "Successfully tagged img:latest",
+    ])
+
+    assert [(s.index, s.total, s.instruction) for s in report.steps] == [
+        (1, 3, "FROM python:3.11"), (2, 3, "COPY . /app"), (3, 3, "RUN pip install -e /app")]
+    assert [s.cached for s in report.steps] == [False, True, False]
+    assert report.cache_hits == 1
+    assert report.image_id == "3123456789ab"
+    # every step is reported once it is finished
+    assert finished == report.steps
+    assert all(s.duration is not None for s in report.steps)
+
+
+def test_buildkit_output():
+    report, finished = feed([
+        "#1 [internal] load build definition from Dockerfile",
+        "#1 DONE 0.0s",
+        "#5 [1/3] FROM docker.io/library/python:3.11",
+        "#5 DONE 0.1s",
+        "#6 [2/3] COPY . /app",
+        "#7 [builder 3/3] RUN pip install -e /app",
+        "#6 CACHED",
+        "#7 1.234 Collecting pyyaml",
+        "#7 DONE 3.1s",
+        "#8 exporting to image",
+        "#8 writing image sha256:4123456789abcdef done",
+        "#8 DONE 0.2s",
+    ])
+
+    # internal vertices aren't steps
+    assert [(s.index, s.instruction) for s in report.steps] == [
+        (1, "FROM docker.io/library/python:3.11"), (2, "COPY . /app"),
+        (3, "RUN pip install -e /app")]
+    assert [s.cached for s in report.steps] == [False, True, False]
+    assert [s.duration for s in report.steps] == [0.1, 0.0, 3.1]
+    assert [s.index for s in finished] == [1, 2, 3]
+    assert report.image_id == "sha256:4123456789abcdef"
+
+
+def test_tail_is_bounded():
+    report, _ = feed([f"line {i}" for i in range(100)])
+    assert list(report.tail) == [f"line {i}" for i in range(80, 100)]
+    assert report.steps == []
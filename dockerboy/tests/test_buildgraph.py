@@ -0,0 +1,117 @@
+""" A project's images built as a DAG, see `buildgraph`. """
+import time
+
+import pytest
+
+from dockerboy.dockwrap.buildgraph import BuildGraph, dockerfile_bases
+from dockerboy.dockwrap.utils.build import BuildReport
+
+
+class StubImage:
+    """ Stands in for MyImage: builds take `seconds` and exit with `returncode`. """
+
+    def __init__(self, project, name: str, dockerfile: str, seconds: float = 0.0,
+                 returncode: int = 0):
+        self.name = name
+        self.dockerfile = str(project / name)
+        (project / name).mkdir()
+        (project / name / "Dockerfile").write_text(dockerfile)
+        self.seconds = seconds
+        self.returncode = returncode
+        self.running = None
+
+    def build(self, force, on_step, log, manifest, parents):
+        self.running.add(self.name)
+        self.running.peak = max(self.running.peak, len(self.running))
+        time.sleep(self.seconds)
+        self.running.discard(self.name)
+        return BuildReport(self.name, returncode=self.returncode)
+
+
+class Running(set):
+    """ The images building right now, and the most there were at once. """
+    peak = 0
+
+
+@pytest.fixture
+def make_graph(project):
+    def make_graph(*specs) -> BuildGraph:
+        running = Running()
+        images = []
+        for spec in specs:
+            image = StubImage(project, *spec)
+            image.running = running
+            images.append(image)
+        graph = BuildGraph(images)
+        graph.running = running
+        return graph
+    return make_graph
+
+
+def test_dockerfile_bases(tmp_path):
+    path = tmp_path / "Dockerfile"
+    path.write_text("ARG BASE=python:3.11\n"
+                    "FROM --platform=linux/amd64 ${BASE} AS deps\n"
+                    "RUN pip install \\\n    numpy\n"
+                    "FROM deps AS test\n"
+                    "FROM cpu-image\n"
+                    "COPY --from=test /out /out\n")
+    # later stages building on `deps` aren't images to wait for
+    assert dockerfile_bases(str(path)) == ["python:3.11", "cpu-image"]
+
+
+def test_parents_and_order(make_graph):
+    graph = make_graph(("debug-image", "FROM gpu-image\n"),
+                       ("gpu-image", "FROM cpu-image:latest\n"),
+                       ("cpu-image", "FROM python:3.11\n"),
+                       ("tagged-image", "FROM cpu-image:v2\n"))
+    assert graph.nodes["debug-image"].parents == ["gpu-image"]
+    # a pinned tag is somebody else's build, not this graph's
+    assert graph.nodes["tagged-image"].parents == []
+    assert graph.order.index("cpu-image") < graph.order.index("gpu-image") < \
+        graph.order.index("debug-image")
+
+    graph.select(["gpu"])
+    assert graph.order == ["cpu-image", "gpu-image"]
+    with pytest.raises(ValueError):
+        graph.select(["missing"])
+
+
+def test_cycle(make_graph):
+    with pytest.raises(ValueError, match="depend on each other"):
+        make_graph(("a-image", "FROM b-image\n"), ("b-image", "FROM a-image\n"))
+
+
+def test_independent_images_build_together(make_graph):
+    graph = make_graph(("cpu-image", "FROM python\n", 0.05),
+                       ("gpu-image", "FROM cpu-image\n", 0.1),
+                       ("docs-image", "FROM python\n", 0.3))
+    assert graph.build(jobs=2)
+    assert graph.running.peak == 2
+    assert {node.status for node in graph.nodes.values()} == {"built"}
+    # gpu only started once cpu was done
+    cpu, gpu = graph.nodes["cpu-image"], graph.nodes["gpu-image"]
+    assert gpu.started >= cpu.started + cpu.duration - 0.01
+
+    assert graph.critical_path() == ["docs-image"]
+    lines = graph.table().splitlines()
+    assert lines[0].split() == ["image", "from", "status", "start", "time"]
+    assert lines[-1].startswith("critical path: docs-image (")
+
+
+def test_failure_skips_descendants(make_graph):
+    graph = make_graph(("cpu-image", "FROM python\n", 0.0, 1),
+                       ("gpu-image", "FROM cpu-image\n"),
+                       ("docs-image", "FROM python\n"))
+    assert not graph.build(jobs=1)
+    assert {name: node.status for name, node in graph.nodes.items()} == \
+        {"cpu-image": "failed", "gpu-image": "skipped", "docs-image": "cancelled"}
+
+
+def test_keep_going(make_graph):
+    graph = make_graph(("cpu-image", "FROM python\n", 0.0, 1),
+                       ("gpu-image", "FROM cpu-image\n"),
+                       ("docs-image", "FROM python\n"))
+    assert not graph.build(jobs=1, keep_going=True)
+    assert {name: node.status for name, node in graph.nodes.items()} == \
+        {"cpu-image": "failed", "gpu-image": "skipped", "docs-image": "built"}
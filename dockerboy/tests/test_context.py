@@ -0,0 +1,52 @@
+from dockerboy.dockwrap.utils.context import IgnoreRules, BuildContext
+
+
+def test_patterns():
+    rules = IgnoreRules(["# a comment", "", "*.pyc", "build", "docs/**/*.md", "/data/raw?"])
+
+    assert rules.is_excluded("a.pyc")
+    # * doesn't cross directories
+    assert not rules.is_excluded("pkg/a.pyc")
+    # a matched directory takes everything below it
+    assert rules.is_excluded("build/lib/x.py")
+    assert not rules.is_excluded("src/build.py")
+    # ** matches zero or more directories
+    assert rules.is_excluded("docs/index.md")
+    assert rules.is_excluded("docs/a/b/page.md")
+    assert not rules.is_excluded("docs/conf.py")
+    assert rules.is_excluded("data/raw1/file")
+    assert not rules.is_excluded("data/raw")
+    assert not rules.has_exceptions
+
+
+def test_exceptions():
+    rules = IgnoreRules(["logs", "!logs/keep.txt", "*.md", "!README.md", "README.md"])
+
+    assert rules.has_exceptions
+    assert rules.is_excluded("logs/run.log")
+    assert not rules.is_excluded("logs/keep.txt")
+    # the last matching pattern wins
+    assert rules.is_excluded("README.md")
+    assert rules.is_excluded("CHANGES.md")
+
+
+def test_from_file(tmp_path):
+    (tmp_path / ".dockerignore").write_text("*.log\n!important.log\n")
+    rules = IgnoreRules.from_file(str(tmp_path / ".dockerignore"))
+    assert rules.is_excluded("debug.log")
+    assert not rules.is_excluded("important.log")
+    assert IgnoreRules.from_file(str(tmp_path / "missing")).rules == []
+
+
+def test_context_files(tmp_path):
+    for path in ["Dockerfile", ".dockerignore", "app.py", "cache/blob", ".dboy/state.json"]:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(path)
+    (tmp_path / ".dockerignore").write_text("cache\nDockerfile\n.dockerignore\n")
+
+    files = [relpath for relpath, _ in BuildContext(str(tmp_path)).files()]
+    # the Dockerfile and .dockerignore are always sent, dboy's own state never
+    assert files == [".dockerignore", "Dockerfile", "app.py"]
+    assert [relpath for relpath, _ in
+            BuildContext(str(tmp_path), excludes=[str(tmp_path / "app.py")]).files()] == \
+        [".dockerignore", "Dockerfile"]
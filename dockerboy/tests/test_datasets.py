@@ -0,0 +1,159 @@
+import json
+import os
+
+import pytest
+
+import regress
+
+from dockerboy.__main__ import main
+from dockerboy.dockwrap import labels, datasets
+from dockerboy.dockwrap.backends.cli import CliBackend
+from dockerboy.dockwrap.datasets import DatasetCache, CONTAINER_MOUNT
+
+
+def prepared(path, version="3.0.1", train=b"train records"):
+    """ A directory laid out like tfds' `<data_dir>/<name>`. """
+    files = {f"{version}/dataset_info.json": b'{"name": "toy"}',
+             f"{version}/features.json": b'{"image": "uint8"}',
+             f"{version}/toy-train.tfrecord-00000-of-00001": train}
+    for relpath, data in files.items():
+        (path / relpath).parent.mkdir(parents=True, exist_ok=True)
+        (path / relpath).write_bytes(data)
+    return path
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DatasetCache(str(tmp_path / "cache"))
+
+
+def objects(cache) -> list[str]:
+    return sorted(digest for prefix in os.listdir(cache._path("objects"))
+                  for digest in os.listdir(cache._path("objects", prefix)))
+
+
+def test_add(cache, tmp_path):
+    manifest = cache.add("toy", str(prepared(tmp_path / "toy")))
+
+    assert cache.names() == ["toy"]
+    assert manifest["size"] == sum(entry["size"] for entry in manifest["files"].values())
+    current = os.path.join(cache.root, "current", "toy")
+    # relative, so it resolves inside the container too
+    assert not os.path.isabs(os.readlink(current))
+    with open(os.path.join(current, "3.0.1", "features.json"), "rb") as f:
+        assert f.read() == b'{"image": "uint8"}'
+    assert cache.verify("toy") == []
+
+
+def test_identical_content_is_stored_once(cache, tmp_path):
+    first = cache.add("toy", str(prepared(tmp_path / "toy")))
+    stored = objects(cache)
+    assert len(stored) == 3
+
+    # the same files again: same tree, nothing new stored
+    again = cache.add("toy", str(prepared(tmp_path / "copy")))
+    assert again["digest"] == first["digest"]
+    assert objects(cache) == stored
+
+    # another dataset sharing two files only adds its own
+    other = cache.add("other", str(prepared(tmp_path / "other", train=b"other records")))
+    assert other["digest"] != first["digest"]
+    assert len(objects(cache)) == 4
+
+    # trees hardlink the shared objects instead of copying them
+    digest = first["files"]["3.0.1/features.json"]["sha256"]
+    shared = os.stat(cache._path("objects", digest[:2], digest))
+    assert shared.st_nlink == 3
+    assert os.stat(os.path.join(cache.root, "current", "other", "3.0.1", "features.json")) \
+        .st_ino == shared.st_ino
+
+
+def test_same_files_under_two_names(cache, tmp_path):
+    toy = cache.add("toy", str(prepared(tmp_path / "toy")))
+    alias = cache.add("alias", str(prepared(tmp_path / "alias")))
+    assert alias["digest"] == toy["digest"]
+    assert sorted(os.listdir(cache._path("trees", toy["digest"]))) == ["alias", "toy"]
+    assert cache.verify("toy") == cache.verify("alias") == []
+
+    # one of them going away leaves the other's tree alone
+    cache.remove("toy")
+    cache.gc()
+    assert os.listdir(cache._path("trees", toy["digest"])) == ["alias"]
+    assert cache.verify("alias") == []
+
+
+def test_concurrent_add_of_the_same_tree(cache, tmp_path, monkeypatch):
+    link_or_copy = datasets._link_or_copy
+    source = str(prepared(tmp_path / "toy"))
+
+    def racing(src, dst):
+        # another process finishes the same tree while this one is staging it
+        monkeypatch.setattr(datasets, "_link_or_copy", link_or_copy)
+        cache.add("toy", source)
+        link_or_copy(src, dst)
+
+    monkeypatch.setattr(datasets, "_link_or_copy", racing)
+    manifest = cache.add("toy", source)
+    assert os.listdir(cache._path("trees", manifest["digest"])) == ["toy"]
+    assert cache.verify("toy") == []
+
+
+def test_new_version_and_gc(cache, tmp_path):
+    first = cache.add("toy", str(prepared(tmp_path / "v1")))
+    second = cache.add("toy", str(prepared(tmp_path / "v2", train=b"more train records")))
+    assert os.readlink(os.path.join(cache.root, "current", "toy")).split(os.sep)[2] == \
+        second["digest"]
+
+    # only the old train file is unreferenced now
+    assert cache.gc() == len(b"train records")
+    assert not os.path.exists(cache._path("trees", first["digest"]))
+    assert len(objects(cache)) == 3
+
+    cache.remove("toy")
+    assert cache.names() == []
+    cache.gc()
+    assert objects(cache) == []
+
+
+def test_verify(cache, tmp_path):
+    manifest = cache.add("toy", str(prepared(tmp_path / "toy")))
+    # objects are read-only, replace one behind the cache's back
+    path = os.path.join(cache._path("trees", manifest["digest"], "toy"), "3.0.1", "features.json")
+    os.remove(path)
+    with open(path, "wb") as f:
+        f.write(b"tampered")
+    assert cache.verify("toy") == ["3.0.1/features.json"]
+    with pytest.raises(KeyError):
+        cache.verify("missing")
+
+
+def test_mounts(cache, tmp_path):
+    assert cache.mounts() == ([], {})
+
+    cache.add("toy", str(prepared(tmp_path / "toy")))
+    volumes, env = cache.mounts()
+    assert volumes == [(cache.root, f"{CONTAINER_MOUNT}:ro")]
+    assert env == {"TFDS_DATA_DIR": f"{CONTAINER_MOUNT}/current"}
+
+    options = CliBackend._run_options("c", volumes, gpus=False, env=env)
+    assert ["-v", f"{cache.root}:/dboy-data:ro"] == options[2:4]
+    assert ["-e", "TFDS_DATA_DIR=/dboy-data/current"] == options[4:6]
+
+
+def test_run_mounts_the_cache_read_only(backend, engine, project, monkeypatch):
+    monkeypatch.setenv("DBOY_NO_DAEMON", "1")
+    (project / "shared").mkdir()
+    (project / "Dockerfile").write_text("FROM python:3.11\n")
+    cache = project / "cache"
+    with open(project / ".dboy.yaml", "w") as f:
+        json.dump({**regress.config(str(project)), "data_cache": str(cache), "ports": []}, f)
+    engine.add_image(regress.IMAGE, {labels.PROJECT: str(project), labels.SPEC: "bench",
+                                     labels.VERSION: "0"})
+
+    main(["data", "prepare", "toy", "--from-dir", str(prepared(project / "toy"))],
+         forward=False)
+    main(["r", "-ni", "-nrm", "--", "python", "train.py"], forward=False)
+
+    spec = engine.find_container(regress.CONTAINER)["Spec"]
+    assert f"{cache}:/dboy-data:ro" in spec["HostConfig"]["Binds"]
+    assert "TFDS_DATA_DIR=/dboy-data/current" in spec["Env"]
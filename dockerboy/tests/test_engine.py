@@ -0,0 +1,233 @@
+""" EngineBackend against the fake Engine API server. """
+import tarfile
+import json
+import io
+
+import pytest
+
+from dockerboy.dockwrap import labels
+from dockerboy.dockwrap.backends import EngineError, NameInUse
+from dockerboy.dockwrap.backends.base import ImageInfo
+from dockerboy.dockwrap.utils.context import TarStream
+
+from .conftest import add_container
+
+
+class BytesStream(TarStream):
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def write_tar(self, fileobj):
+        fileobj.write(self.data)
+
+
+def test_ping(backend):
+    assert backend.ping()
+
+
+def test_ps(backend, engine):
+    add_container(engine, "up", "img")
+    add_container(engine, "down", "img", running=False, labels={"a": "1"})
+
+    assert sorted((c.name, c.state) for c in backend.ps()) == [
+        ("down", "exited"), ("up", "running")]
+    assert [c.name for c in backend.ps(all=False)] == ["up"]
+    down = next(c for c in backend.ps() if c.name == "down")
+    assert (down.image, down.labels) == ("img", {"a": "1"})
+
+
+def test_ps_is_scoped(backend, engine, project):
+    labels.scope(str(project), "img")
+    add_container(engine, "mine", "img", labels=labels.for_ref("img"))
+    add_container(engine, "theirs", "img", labels={labels.PROJECT: "/elsewhere"})
+    assert [c.name for c in backend.ps()] == ["mine"]
+
+
+def test_images(backend, engine):
+    image = engine.add_image("img:v1")
+    engine.add_image("other")["RepoTags"].clear()
+
+    short_id = image["Id"].split(":")[-1][:12]
+    assert ImageInfo(short_id, "img", "v1") in backend.images()
+    assert any(i.repository == "<none>" for i in backend.images())
+    assert backend.inspect_image("img:v1")["Id"] == image["Id"]
+    assert backend.inspect_image("missing") is None
+
+
+def test_build(backend, engine, project):
+    (project / "Dockerfile").write_text("FROM python:3.11\n# a comment\nCOPY . /app\n")
+    (project / "app.py").write_text("print('hi')\n")
+    labels.scope(str(project), "img")
+
+    lines = []
+    assert backend.build("img:v2", str(project), on_line=lines.append) == 0
+    assert lines[:2] == ["Step 1/2 : FROM python:3.11", "Step 2/2 : COPY . /app"]
+    assert lines[-1].startswith("Successfully built ")
+    # scoped builds are labelled
+    assert engine.find_image("img:v2")["Labels"] == {
+        labels.PROJECT: str(project), labels.SPEC: "img", labels.VERSION: "2"}
+
+
+def test_build_error(backend, project):
+    (project / "Dockerfile").write_text("# nothing\n")
+    lines = []
+    assert backend.build("img", str(project), on_line=lines.append) == 1
+    assert lines == ["the Dockerfile cannot be empty"]
+
+
+def test_run(backend, engine):
+    engine.add_image("img")
+    lines = []
+    assert backend.run("img", "job", ["echo", "hi"], interactive=False, gpus=False,
+                       on_line=lines.append) == 0
+    assert lines == ["echo hi"]
+    # removed once it exited
+    assert engine.find_container("job") is None
+
+    engine.exec_handler = lambda cmd: (b"boom\n", 3)
+    assert backend.run("img", "job", ["false"], interactive=False, remove=False) == 3
+    assert engine.find_container("job")["State"] == "exited"
+
+    # the exited one still holds the name
+    with pytest.raises(NameInUse):
+        backend.run("img", "job", ["true"], interactive=False)
+    with pytest.raises(EngineError) as e:
+        backend.run("missing", "job2", ["true"], interactive=False)
+    assert e.value.status == 404
+
+
+def test_run_detached(backend, engine):
+    engine.add_image("img")
+    assert backend.run_detached("img", "bg", ["sleep", "infinity"], volumes=[("/h", "/c")],
+                                ports=[(6006, 6006)], env={"A": "1"})
+    assert engine.find_container("bg")["State"] == "running"
+    # the name is taken now
+    assert not backend.run_detached("img", "bg", ["sleep", "infinity"])
+    assert not backend.run_detached("missing", "bg2", ["sleep", "infinity"])
+
+    assert backend.stop("bg")
+    assert engine.find_container("bg")["State"] == "exited"
+    assert backend.start("bg")
+    assert backend.rm("bg", force=True)
+    assert not backend.rm("bg")
+
+
+def test_exec(backend, engine):
+    engine.add_image("img")
+    backend.run_detached("img", "bg", ["sleep", "infinity"])
+
+    lines = []
+    assert backend.exec("bg", ["ls", "/"], interactive=False, on_line=lines.append) == 0
+    assert lines == ["ls /"]
+
+    engine.exec_handler = lambda cmd: (b"", 42)
+    assert backend.exec("bg", ["exit", "42"], interactive=False) == 42
+
+    backend.stop("bg")
+    with pytest.raises(EngineError) as e:
+        backend.exec("bg", ["ls"], interactive=False)
+    assert e.value.status == 409
+
+
+def test_commit(backend, engine, project):
+    parent = engine.add_image("img", layers=["sha256:a", "sha256:b"])
+    add_container(engine, "c", "img", running=False)
+    labels.scope(str(project), "img")
+
+    assert backend.commit("c", "img:v1")
+    image = engine.find_image("img:v1")
+    assert image["RootFS"]["Layers"][:2] == parent["RootFS"]["Layers"]
+    assert len(image["RootFS"]["Layers"]) == 3
+    assert image["Labels"][labels.VERSION] == "1"
+    assert not backend.commit("missing", "img:v2")
+
+
+def test_squash(backend, engine, project):
+    engine.add_image("img", layers=["sha256:a", "sha256:b"])
+    container = add_container(engine, "c", "img", running=False)
+    labels.scope(str(project), "img")
+
+    assert backend.squash("c", "img:v1", ["ENV A=\"1\"", "LABEL note=\"kept\""])
+    image = engine.find_image("img:v1")
+    # a single layer, sized like the export
+    assert len(image["RootFS"]["Layers"]) == 1
+    assert image["Size"] == len(f"rootfs of {container['Id']}")
+    assert image["Labels"] == {"note": "kept", labels.PROJECT: str(project),
+                               labels.SPEC: "img", labels.VERSION: "1"}
+    assert ("GET", "/containers/c/export") in engine.requests
+    assert not backend.squash("missing", "img:v2")
+
+
+def test_save_and_load(backend, engine):
+    image = engine.add_image("img:v1", {"a": "1"}, layers=["sha256:l1", "sha256:l2"])
+
+    def read(fileobj):
+        with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+            return {m.name: tar.extractfile(m).read() for m in tar if m.isfile()}
+
+    files = backend.save(["img:v1"], read)
+    manifest = json.loads(files["manifest.json"])
+    assert manifest[0]["RepoTags"] == ["img:v1"]
+    assert manifest[0]["Layers"] == ["l1/layer.tar", "l2/layer.tar"]
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    # the daemon has the layers already, nothing is read
+    lines = []
+    assert backend.load(BytesStream(buf.getvalue()), on_line=lines.append) == 0
+    assert lines == ["Loaded image: img:v1"]
+    assert engine.loaded_layers == []
+
+    # the load moved the tag off the original, remove both
+    assert backend.rmi("img:v1") and backend.rmi(image["Id"])
+    assert engine.images == {}
+    assert backend.load(BytesStream(buf.getvalue()), on_line=lines.append) == 0
+    assert engine.loaded_layers == ["sha256:l1", "sha256:l2"]
+    assert engine.find_image("img:v1")["Labels"] == {"a": "1"}
+
+
+def test_prune_needs_a_scope(backend, engine, project):
+    with pytest.raises(ValueError):
+        backend.prune("containers")
+
+    labels.scope(str(project), "img")
+    mine = add_container(engine, "mine", "img", running=False, labels=labels.for_ref("img"))
+    add_container(engine, "theirs", "img", running=False, labels={labels.PROJECT: "/else"})
+    assert backend.prune("containers") == [mine["Id"]]
+    assert engine.find_container("theirs") is not None
+
+
+def test_info_and_disk_usage(backend, engine):
+    engine.add_image("img", size=3 << 20)
+    add_container(engine, "up", "img")
+    info = backend.info()
+    assert (info["NCPU"], info["ContainersRunning"]) == (engine.ncpu, 1)
+    assert backend.disk_usage() == 3 << 20
+
+
+def test_connections_are_reused(backend):
+    for _ in range(20):
+        backend.ps()
+    # one keep-alive connection served every request
+    assert backend.pool._idle.qsize() == 1
+
+
+def test_image_archive_round_trip(backend, engine, project):
+    from dockerboy.dockwrap.images import ImageArchive
+
+    engine.add_image("base", layers=["sha256:l1"])
+    engine.add_image("img:v1", layers=["sha256:l1", "sha256:l2"])
+    archive = ImageArchive(str(project / "archive"))
+    assert archive.export("img:v1").layers == 2
+    assert archive.export("img:v1").skipped
+
+    backend.rmi("img:v1")
+    report = archive.restore("img:v1")
+    # the base layer is still in the daemon, only the top one is sent
+    assert (report.sent, engine.loaded_layers) == (1, ["sha256:l2"])
+    assert engine.find_image("img:v1")["RootFS"]["Layers"] == ["sha256:l1", "sha256:l2"]
@@ -0,0 +1,157 @@
+""" ImageArchive reading `docker save` tars and writing `docker load` ones. """
+import tarfile
+import hashlib
+import json
+import io
+import os
+
+import pytest
+
+from dockerboy.dockwrap import images
+from dockerboy.dockwrap.images import ImageArchive, RestoreStream, chain_ids, full_ref
+
+
+def sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def save_tar(members: dict) -> io.BytesIO:
+    """ A tar of `members`: name -> bytes, or name -> "link:<target>" for a symlink. """
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            if isinstance(data, str):
+                info.type, info.linkname = tarfile.SYMTYPE, data[len("link:"):]
+                tar.addfile(info)
+            else:
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+    buf.seek(0)
+    return buf
+
+
+def config(*layers: bytes) -> bytes:
+    return json.dumps({"rootfs": {"type": "layers",
+                                  "diff_ids": [f"sha256:{sha(l)}" for l in layers]}}).encode()
+
+
+def classic(ref: str, *layers: bytes, repeat_as_link: bool = False) -> io.BytesIO:
+    """ The classic layout: <id>/layer.tar per layer, repeated ones as links. """
+    cfg = config(*layers)
+    members, paths = {}, []
+    for i, layer in enumerate(layers):
+        path = f"{i:02d}/layer.tar"
+        earlier = next((p for p, l in zip(paths, layers) if l == layer), None)
+        members[path] = f"link:../{earlier}" if repeat_as_link and earlier else layer
+        paths.append(path)
+    members[f"{sha(cfg)}.json"] = cfg
+    members["manifest.json"] = json.dumps(
+        [{"Config": f"{sha(cfg)}.json", "RepoTags": [ref], "Layers": paths}]).encode()
+    return save_tar(members)
+
+
+def oci(ref: str, *layers: bytes) -> io.BytesIO:
+    """ The OCI layout: every file under blobs/sha256/ by digest. """
+    cfg = config(*layers)
+    members = {f"blobs/sha256/{sha(data)}": data for data in (*layers, cfg)}
+    members["manifest.json"] = json.dumps(
+        [{"Config": f"blobs/sha256/{sha(cfg)}", "RepoTags": [ref],
+          "Layers": [f"blobs/sha256/{sha(l)}" for l in layers]}]).encode()
+    return save_tar(members)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = ImageArchive(str(tmp_path / "archive"))
+    for directory in ("blobs", "configs", "refs"):
+        (tmp_path / "archive" / directory).mkdir(parents=True)
+    return archive
+
+
+def read_blob(archive, digest: str) -> bytes:
+    with archive.open_blob(digest) as f:
+        return f.read()
+
+
+def test_chain_ids():
+    chains = chain_ids(["sha256:a", "sha256:b"])
+    assert chains[0] == "sha256:a"
+    assert chains[1] == "sha256:" + sha(b"sha256:a sha256:b")
+    assert full_ref("img") == "img:latest"
+
+
+def test_classic_layout(archive):
+    base, top = b"base layer", b"top layer"
+    report = archive._read_save("img:v1", "sha256:i1", classic("img:v1", base, top, base,
+                                                               repeat_as_link=True))
+    assert (report.layers, report.new_bytes) == (3, len(base) + len(top))
+    # the repeat was linked to the first copy and counted as already archived
+    assert report.deduplicated_bytes == len(base)
+
+    record = archive.record("img:v1")
+    assert [layer["blob"] for layer in record["layers"]] == [sha(base), sha(top), sha(base)]
+    assert read_blob(archive, sha(top)) == top
+
+
+def test_large_layers_are_spooled(archive, monkeypatch):
+    monkeypatch.setattr(images, "SMALL_MEMBER", 1024)
+    layer = bytes(range(256)) * 64
+    report = archive._read_save("img:v1", "sha256:i1", classic("img:v1", layer))
+    assert report.new_bytes == len(layer) and report.stored_bytes < len(layer)
+    assert read_blob(archive, sha(layer)) == layer
+    # no temporary spool files left behind
+    assert os.listdir(archive._path("blobs")) == [f"{sha(layer)}{archive.suffix}"]
+
+
+def test_oci_layout_skips_archived_layers(archive, monkeypatch):
+    base, top, other = b"base layer", b"top layer", b"other top"
+    archive._read_save("img:v1", "sha256:i1", oci("img:v1", base, top))
+
+    extracted = []
+    extractfile = tarfile.TarFile.extractfile
+
+    def record_extract(tar, member):
+        extracted.append(member.name)
+        return extractfile(tar, member)
+
+    monkeypatch.setattr(tarfile.TarFile, "extractfile", record_extract)
+    report = archive._read_save("img:v2", "sha256:i2", oci("img:v2", base, other))
+    # the base layer's blob was never read out of the tar
+    assert f"blobs/sha256/{sha(base)}" not in extracted
+    assert (report.new_bytes, report.deduplicated_bytes) == (len(other), len(base))
+    assert [layer["size"] for layer in archive.record("img:v2")["layers"]] == \
+        [len(base), len(other)]
+
+
+def test_restore_stream_leaves_out_present_layers(archive):
+    base, top = b"base layer", b"top layer"
+    archive._read_save("img:v1", "sha256:i1", classic("img:v1", base, top))
+    record = archive.record("img:v1")
+
+    buf = io.BytesIO()
+    RestoreStream(archive, record, [False, True]).write_tar(buf)
+    buf.seek(0)
+    with tarfile.open(fileobj=buf, mode="r") as tar:
+        files = {m.name: tar.extractfile(m).read() for m in tar}
+    assert files[f"{sha(top)}/layer.tar"] == top
+    assert f"{sha(base)}/layer.tar" not in files
+    manifest = json.loads(files["manifest.json"])
+    # the manifest still lists every layer, the daemon has the rest
+    assert manifest[0]["Layers"] == [f"{sha(base)}/layer.tar", f"{sha(top)}/layer.tar"]
+    assert manifest[0]["RepoTags"] == ["img:v1"]
+
+
+def test_gc_and_table(archive):
+    base, top, other = b"base layer", b"top layer", b"other top"
+    archive._read_save("img:v1", "sha256:i1", classic("img:v1", base, top))
+    archive._read_save("img:v2", "sha256:i2", classic("img:v2", base, other))
+    lines = archive.table().splitlines()
+    assert [line.split()[0] for line in lines[2:4]] == ["img:v1", "img:v2"]
+    assert lines[-1].startswith("3 layers")
+
+    archive.remove("img:v1")
+    assert archive.gc() > 0
+    assert archive.blob_path(sha(top)) is None
+    assert read_blob(archive, sha(base)) == base
+    assert archive.refs() == ["img:v2"]
@@ -0,0 +1,75 @@
+import pytest
+
+from dockerboy.dockwrap import labels
+from dockerboy.dockwrap.lineage import Lineage, gc
+
+from .conftest import add_container
+
+
+@pytest.fixture
+def versions(backend, engine, project):
+    """ img:v1 to img:v5 in the engine and the lineage, v1 also tagged
+    img:release and v2 used by a running container.
+    """
+    labels.scope(str(project), "img")
+    scope = labels.for_ref("img")
+    lineage = Lineage()
+    for version in range(1, 6):
+        ref = f"img:v{version}"
+        image = engine.add_image(ref, scope, size=10 << 20)
+        lineage.record(ref, image, "img", squashed=False)
+    # recorded, but removed behind dboy's back since
+    lineage.record("img:v0", {"Id": "sha256:" + "f" * 64, "RootFS": {"Layers": []}},
+                   "img", squashed=False)
+    lineage.save()
+
+    engine.find_image("img:v1")["RepoTags"].append("img:release")
+    add_container(engine, "runner", "img:v2", running=True, labels=scope)
+    add_container(engine, "old", "img:v3", running=False, labels=scope)
+    engine.add_image("dangling", scope)["RepoTags"].clear()
+    return lineage
+
+
+def test_gc(versions, engine, project):
+    report = gc("img", keep=2)
+
+    assert [entry["ref"] for entry in Lineage().versions("img")] == \
+        ["img:v1", "img:v2", "img:v4", "img:v5"]
+    assert engine.find_image("img:v3") is None
+    assert engine.find_image("img:v1") is not None
+    # the stopped container went first, so v3 was no longer in use
+    assert engine.find_container("old") is None
+    assert engine.find_container("runner") is not None
+    assert not any(not image["RepoTags"] for image in engine.images.values())
+
+    assert "Removed 1 stopped containers: old" in report
+    assert "keep img:v5: one of the last 2" in report
+    assert "keep img:v1: tagged img:release" in report
+    assert "keep img:v2: used by runner" in report
+    assert "  remove img:v3" in report
+    assert "Removed 1 versions and 1 dangling images" in report
+
+
+def test_gc_dry_run(versions, engine, project):
+    report = gc("img", keep=2, dry_run=True)
+
+    assert "Would remove 1 stopped containers: old" in report
+    assert "  would remove img:v3" in report
+    assert engine.find_image("img:v3") is not None
+    assert engine.find_container("old") is not None
+    assert len(Lineage().versions("img")) == 6
+
+
+def test_gc_leaves_other_projects_alone(versions, engine, project):
+    add_container(engine, "foreign", "other", running=False,
+                  labels={labels.PROJECT: "/elsewhere"})
+    gc("img", keep=2)
+    assert engine.find_container("foreign") is not None
+
+
+def test_next_ref(versions):
+    # numbers follow the newest recorded version, whatever the container runs
+    assert versions.next_ref("img:v2") == "img:v6"
+    versions.forget("img", {entry["ref"] for entry in versions.versions("img")})
+    assert versions.versions("img") == []
+    assert versions.next_ref("img:v2") == "img:v3"
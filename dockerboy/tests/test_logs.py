@@ -0,0 +1,146 @@
+""" Detached runs' rotating logs, and `dboy logs` merging several containers. """
+import threading
+import time
+import gzip
+import os
+
+from .conftest import add_container
+
+from dockerboy.dockwrap import logs
+from dockerboy.dockwrap.logs import (RotatingLog, FileSource, DockerSource, follow_container,
+                                     last_lines, multiplex, split_timestamp)
+
+
+def stamp(second: int) -> str:
+    return f"2024-05-01T12:00:{second:02d}.000000000Z"
+
+
+def read_archive(path) -> list[str]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def wait_for(predicate, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_rotation_keeps_backups(tmp_path):
+    log = RotatingLog(str(tmp_path), max_bytes=12, backups=2)
+    # "line-N\n" is 7 bytes, so every line after the first rotates
+    for n in range(4):
+        log.write(f"line-{n}")
+    log.close()
+
+    assert (tmp_path / "output.log").read_text() == "line-3\n"
+    assert read_archive(log.archive(1)) == ["line-2"]
+    assert read_archive(log.archive(2)) == ["line-1"]
+    # line-0 fell off the end
+    assert sorted(os.listdir(tmp_path)) == ["output.log", "output.log.1.gz", "output.log.2.gz"]
+
+
+def test_rotation_without_backups(tmp_path):
+    log = RotatingLog(str(tmp_path), max_bytes=12, backups=0)
+    for n in range(3):
+        log.write(f"line-{n}")
+    log.close()
+    assert os.listdir(tmp_path) == ["output.log"]
+    assert (tmp_path / "output.log").read_text() == "line-2\n"
+
+
+def test_reopen_appends(tmp_path):
+    RotatingLog(str(tmp_path), max_bytes=20).write("line-0")
+    log = RotatingLog(str(tmp_path), max_bytes=20)
+    # the size picks up where the last follower left off
+    assert log.size == 7
+    log.write("line-1")
+    log.write("line-2")
+    log.close()
+    assert read_archive(log.archive(1)) == ["line-0", "line-1"]
+
+
+def test_split_timestamp():
+    assert split_timestamp(f"{stamp(1)} hello world") == (stamp(1), "hello world")
+    assert split_timestamp("no timestamp here") == ("", "no timestamp here")
+
+
+def test_last_lines(tmp_path):
+    path = tmp_path / "output.log"
+    path.write_text("".join(f"line-{n}\n" for n in range(100)))
+    # blocks smaller than a line still find the right ones
+    assert last_lines(str(path), 3, block=4) == ["line-97", "line-98", "line-99"]
+    assert len(last_lines(str(path), 500)) == 100
+    assert last_lines(str(path), 0) == []
+
+
+def test_tail_reaches_into_archive(tmp_path):
+    log = RotatingLog(str(tmp_path), max_bytes=20)
+    for n in range(4):
+        log.write(f"line-{n}")
+    log.close()
+    source = FileSource("a", str(tmp_path))
+    assert source.tail(2) == ["line-2", "line-3"]
+    # just rotated: the rest comes from output.log.1.gz
+    assert source.tail(3) == ["line-1", "line-2", "line-3"]
+
+
+def test_multiplex_merges_by_time(tmp_path, backend, engine):
+    log = RotatingLog(str(tmp_path / "trainer"))
+    for second, text in [(1, "epoch 1"), (4, "epoch 2"), (6, "epoch 3")]:
+        log.write(f"{stamp(second)} {text}")
+    log.close()
+    container = add_container(engine, "tb", "img", running=False)
+    container["Output"] = f"{stamp(2)} serving\n{stamp(5)} reload\n".encode()
+
+    out = []
+    multiplex([FileSource("trainer", str(tmp_path / "trainer")), DockerSource("tb")],
+              tail=2, out=out.append)
+    # each source's last two lines, in one timeline
+    assert out == ["[tb     ] serving", "[trainer] epoch 2", "[tb     ] reload",
+                   "[trainer] epoch 3"]
+
+    out.clear()
+    multiplex([DockerSource("tb")], tail=1, timestamps=True, out=out.append)
+    assert out == [f"[tb] {stamp(5)} reload"]
+
+
+def test_multiplex_follows_across_rotation(tmp_path):
+    directory = str(tmp_path / "trainer")
+    os.makedirs(directory)
+    # a live follower, as far as `is_following` can tell
+    (tmp_path / "trainer" / logs.PID_FILE).write_text(str(os.getpid()))
+
+    out = []
+    reader = threading.Thread(target=multiplex, daemon=True, kwargs={
+        "sources": [FileSource("trainer", directory)], "follow": True, "out": out.append})
+    reader.start()
+
+    # created after the reader started, so it's read from the beginning
+    log = RotatingLog(directory, max_bytes=20)
+    log.write("line-0")
+    wait_for(lambda: out)
+    for n in range(1, 4):
+        log.write(f"line-{n}")
+    log.close()
+    assert os.path.exists(log.archive(1))
+
+    # the follower exiting ends it, once everything has been read
+    os.remove(tmp_path / "trainer" / logs.PID_FILE)
+    reader.join(10)
+    assert not reader.is_alive()
+    assert out == [f"[trainer] line-{n}" for n in range(4)]
+
+
+def test_follow_container(tmp_path, backend, engine):
+    container = add_container(engine, "job", "img", running=False)
+    container["Output"] = b"".join(f"line-{n}\n".encode() for n in range(3))
+
+    directory = str(tmp_path / "logs" / "job")
+    assert follow_container("job", directory, max_bytes=14, backups=5, remove=True) == 0
+    assert (tmp_path / "logs" / "job" / "output.log").read_text() == "line-2\n"
+    assert read_archive(os.path.join(directory, "output.log.1.gz")) == ["line-0", "line-1"]
+    assert not os.path.exists(os.path.join(directory, logs.PID_FILE))
+    # it had exited, so --rm removed it
+    assert engine.containers == {}
@@ -0,0 +1,74 @@
+import os
+
+from dockerboy.dockwrap.utils.manifest import BuildManifest
+
+
+def make_context(path):
+    (path / "pkg").mkdir(parents=True)
+    (path / "Dockerfile").write_text("FROM python:3.11\n")
+    (path / "pkg" / "a.py").write_text("a = 1\n")
+    (path / ".dboy").mkdir()
+    (path / ".dboy" / "manifest.json").write_text("{}")
+
+
+def test_context_hash(tmp_path):
+    make_context(tmp_path)
+    manifest = BuildManifest(str(tmp_path / "m.json"))
+    first = manifest.context_hash(str(tmp_path))
+    assert manifest.context_hash(str(tmp_path)) == first
+
+    # dboy's own state isn't part of the context
+    (tmp_path / ".dboy" / "pool.json").write_text("{}")
+    assert manifest.context_hash(str(tmp_path)) == first
+
+    (tmp_path / "pkg" / "a.py").write_text("a = 2\n")
+    changed = manifest.context_hash(str(tmp_path))
+    assert changed != first
+
+    # so is the mode
+    os.chmod(tmp_path / "pkg" / "a.py", 0o755)
+    assert manifest.context_hash(str(tmp_path)) != changed
+
+
+def test_digest_cache(tmp_path):
+    make_context(tmp_path)
+    manifest = BuildManifest(str(tmp_path / "m.json"))
+    context_hash = manifest.context_hash(str(tmp_path))
+    path = str(tmp_path / "pkg" / "a.py")
+    assert path in manifest.files
+
+    # a cached digest is trusted while size, mtime and inode are unchanged
+    manifest.files[path][3] = "0" * 64
+    assert manifest.context_hash(str(tmp_path)) != context_hash
+
+    # files that left the context are forgotten
+    os.remove(path)
+    manifest.context_hash(str(tmp_path))
+    assert path not in manifest.files
+
+
+def test_explicit_files(tmp_path):
+    make_context(tmp_path)
+    manifest = BuildManifest(str(tmp_path / "m.json"))
+    only = [("Dockerfile", str(tmp_path / "Dockerfile"))]
+    assert manifest.context_hash(str(tmp_path), only) != manifest.context_hash(str(tmp_path))
+    assert manifest.context_hash(str(tmp_path), only) == manifest.context_hash(str(tmp_path), only)
+
+
+def test_record_and_reload(tmp_path):
+    path = str(tmp_path / "m.json")
+    manifest = BuildManifest(path)
+    assert manifest.lookup("img") is None
+    manifest.record("img", "abc", "0123456789ab", parents={"base": "ba9876543210"})
+    manifest.record("base", "def", "ba9876543210")
+    manifest.save()
+
+    reloaded = BuildManifest(path)
+    assert reloaded.lookup("img") == {"hash": "abc", "image_id": "0123456789ab",
+                                      "parents": {"base": "ba9876543210"}}
+    assert reloaded.lookup("base")["parents"] == {}
+
+
+def test_default_path(project):
+    BuildManifest().save()
+    assert os.path.exists(project / ".dboy" / "manifest.json")
@@ -0,0 +1,23 @@
+""" The small shared helpers in `utils.misc`. """
+import json
+
+from dockerboy.dockwrap.utils.misc import format_table, write_json
+
+
+def test_format_table():
+    rows = [("name", "size"), ("a", "10"), ("longer", "7")]
+    assert format_table(rows) == ["name    size",
+                                  "------  ----",
+                                  "a       10  ",
+                                  "longer  7   "]
+    assert format_table(rows, right_align=True)[2:] == ["a         10",
+                                                        "longer     7"]
+
+
+def test_write_json(tmp_path):
+    path = tmp_path / "state.json"
+    write_json(str(path), {"a": 1})
+    write_json(str(path), {"b": [2]})
+    assert json.loads(path.read_text()) == {"b": [2]}
+    assert [p.name for p in tmp_path.iterdir()] == ["state.json"]
+
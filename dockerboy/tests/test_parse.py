@@ -0,0 +1,44 @@
+import json
+
+from dockerboy.dockwrap.backends.cli import parse_ps, parse_images, parse_size
+
+
+def test_parse_ps():
+    out = "\n".join(json.dumps(row) for row in [
+        {"ID": "abc", "Names": "web", "Image": "img:v2", "State": "running",
+         "Status": "Up 2 minutes", "Command": "\"sleep infinity\"",
+         "CreatedAt": "2024-01-01", "Ports": "0.0.0.0:6006->6006/tcp",
+         "Labels": "dockerboy.project=/p,dockerboy.spec=img"},
+        {"ID": "def", "Names": "a,b", "Image": "img", "Status": "Exited (0) 1 hour ago",
+         "Labels": ""},
+    ]) + "\n\n"
+
+    web, a, b = parse_ps(out)
+    assert (web.id, web.name, web.image, web.state) == ("abc", "web", "img:v2", "running")
+    assert web.running
+    assert web.labels == {"dockerboy.project": "/p", "dockerboy.spec": "img"}
+    # no State column: derived from Status
+    assert [a.name, b.name] == ["a", "b"]
+    assert a.state == b.state == "exited"
+    assert a.labels == {}
+
+
+def test_parse_images():
+    out = "\n".join(json.dumps(row) for row in [
+        {"ID": "0123456789ab", "Repository": "img", "Tag": "v1"},
+        {"ID": "ba9876543210", "Repository": "<none>", "Tag": "<none>"},
+    ])
+
+    tagged, dangling = parse_images(out)
+    assert (tagged.id, tagged.repository, tagged.tag) == ("0123456789ab", "img", "v1")
+    assert tagged.refs == ["0123456789ab", "img", "img:v1"]
+    # untagged images are only known by their ID
+    assert dangling.refs == ["ba9876543210"]
+    assert parse_images("") == []
+
+
+def test_parse_size():
+    assert parse_size("1.5GB") == 1_500_000_000
+    assert parse_size("12kB") == 12_000
+    assert parse_size(" 3 MB ") == 3_000_000
+    assert parse_size("0B") == 0
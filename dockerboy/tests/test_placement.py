@@ -0,0 +1,125 @@
+""" `dboy` commands spread over two daemons, see `endpoints`. """
+import json
+import os
+
+import pytest
+
+import regress
+
+from dockerboy.__main__ import main
+from dockerboy.dockwrap import endpoints, labels
+from dockerboy.dockwrap.backends import set_backend, use_endpoint
+from dockerboy.dockwrap.backends.fake import FakeEngine
+from dockerboy.dockwrap.wrapper import DockerWrapper
+
+from .conftest import add_container
+
+
+CONTAINER = "bench-container"
+
+
+@pytest.fixture
+def engines(socket_dir):
+    """ A small host already running three containers, and a bigger idle one. """
+    busy = FakeEngine(os.path.join(socket_dir, "busy.sock"), ncpu=4, mem_total=8 << 30)
+    idle = FakeEngine(os.path.join(socket_dir, "idle.sock"), ncpu=8, mem_total=32 << 30)
+    with busy, idle:
+        for i in range(3):
+            add_container(busy, f"foreign-{i}", "other", labels={labels.PROJECT: "/elsewhere"})
+        yield busy, idle
+
+
+@pytest.fixture
+def dboy(engines, project, monkeypatch):
+    """ Runs `dboy` in a project whose `endpoints` are both engines. """
+    monkeypatch.setenv("DBOY_BACKEND", "engine")
+    monkeypatch.setenv("DBOY_NO_DAEMON", "1")
+    monkeypatch.delenv("DBOY_ENDPOINT", raising=False)
+
+    (project / "shared").mkdir()
+    (project / "Dockerfile").write_text("FROM python:3.11\n")
+    config = {**regress.config(str(project)),
+              "endpoints": [f"unix://{engine.socket_path}" for engine in engines]}
+    with open(project / ".dboy.yaml", "w") as f:
+        json.dump(config, f)
+    for engine in engines:
+        engine.add_image(regress.IMAGE, {labels.PROJECT: str(project), labels.SPEC: "bench",
+                                         labels.VERSION: "0"})
+
+    def dboy(*args):
+        main(list(args), forward=False)
+        # every command is a new process in real life
+        DockerWrapper._states.clear()
+        use_endpoint(None)
+
+    yield dboy
+    set_backend(None)
+    DockerWrapper._states.clear()
+    labels.unscope()
+    use_endpoint(None)
+    endpoints._pinned = None
+
+
+def placement(project) -> dict:
+    with open(project / ".dboy" / "placement.json", "r") as f:
+        return json.load(f)
+
+
+def container_requests(engine) -> list[tuple[str, str]]:
+    return [(method, path) for method, path in engine.requests if CONTAINER in path]
+
+
+def test_run_lands_on_the_emptier_endpoint(dboy, engines, project, capsys):
+    busy, idle = engines
+    dboy("r", "-ni", "-nrm", "--", "echo", "hi")
+
+    assert idle.find_container(CONTAINER) is not None
+    assert busy.find_container(CONTAINER) is None
+    assert placement(project) == {CONTAINER: f"unix://{idle.socket_path}"}
+    assert f"Placing {CONTAINER} on unix://{idle.socket_path}: 0 running" in capsys.readouterr().out
+
+
+def test_sd_and_rm_follow_the_placement(dboy, engines, project):
+    busy, idle = engines
+    dboy("r", "-ni", "-nrm", "--", "echo", "hi")
+    # as if it were still running its command
+    idle.find_container(CONTAINER)["State"] = "running"
+    busy.requests.clear()
+
+    dboy("sd")
+    assert idle.find_container(CONTAINER)["State"] == "exited"
+    dboy("rm")
+    assert idle.find_container(CONTAINER) is None
+    assert container_requests(busy) == []
+
+
+def test_existing_container_stays_put(dboy, engines, project):
+    busy, idle = engines
+    dboy("r", "-ni", "-nrm", "--", "echo", "hi")
+    idle.find_container(CONTAINER).update(State="running", Cmd=["sleep", "infinity"])
+    # the idle host fills up, the container is still reused there
+    for i in range(20):
+        add_container(idle, f"other-{i}", "other")
+
+    dboy("r", "-ni", "-nrm", "--", "echo", "again")
+    assert ("POST", f"/containers/{CONTAINER}/exec") in idle.requests
+    assert busy.find_container(CONTAINER) is None
+    assert placement(project) == {CONTAINER: f"unix://{idle.socket_path}"}
+
+
+def test_pinned_endpoint_wins(dboy, engines, project):
+    busy, idle = engines
+    dboy("-e", f"unix://{busy.socket_path}", "r", "-ni", "-nrm", "--", "echo", "hi")
+
+    assert busy.find_container(CONTAINER) is not None
+    assert idle.find_container(CONTAINER) is None
+    assert placement(project) == {CONTAINER: f"unix://{busy.socket_path}"}
+
+
+def test_endpoint_without_the_image_is_left_out(dboy, engines, project):
+    busy, idle = engines
+    del idle.images[idle.find_image(regress.IMAGE)["Id"]]
+    dboy("r", "-ni", "-nrm", "--", "echo", "hi")
+
+    assert busy.find_container(CONTAINER) is not None
+    assert placement(project) == {CONTAINER: f"unix://{busy.socket_path}"}
@@ -0,0 +1,105 @@
+import json
+import os
+
+import pytest
+
+from dockerboy.dockwrap import pool as pool_module
+from dockerboy.dockwrap.pool import WarmPool
+from dockerboy.dockwrap.wrapper import DockerWrapper
+
+
+@pytest.fixture
+def pool(backend, engine, project):
+    engine.add_image("img")
+    return WarmPool("c", "img", str(project), "/app", size=1, max_size=2, idle_timeout=60)
+
+
+def entries(project) -> dict:
+    path = project / ".dboy" / "pool.json"
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f).get("c", {})
+
+
+def test_warm(pool, engine, project):
+    assert pool.warm() == 1
+    assert pool.warm() == 0
+    container = engine.find_container("c-pool-0")
+    assert container["State"] == "running"
+    # the idle watchdog is the entrypoint
+    assert container["Cmd"][:2] == ["sh", "-c"] and "-lt 60" in container["Cmd"][2]
+    assert entries(project)["c-pool-0"]["state"] == "idle"
+
+
+def test_lease_and_release(pool, project):
+    pool.warm()
+    name = pool.lease()
+    assert name == "c-pool-0"
+    assert entries(project)[name]["state"] == "leased"
+    assert entries(project)[name]["pid"] == os.getpid()
+
+    # the next lease starts a second container, up to max_size
+    assert pool.lease() == "c-pool-1"
+    assert pool.lease() is None
+
+    pool.release(name)
+    assert entries(project)[name]["state"] == "idle"
+    assert entries(project)[name]["uses"] == 1
+    assert pool.lease() == name
+
+
+def test_run(pool, engine, project):
+    assert pool.run(["echo", "hi"], interactive=False) == 0
+    entry = entries(project)["c-pool-0"]
+    assert (entry["state"], entry["uses"]) == ("idle", 1)
+    assert ("POST", "/containers/c-pool-0/exec") in engine.requests
+
+
+def test_max_uses_recycles(pool, engine, project):
+    pool.max_uses = 1
+    name = pool.lease()
+    pool.release(name)
+    assert name not in entries(project)
+    assert engine.find_container(name) is None
+
+
+def test_rebuilt_image_is_discarded(pool, engine, project):
+    pool.warm()
+    engine.add_image("img")
+    DockerWrapper.invalidate()
+
+    pool.prune()
+    assert entries(project) == {}
+    assert engine.find_container("c-pool-0") is None
+
+
+def test_idle_timeout_and_dead_lease_holder(pool, engine, project, monkeypatch):
+    pool.max_size = 3
+    pool.warm(2)
+    leased = pool.lease()
+    idle = next(name for name in entries(project) if name != leased)
+
+    now = pool_module.time.time()
+    monkeypatch.setattr(pool_module.time, "time", lambda: now + 120)
+    monkeypatch.setattr(pool_module, "_pid_alive", lambda pid: False)
+    pool.prune()
+    assert entries(project) == {}
+    assert engine.find_container(idle) is None and engine.find_container(leased) is None
+
+
+def test_exited_container_is_forgotten(pool, engine, project):
+    pool.warm()
+    engine.find_container("c-pool-0")["State"] = "exited"
+    DockerWrapper.invalidate()
+
+    assert pool.lease() == "c-pool-0"
+    assert engine.find_container("c-pool-0")["State"] == "running"
+
+
+def test_drain(pool, engine, project):
+    pool.warm(2)
+    assert pool.drain() == 2
+    assert entries(project) == {}
+    assert engine.containers == {}
+    assert "0/2 containers" in pool.status()
@@ -0,0 +1,67 @@
+import socket
+import json
+
+import pytest
+
+from dockerboy.dockwrap.ports import PortRegistry
+
+from .conftest import add_container
+
+
+@pytest.fixture
+def registry(backend, project, monkeypatch):
+    # stay clear of anything listening on the usual ports
+    monkeypatch.setattr(PortRegistry, "port_range", (47000, 47010))
+    return PortRegistry()
+
+
+def test_allocate_requested_port(registry, project):
+    assert registry.allocate("a", [(47000, 6006)]) == [(47000, 6006)]
+    assert registry.leased("a") == [(47000, 6006)]
+    with open(project / "ports.json", "r") as f:
+        assert json.load(f)["47000"]["container"] == "a"
+
+
+def test_taken_port_moves(registry, engine):
+    add_container(engine, "a", "img")
+    registry.allocate("a", [(47000, 6006)])
+
+    assert registry.allocate("b", [(47000, 6006), (47001, 8888)]) == \
+        [(47001, 6006), (47002, 8888)]
+
+
+def test_bound_port_moves(registry):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("0.0.0.0", 47000))
+        s.listen()
+        assert registry.allocate("a", [(47000, 6006)]) == [(47001, 6006)]
+
+
+def test_reallocate_gives_old_ports_back(registry, engine):
+    add_container(engine, "a", "img")
+    registry.allocate("a", [(47003, 6006)])
+    assert registry.allocate("a", [(47000, 6006)]) == [(47000, 6006)]
+    assert registry.leased("a") == [(47000, 6006)]
+
+
+def test_release(registry, engine):
+    registry.allocate("a", [(47000, 6006)])
+    registry.allocate("b", [(47001, 6006)])
+    assert registry.release("a", "c") == [47000]
+    assert registry.leased("a") == []
+    assert registry.leased("b") == [(47001, 6006)]
+
+
+def test_leases_of_removed_containers_are_dropped(registry, engine):
+    registry.allocate("gone", [(47000, 6006)])
+    # "gone" isn't in the engine, so its lease is dropped once it gets in the way
+    assert registry.allocate("b", [(47000, 6006)]) == [(47000, 6006)]
+    assert registry.leased("gone") == []
+
+
+def test_range_exhausted(registry, engine, monkeypatch):
+    monkeypatch.setattr(PortRegistry, "port_range", (47000, 47001))
+    add_container(engine, "a", "img")
+    registry.allocate("a", [(47000, 1), (47001, 2)])
+    with pytest.raises(RuntimeError, match="No free host port"):
+        registry.allocate("b", [(47000, 6006)])
@@ -0,0 +1,30 @@
+""" The fake-docker call-count and latency check of bench/regress.py. """
+import json
+import os
+
+import pytest
+
+import regress
+
+
+# latencies are compared against a baseline recorded outside of pytest,
+# allow for a busier machine
+TOLERANCE = float(os.environ.get("DBOY_REGRESS_TOLERANCE", "1.0"))
+RUNS = 3
+
+
+@pytest.fixture(scope="module")
+def sandbox(tmp_path_factory):
+    return regress.Sandbox(str(tmp_path_factory.mktemp("regress")))
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    with open(regress.BASELINE_FILE, "r") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("name", list(regress.SCENARIOS))
+def test_scenario(sandbox, baseline, name):
+    result = regress.measure(sandbox, regress.SCENARIOS[name], RUNS)
+    assert regress.compare(name, result, baseline.get(name), TOLERANCE) == []
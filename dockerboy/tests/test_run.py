@@ -0,0 +1,66 @@
+""" `exec_or_run` creating, reusing and adopting the project's container. """
+import json
+
+import pytest
+
+import fake_docker
+import regress
+
+from dockerboy.dockwrap import labels
+from dockerboy.dockwrap.backends import EngineError
+from dockerboy.dockwrap.utils.run import exec_or_run
+from dockerboy.dockwrap.wrapper import DockerWrapper
+
+from .conftest import add_container
+
+
+@pytest.fixture
+def scoped(backend, engine, project):
+    labels.scope(str(project), "img")
+    engine.add_image("img", labels.for_ref("img"))
+    return project
+
+
+def run(project, name="job"):
+    return exec_or_run("img", name, str(project), ["python", "train.py"], interactive=False,
+                       post_removal=False)
+
+
+def test_creates_the_container(scoped, engine):
+    run(scoped)
+    assert engine.find_container("job")["Labels"][labels.PROJECT] == str(scoped)
+
+
+def test_adopts_a_container_from_before_labels(scoped, engine):
+    # invisible to the scoped listing, but holding the name
+    add_container(engine, "job", "img")
+    engine.requests.clear()
+
+    run(scoped)
+    # executed in the old container instead of failing to create a new one
+    assert [c["Name"] for c in engine.containers.values()] == ["job"]
+    assert any(path.endswith("/exec") for _, path in engine.requests)
+
+
+def test_other_failures_are_not_adopted(scoped, engine, monkeypatch):
+    adopted = []
+    monkeypatch.setattr(DockerWrapper, "adopt_container", adopted.append)
+    with pytest.raises(EngineError):
+        exec_or_run("missing", "job", str(scoped), ["true"], interactive=False)
+    assert adopted == []
+
+
+def test_cli_adopts_a_container_from_before_labels(tmp_path):
+    sandbox = regress.Sandbox(str(tmp_path))
+    sandbox.reset({"images": [regress.IMAGE]})
+    with open(sandbox.state_file, "r") as f:
+        state = json.load(f)
+    fake_docker.add_container(state, regress.CONTAINER, regress.IMAGE, ["sleep", "infinity"],
+                              True)
+    with open(sandbox.state_file, "w") as f:
+        json.dump(state, f)
+
+    assert sandbox.dboy(["r", *regress.RUN_ARGS]).returncode == 0
+    calls = [call["args"][0] for call in sandbox.calls()]
+    assert calls[calls.index("run"):][:3] == ["run", "container", "ps"]
+    assert "exec" in calls[calls.index("run"):]
@@ -0,0 +1,136 @@
+""" `dboy serve`'s socket: who gets to talk to the daemon, and to whom `dboy` talks. """
+import subprocess
+import socket
+import stat
+import time
+import sys
+import os
+
+import pytest
+
+import regress
+from dockerboy import serve
+
+root_only = pytest.mark.skipif(os.getuid() != 0, reason="needs to act as another user")
+
+
+@pytest.fixture
+def daemon(socket_dir):
+    """ A `dboy serve` on its default socket under a scratch $XDG_RUNTIME_DIR. """
+    sandbox = regress.Sandbox(socket_dir)
+    sandbox.reset({})
+    env = {**sandbox.env, "XDG_RUNTIME_DIR": socket_dir}
+    env.pop("DBOY_NO_DAEMON")
+    env.pop(serve.SOCKET_ENV, None)
+    path = os.path.join(socket_dir, "dockerboy", "dboy.sock")
+    process = subprocess.Popen([sys.executable, "-c", regress.ENTRY, "serve"],
+                               cwd=sandbox.project, env=env, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while not os.path.exists(path):
+            assert process.poll() is None and time.monotonic() < deadline
+            time.sleep(0.05)
+        yield path
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def listen(path: str) -> socket.socket:
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+    return listener
+
+
+def test_default_socket_path(monkeypatch):
+    monkeypatch.delenv(serve.SOCKET_ENV, raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+    assert serve.socket_path() == "/run/user/1000/dockerboy/dboy.sock"
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    assert serve.socket_path() == f"/tmp/dockerboy-{os.getuid()}/dboy.sock"
+    monkeypatch.setenv(serve.SOCKET_ENV, "/elsewhere.sock")
+    assert serve.socket_path() == "/elsewhere.sock"
+
+
+def test_private_dir(tmp_path):
+    path = str(tmp_path / "dockerboy")
+    serve.private_dir(path)
+    assert stat.S_IMODE(os.lstat(path).st_mode) == 0o700
+
+    os.chmod(path, 0o755)
+    serve.private_dir(path)
+    assert stat.S_IMODE(os.lstat(path).st_mode) == 0o700
+
+    # somebody else's directory planted where ours goes
+    link = str(tmp_path / "planted")
+    os.symlink(path, link)
+    with pytest.raises(PermissionError):
+        serve.private_dir(link)
+
+
+def test_daemon_socket_is_private(daemon, monkeypatch):
+    assert stat.S_IMODE(os.lstat(os.path.dirname(daemon)).st_mode) == 0o700
+    assert stat.S_IMODE(os.lstat(daemon).st_mode) == 0o600
+
+    monkeypatch.setenv(serve.SOCKET_ENV, daemon)
+    status = serve.request("status")
+    assert status["pid"] > 0
+
+
+def test_client_ignores_symlinked_socket(socket_dir, capsys):
+    listener = listen(os.path.join(socket_dir, "real.sock"))
+    link = os.path.join(socket_dir, "link.sock")
+    os.symlink(listener.getsockname(), link)
+    try:
+        assert serve._connect(link) is None
+        assert serve._connect(listener.getsockname()) is not None
+    finally:
+        listener.close()
+    assert "not a socket owned by" in capsys.readouterr().err
+
+
+@root_only
+def test_client_ignores_foreign_socket(socket_dir, capsys):
+    listener = listen(os.path.join(socket_dir, "foreign.sock"))
+    os.chown(listener.getsockname(), 65534, 65534)
+    try:
+        assert serve._connect(listener.getsockname()) is None
+    finally:
+        listener.close()
+    assert "not a socket owned by" in capsys.readouterr().err
+
+
+def ask_status(path: str, uid: int = None) -> bytes:
+    """ The daemon's raw reply to a status request, sent as `uid` from a forked child. """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            if uid is not None:
+                os.setgid(uid)
+                os.setuid(uid)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(path)
+            sock.sendall(b'{"op": "status"}\n')
+            sock.settimeout(10)
+            os.write(write, sock.recv(1 << 16))
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read, "rb") as f:
+        reply = f.read()
+    os.waitpid(pid, 0)
+    return reply
+
+
+@root_only
+def test_daemon_refuses_foreign_peer(daemon):
+    # open the socket up so that only the peer check stands in the way
+    os.chmod(os.path.dirname(os.path.dirname(daemon)), 0o755)
+    os.chmod(os.path.dirname(daemon), 0o711)
+    os.chmod(daemon, 0o666)
+
+    assert b'"pid"' in ask_status(daemon)
+    assert ask_status(daemon, uid=65534) == b""
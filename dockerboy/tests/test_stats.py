@@ -0,0 +1,168 @@
+import types
+import csv
+
+import pytest
+
+from dockerboy.dockwrap import stats
+from dockerboy.dockwrap.stats import (
+    COLUMNS, CgroupReader, StatsSampler, find_cgroup)
+
+from dockerboy.dockwrap.wrapper import DockerWrapper
+
+from .conftest import add_container, read_scalars
+
+
+CONTAINER_ID = "c0ffee" * 10 + "beef"
+MB = 2**20
+
+
+def write_counters(path, cpu_usec=0, throttled_usec=0, memory=0, read=0, written=0):
+    """ The stat files of a cgroup v2 directory, I/O split over two devices. """
+    (path / "cpu.stat").write_text(
+        f"usage_usec {cpu_usec}\nuser_usec {cpu_usec * 3 // 4}\n"
+        f"system_usec {cpu_usec // 4}\nnr_periods 10\nnr_throttled 1\n"
+        f"throttled_usec {throttled_usec}\n")
+    (path / "memory.current").write_text(f"{memory}\n")
+    (path / "io.stat").write_text(
+        f"8:0 rbytes={read // 2} wbytes={written} rios=1 wios=1 dbytes=0 dios=0\n"
+        f"259:0 rbytes={read - read // 2} wbytes=0 rios=1 wios=0 dbytes=0 dios=0\n")
+
+
+@pytest.fixture
+def cgroup(tmp_path):
+    """ A container's cgroup under a cgroupfs-driver root. """
+    path = tmp_path / "cgroup" / "docker" / CONTAINER_ID
+    path.mkdir(parents=True)
+    write_counters(path, memory=100 * MB)
+    return path
+
+
+@pytest.fixture
+def sampled(cgroup, monkeypatch):
+    """ A sampler holding three samples two seconds apart. """
+    clock = iter([100.0, 102.0, 104.0])
+    monkeypatch.setattr(stats, "time", types.SimpleNamespace(time=lambda: next(clock)))
+
+    sampler = StatsSampler("c", str(cgroup))
+    reader = CgroupReader(str(cgroup))
+    sampler.samples.append(reader.read())
+    # 1.5 cores, 25% throttled, 2MB/s read and 1MB/s written
+    write_counters(cgroup, cpu_usec=3_000_000, throttled_usec=500_000, memory=200 * MB,
+                   read=4 * MB, written=2 * MB)
+    sampler.samples.append(reader.read())
+    # half a core, nothing else
+    write_counters(cgroup, cpu_usec=4_000_000, throttled_usec=500_000, memory=150 * MB,
+                   read=4 * MB, written=2 * MB)
+    sampler.samples.append(reader.read())
+    reader.close()
+    return sampler
+
+
+EXPECTED = [
+    {"time": 2.0, "cpu_percent": 150.0, "memory_mb": 200.0, "io_read_mb_s": 2.0,
+     "io_write_mb_s": 1.0, "throttled_percent": 25.0},
+    {"time": 4.0, "cpu_percent": 50.0, "memory_mb": 150.0, "io_read_mb_s": 0.0,
+     "io_write_mb_s": 0.0, "throttled_percent": 0.0},
+]
+
+
+def test_reader(cgroup):
+    write_counters(cgroup, cpu_usec=8, throttled_usec=2, memory=5, read=7, written=3)
+    reader = CgroupReader(str(cgroup))
+    sample = reader.read()
+    assert sample[1:] == (8, 6, 2, 2, 5, 7, 3)
+
+    # the files stay open and are re-read in place
+    write_counters(cgroup, cpu_usec=80)
+    assert reader.read().cpu_usec == 80
+    reader.close()
+
+
+def test_missing_controllers_read_as_zero(cgroup):
+    (cgroup / "io.stat").unlink()
+    (cgroup / "cpu.stat").unlink()
+    sample = CgroupReader(str(cgroup)).read()
+    assert (sample.cpu_usec, sample.io_read_bytes, sample.memory_bytes) == (0, 0, 100 * MB)
+
+    (cgroup / "memory.current").unlink()
+    with pytest.raises(FileNotFoundError):
+        CgroupReader(str(cgroup))
+
+
+def test_rows(sampled):
+    assert sampled.rows() == EXPECTED
+
+
+def test_csv(sampled, tmp_path):
+    path = tmp_path / "stats.csv"
+    assert sampled.to_csv(str(path)) == 2
+
+    with open(path, "r", newline="") as f:
+        reader = csv.DictReader(f)
+        assert reader.fieldnames == COLUMNS
+        rows = [{key: float(value) for key, value in row.items()} for row in reader]
+    assert rows == EXPECTED
+
+
+def test_tensorboard(sampled, tmp_path):
+    path = sampled.to_tensorboard(str(tmp_path / "tb"))
+
+    scalars = read_scalars(path)
+    assert sorted(scalars) == sorted(f"stats/{column}" for column in COLUMNS[1:])
+    for column in COLUMNS[1:]:
+        assert scalars[f"stats/{column}"] == [(step, pytest.approx(row[column]))
+                                              for step, row in enumerate(EXPECTED)]
+
+
+def test_run_stops_with_the_container(cgroup):
+    sampler = StatsSampler("c", str(cgroup), interval=0.01)
+    rows = []
+
+    def on_sample(row):
+        rows.append(row)
+        if len(rows) == 2:
+            # the container stopped, its cgroup is removed
+            for path in cgroup.iterdir():
+                path.unlink()
+            cgroup.rmdir()
+
+    sampler.run(on_sample=on_sample)
+    assert len(sampler.samples) == 3
+    assert [set(row) for row in rows] == [set(COLUMNS)] * 2
+    assert rows[1]["memory_mb"] == 100.0
+
+
+def test_run_duration_and_capacity(cgroup):
+    sampler = StatsSampler("c", str(cgroup), interval=0.01, capacity=5)
+    sampler.run(duration=0.2)
+    assert len(sampler.samples) == 5
+    assert len(sampler.rows()) == 4
+
+
+def test_find_cgroup(tmp_path):
+    root = tmp_path / "cgroup"
+    assert find_cgroup(CONTAINER_ID, str(root)) is None
+
+    systemd = root / "system.slice" / f"docker-{CONTAINER_ID}.scope"
+    systemd.mkdir(parents=True)
+    assert find_cgroup(CONTAINER_ID, str(root)) == str(systemd)
+
+    # rootless docker nests it under the user's slice
+    systemd.rmdir()
+    nested = root / "user.slice" / "user-1000.slice" / "user@1000.service" / \
+        f"docker-{CONTAINER_ID}.scope"
+    nested.mkdir(parents=True)
+    assert find_cgroup(CONTAINER_ID, str(root)) == str(nested)
+
+
+def test_for_container(backend, engine, cgroup):
+    engine.add_image("img")
+    add_container(engine, "c", "img", id=CONTAINER_ID)
+    root = str(cgroup.parent.parent)
+
+    assert StatsSampler.for_container("c", root=root).cgroup_path == str(cgroup)
+
+    engine.containers[CONTAINER_ID]["State"] = "exited"
+    DockerWrapper.invalidate()
+    with pytest.raises(ValueError, match="not running"):
+        StatsSampler.for_container("c", root=root)
@@ -0,0 +1,87 @@
+""" `dboy sweep`: expanding jobs and running one container per job. """
+import json
+
+import pytest
+
+import regress
+
+from dockerboy.__main__ import main
+from dockerboy.dockwrap import labels
+from dockerboy.dockwrap.sweep import expand_grid, make_jobs, summary_table
+
+
+def test_expand_grid():
+    assert expand_grid({"lr": [1, 2], "bs": 3}) == [{"lr": 1, "bs": 3}, {"lr": 2, "bs": 3}]
+
+
+def test_placeholders():
+    jobs = make_jobs("c", ["train.py", "--lr", "{lr}", "--log-dir", "tb/{name}"],
+                     [{"lr": 0.1}, {"lr": 0.01}])
+    assert [job.name for job in jobs] == ["c-sweep-0", "c-sweep-1"]
+    assert jobs[1].cmd == ["train.py", "--lr", "0.01", "--log-dir", "tb/c-sweep-1"]
+    assert jobs[1].label == "lr=0.01"
+
+
+def test_flags_without_placeholders():
+    jobs = make_jobs("c", ["train.py"], [{"lr": 0.1, "bs": 32}])
+    assert jobs[0].cmd == ["train.py", "--lr=0.1", "--bs=32"]
+
+
+def test_literal_braces():
+    code = "d = {}; d['x'] = {'y': 1}; print(d, {lr})"
+    jobs = make_jobs("c", ["python", "-c", code], [{"lr": 0.1}])
+    assert jobs[0].cmd == ["python", "-c", "d = {}; d['x'] = {'y': 1}; print(d, 0.1)"]
+
+    # nothing to substitute: the parameters become flags, the braces stay
+    jobs = make_jobs("c", ["python", "-c", "d = {}", "{unknown}"], [{"lr": 0.1}])
+    assert jobs[0].cmd == ["python", "-c", "d = {}", "{unknown}", "--lr=0.1"]
+
+
+def test_full_commands():
+    jobs = make_jobs("c", [], ["python a.py", ["python", "b.py", 2]])
+    assert [job.cmd for job in jobs] == [["python", "a.py"], ["python", "b.py", "2"]]
+    assert jobs[0].label == "python a.py"
+
+
+@pytest.fixture
+def dboy(backend, engine, project, monkeypatch):
+    monkeypatch.setenv("DBOY_NO_DAEMON", "1")
+    (project / "shared").mkdir()
+    (project / "Dockerfile").write_text("FROM python:3.11\n")
+    with open(project / ".dboy.yaml", "w") as f:
+        json.dump({**regress.config(str(project)), "ports": []}, f)
+    engine.add_image(regress.IMAGE, {labels.PROJECT: str(project), labels.SPEC: "bench",
+                                     labels.VERSION: "0"})
+    (project / "grid.yaml").write_text("lr: [0.1, 0.01, 0.001]\n")
+    return lambda *args: main(["sweep", "-g", "grid.yaml", "-w", "2", *args], forward=False)
+
+
+def test_sweep(dboy, engine, capsys):
+    dboy("--", "python", "train.py", "--lr", "{lr}")
+    out = capsys.readouterr().out
+    assert "3/3 jobs succeeded" in out
+    # every job ran in its own container, removed afterwards
+    assert engine.containers == {}
+    assert "[bench-container-sweep-2] finished with exit code 0" in out
+
+
+def test_failed_job_fails_the_sweep(dboy, engine, capsys):
+    engine.exec_handler = lambda cmd: (b"diverged\n", 1) if "0.001" in cmd \
+        else (b"ok\n", 0)
+    with pytest.raises(SystemExit) as e:
+        dboy("--", "python", "train.py", "--lr", "{lr}")
+    assert e.value.code == 1
+
+    out = capsys.readouterr().out
+    assert "2/3 jobs succeeded" in out
+    assert "--- bench-container-sweep-2 (last lines)\ndiverged" in out
+
+
+def test_summary_table():
+    jobs = make_jobs("c", ["train.py"], [{"lr": 0.1}, {"lr": 0.01}])
+    jobs[0].returncode, jobs[0].duration = 0, 1.0
+    lines = summary_table(jobs).splitlines()
+    assert lines[0].split() == ["job", "params", "exit", "time"]
+    assert lines[2].split() == ["c-sweep-0", "lr=0.1", "0", "1.0s"]
+    assert lines[3].split() == ["c-sweep-1", "lr=0.01", "-", "-"]
+    assert lines[4] == "1/2 jobs succeeded"
@@ -0,0 +1,82 @@
+import pytest
+
+from dockerboy.dockwrap.utils import tfevents
+from dockerboy.dockwrap.utils.tfevents import (
+    EventWriter, downsample, read_records, summary_values, value_tag, tfrecord,
+    encode_scalar_event)
+
+from .conftest import read_scalars
+
+
+def test_crc32c():
+    # the check value of CRC-32C
+    assert tfevents._crc32c_py(b"123456789") == 0xE3069283
+    assert tfevents.crc32c(b"123456789") == 0xE3069283
+    native = tfevents._native_crc32c()
+    if native is not None:
+        data = bytes(range(256)) * 10
+        assert native(data) == tfevents._crc32c_py(data)
+
+
+def test_round_trip(tmp_path):
+    with EventWriter(str(tmp_path)) as writer:
+        for step in range(5):
+            writer.add_scalar("loss", 1 / (step + 1), step, wall_time=100.0 + step)
+            writer.add_scalar("lr", 0.5, step)
+
+    records = list(read_records(writer.path))
+    # the file version event comes first and has no summary
+    assert summary_values(records[0]) is None
+    assert summary_values(records[1])[:2] == (100.0, 0)
+    assert value_tag(summary_values(records[1])[2][0]) == ("loss", True)
+
+    scalars = read_scalars(writer.path)
+    assert [step for step, _ in scalars["loss"]] == list(range(5))
+    assert [value for _, value in scalars["loss"]] == pytest.approx([1, 1 / 2, 1 / 3, 1 / 4, 1 / 5])
+    assert scalars["lr"] == [(step, 0.5) for step in range(5)]
+
+
+def test_partial_record_is_skipped(tmp_path):
+    path = tmp_path / "events"
+    complete = tfrecord(encode_scalar_event("a", 1.0, 1, 0.0))
+    path.write_bytes(complete + tfrecord(encode_scalar_event("a", 2.0, 2, 0.0))[:-3])
+    assert len(list(read_records(str(path)))) == 1
+
+
+def test_corrupt_length(tmp_path):
+    path = tmp_path / "events"
+    path.write_bytes(b"\xff" * 16)
+    with pytest.raises(ValueError, match="corrupt record length"):
+        list(read_records(str(path)))
+
+
+def test_downsample(tmp_path):
+    with EventWriter(str(tmp_path / "src")) as writer:
+        for step in range(1000):
+            writer.add_scalar("loss", step, step)
+        writer.add_scalar("final", 1.0, 999)
+
+    dst = str(tmp_path / "events.small")
+    read, written = downsample(writer.path, dst, max_scalars=10)
+    assert read == 1001
+
+    scalars = read_scalars(dst)
+    steps = [step for step, _ in scalars["loss"]]
+    assert len(steps) <= 11
+    assert written == len(steps) + 1
+    # evenly spaced, first and last kept
+    assert steps[0] == 0 and steps[-1] == 999
+    assert steps[1] - steps[0] == steps[2] - steps[1]
+    assert scalars["final"] == [(999, 1.0)]
+    # the version event is copied as it is
+    assert summary_values(next(read_records(dst))) is None
+
+
+def test_downsample_small_file_unchanged(tmp_path):
+    with EventWriter(str(tmp_path / "src")) as writer:
+        for step in range(5):
+            writer.add_scalar("loss", step, step)
+
+    dst = str(tmp_path / "events.small")
+    assert downsample(writer.path, dst) == (5, 5)
+    assert read_scalars(dst) == read_scalars(writer.path)
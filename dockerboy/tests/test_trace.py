@@ -0,0 +1,38 @@
+""" Spans around docker calls, and what counts as a failed one. """
+import pytest
+
+from dockerboy.dockwrap import trace
+from dockerboy.dockwrap.backends import EngineError
+
+
+@pytest.mark.parametrize("status, http, failed", [
+    (0, False, False), (1, False, True), (200, False, True), (255, False, True),
+    (200, True, False), (304, True, False), (404, True, True), (500, True, True),
+    (None, False, False), ("error", False, True),
+])
+def test_failed(status, http, failed):
+    span = trace.Span("op")
+    span.status, span.http = status, http
+    assert span.failed == failed
+
+
+def test_raising_block_fails():
+    with pytest.raises(ValueError):
+        with trace.span("op") as span:
+            raise ValueError
+    assert span.status == "error" and span.failed
+
+
+def test_engine_requests_are_http(backend, engine):
+    recorder = trace.add_hook(trace.Recorder())
+    try:
+        backend.ps()
+        with pytest.raises(EngineError):
+            backend.request("GET", "/containers/missing/json")
+    finally:
+        trace.remove_hook(recorder)
+
+    requests = [s for s in recorder.spans if s.name.startswith("engine GET")]
+    assert [(s.status, s.http, s.failed) for s in requests] == \
+        [(200, True, False), (404, True, True)]
+
@@ -1,3 +1,4 @@
 pip install tensorflow-datasets
 # pip install gymnasium[atari]
-python -c "import tensorflow_datasets as tfds; tfds.load('cifar100')"
\ No newline at end of file
+# datasets are prepared once on the host with `dboy data prepare cifar100`
+# and mounted read-only into every container, not baked into the image